@@ -0,0 +1,241 @@
+"""
+Cost-based admission control for the calc API.
+
+Every request is priced from the parsed expression before it is run: one
+unit per AST node, plus the estimated size of exact integer powers (9**9**9
+is priced by the digits it would produce), plus a per-row share for batch
+work. Each client has a token bucket refilled at CALCIFY_RATE_LIMIT units
+a second up to CALCIFY_RATE_BURST. Work that fits within
+CALCIFY_ADMISSION_WAIT seconds of refill is queued (the request sleeps);
+anything further over budget is refused with Rejected, which the routes
+turn into 429 with Retry-After. A request costing more than a full bucket
+could never run and fails with TooExpensive instead.
+
+Buckets live in memory by default. CALCIFY_ADMISSION_BACKEND=sqlite keeps
+them in a SQLite file (CALCIFY_ADMISSION_PATH) so several server
+processes on one host share the same budgets.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import engine
+import executor
+import metrics
+from engine import BinOp, Call, Num, UnaryOp
+
+RATE = float(os.environ.get("CALCIFY_RATE_LIMIT", 2000))    # units/second, 0 disables
+BURST = float(os.environ.get("CALCIFY_RATE_BURST", 20000))
+MAX_WAIT = float(os.environ.get("CALCIFY_ADMISSION_WAIT", 0.25))
+BACKEND = os.environ.get("CALCIFY_ADMISSION_BACKEND", "memory")  # "memory" or "sqlite"
+# Clients are told apart by remote address, or by this header when set,
+# e.g. an API key header added by a proxy
+CLIENT_HEADER = os.environ.get("CALCIFY_CLIENT_HEADER")
+ADMISSION_PATH = os.environ.get(
+    "CALCIFY_ADMISSION_PATH", os.path.join(os.path.expanduser("~"), ".calcify", "admission.db"))
+MAX_CLIENTS = 10000
+
+# An exact power costs one unit per this many bits of result
+POWER_BITS_PER_UNIT = 1000
+# Vectorized batch rows are much cheaper than separate requests
+ROW_COST = 0.001
+
+ADMISSIONS = metrics.counter("admission_total", "Admission decisions", ["outcome"])
+
+
+class Rejected(executor.ExecutorError):
+    """The client is over budget; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__("Rate limit exceeded")
+        self.retry_after = retry_after
+
+
+class TooExpensive(executor.ExecutorError):
+    """The request costs more than a client's whole budget."""
+
+
+# --- Cost estimation ---
+def estimate(text, rows=1):
+    """Cost of evaluating `text` over `rows` bindings; unparseable input costs 1."""
+    try:
+        tree = engine.compile_expression(text).tree
+    except (engine.ExpressionError, TypeError, AttributeError):
+        return 1.0
+    try:
+        nodes, powers = _structure(tree)
+    except RecursionError:
+        return math.inf
+    return nodes + powers + nodes * ROW_COST * max(rows - 1, 0)
+
+
+def estimate_many(texts, rows=1):
+    return sum(estimate(text, rows) for text in texts)
+
+
+def _structure(tree):
+    # (node count, cost of exact integer powers)
+    nodes = 0
+    powers = 0.0
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        if isinstance(node, UnaryOp):
+            stack.append(node.operand)
+        elif isinstance(node, BinOp):
+            stack.extend((node.left, node.right))
+            if node.op == "**":
+                bits = _bits(node)
+                if bits is not None:
+                    powers += bits / POWER_BITS_PER_UNIT
+        elif isinstance(node, Call):
+            stack.extend(node.args)
+    return nodes, powers
+
+
+def _bits(node):
+    """Rough bit length of a constant subtree's value, or None if it has names."""
+    if isinstance(node, Num):
+        return math.log2(abs(engine.float_literal(node.text)) + 2)
+    if isinstance(node, UnaryOp):
+        return _bits(node.operand)
+    if not isinstance(node, BinOp):
+        return None
+    left, right = _bits(node.left), _bits(node.right)
+    if left is None or right is None:
+        return None
+    if node.op in ("+", "-"):
+        return max(left, right) + 1
+    if node.op == "*":
+        return left + right
+    if node.op == "**":
+        # |base|**exp has about log2|base| * exp bits, and exp is about 2**right
+        return left * 2.0 ** min(right, 1000)
+    return left
+
+
+# --- Token buckets ---
+def _take(tokens, updated, now, cost, rate, burst, max_wait):
+    """
+    Refill a bucket and try to take `cost` from it. Returns (tokens left,
+    admitted, wait): the wait before running when admitted (the bucket goes
+    into debt for it), otherwise how long until the cost would fit.
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    wait = max(0.0, (cost - tokens) / rate)
+    if wait > max_wait:
+        return tokens, False, wait - max_wait
+    return tokens - cost, True, wait
+
+
+class MemoryBackend:
+    """Buckets for this process only."""
+
+    def __init__(self, max_clients=MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst, max_wait):
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, admitted, wait = _take(tokens, updated, now, cost, rate, burst, max_wait)
+            # Evicting the longest idle client only hands it a full bucket early
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return admitted, wait
+
+
+class SQLiteBackend:
+    """Buckets in a SQLite file shared by every process that opens it."""
+
+    # Full buckets are deleted every this many takes; a missing row is a full bucket
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path=None):
+        self.path = path or ADMISSION_PATH
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Autocommit, so take() can hold an explicit write transaction
+        self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Losing the last few updates in a crash only refills some buckets early
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets"
+                         " (client TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        self._lock = threading.Lock()
+        self._takes = 0
+
+    def take(self, key, cost, rate, burst, max_wait):
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so the read-modify-write
+            # is atomic across processes
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._db.execute("SELECT tokens, updated FROM buckets WHERE client = ?",
+                                       (key,)).fetchone()
+                tokens, updated = row or (burst, now)
+                tokens, admitted, wait = _take(tokens, updated, now, cost, rate, burst, max_wait)
+                self._db.execute("INSERT OR REPLACE INTO buckets (client, tokens, updated)"
+                                 " VALUES (?, ?, ?)", (key, tokens, now))
+                self._takes += 1
+                if self._takes % self.PRUNE_EVERY == 0:
+                    # Long enough idle to have refilled from the deepest debt
+                    self._db.execute("DELETE FROM buckets WHERE updated < ?",
+                                     (now - burst / rate - max_wait,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return admitted, wait
+
+
+class Admission:
+    def __init__(self, rate=RATE, burst=BURST, max_wait=MAX_WAIT, backend=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.backend = backend or MemoryBackend()
+
+    def admit(self, client, cost):
+        """
+        Charge `cost` to `client`, sleeping first if it is queued. Raises
+        Rejected when the client is too far over budget, TooExpensive when
+        the cost exceeds the burst size.
+        """
+        wait = self.charge(client, cost)
+        if wait > 0:
+            time.sleep(wait)
+
+    def charge(self, client, cost):
+        """
+        Like admit, but returns the seconds to wait before running instead
+        of sleeping, for callers that can't block (the asyncio server).
+        """
+        if self.rate <= 0:
+            return 0.0
+        if cost > self.burst:
+            ADMISSIONS.inc("too_expensive")
+            raise TooExpensive("Expression is too expensive")
+        admitted, wait = self.backend.take(client, cost, self.rate, self.burst, self.max_wait)
+        if not admitted:
+            ADMISSIONS.inc("rejected")
+            raise Rejected(wait)
+        ADMISSIONS.inc("queued" if wait > 0 else "admitted")
+        return wait
+
+
+def create():
+    """The Admission configured by CALCIFY_ADMISSION_BACKEND."""
+    if BACKEND == "sqlite":
+        return Admission(backend=SQLiteBackend())
+    return Admission()
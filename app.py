@@ -1,12 +1,116 @@
-from flask import Flask, render_template, jsonify, request
-import requests
+from flask import Flask, Response, render_template, jsonify, request, session, stream_with_context
+
+import csv
+import io
 import math
+import os
+import threading
+import time
+import uuid
+
+import admission
+import engine
+import environment
+import executor
+import history
+import metrics
+import numeric
+import rates
+import sampler
+import solver
+import stream
+import units
+import wire
 
 app = Flask(__name__)
+# Signs the session cookie, which only carries an id (see SESSIONS)
+app.secret_key = os.environ.get("CALCIFY_SECRET_KEY") or os.urandom(32)
 
 # --- Currency API ---
-CURRENCY_API_URL = "https://api.exchangerate-api.com/v4/latest/USD"
-CURRENCY_CACHE = {}
+# TTL and upstream URL are configurable, see rates.py
+RATE_CACHE = rates.RateCache()
+# Currency factors are rebased whenever the rate cache refreshes
+units.registry.track(RATE_CACHE)
+
+# --- Evaluation ---
+# Expressions run in a warm pool of worker processes with a per-job time
+# budget (CALCIFY_EXECUTOR=inline runs them in the request thread instead).
+EXECUTOR = executor.create()
+# Batches at least this long are split across the pool
+BATCH_CHUNK_ROWS = 10000
+
+# Every single calculation is recorded; repeats are answered from history.
+# Opened on first use, since spawned executor workers import this module too.
+_history = None
+_history_lock = threading.Lock()
+
+def _history_store():
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = history.HistoryStore()
+    return _history
+
+# Per-client budgets, charged by estimated cost before work is queued
+# (see admission.py, which also says how clients are told apart)
+ADMISSION = admission.create()
+CLIENT_HEADER = admission.CLIENT_HEADER
+
+def _client_id():
+    if CLIENT_HEADER:
+        return request.headers.get(CLIENT_HEADER) or request.remote_addr or ""
+    return request.remote_addr or ""
+
+def _admit(cost):
+    ADMISSION.admit(_client_id(), cost)
+
+# User definitions (`rate = 0.07`, `f(x) = x^2 + 1`) live server-side, one
+# environment per session, held in this process
+SESSIONS = environment.Sessions()
+
+def _session_id(create=False):
+    session_id = session.get('id')
+    if session_id is None and create:
+        session_id = session['id'] = uuid.uuid4().hex
+    return session_id
+
+def _session_environment(create=False):
+    session_id = _session_id(create)
+    if session_id is None:
+        return None
+    return SESSIONS.get(session_id, create)
+
+def _executor_error(e):
+    if isinstance(e, admission.Rejected):
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = str(max(1, math.ceil(e.retry_after)))
+        return response, 429
+    if isinstance(e, executor.QueueFull):
+        response = jsonify({"error": str(e)})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({"error": str(e)}), 400
+
+# --- Instrumentation ---
+REQUEST_TIME = metrics.histogram("http_request_seconds", "Request latency by route", ["route"])
+CALC_RESULTS = metrics.counter("calc_requests_total", "Calculations by outcome", ["outcome"])
+metrics.gauge("calc_cache_hits", "Expression cache hits", lambda: engine.cache_stats()["hits"])
+metrics.gauge("calc_cache_misses", "Expression cache misses", lambda: engine.cache_stats()["misses"])
+metrics.gauge("calc_cache_size", "Expressions in the cache", lambda: engine.cache_stats()["size"])
+metrics.gauge("executor_jobs", "Jobs run by the executor", lambda: EXECUTOR.stats.jobs)
+metrics.gauge("executor_timeouts", "Jobs cancelled for running too long", lambda: EXECUTOR.stats.timeouts)
+metrics.gauge("executor_rejected", "Jobs rejected with a full queue", lambda: EXECUTOR.stats.rejected)
+metrics.gauge("currency_upstream_fetches", "Upstream rate fetches", lambda: RATE_CACHE.fetch_count)
+
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/slowest')
+def get_slowest():
+    # Populated when CALCIFY_PROFILE_SLOWEST=N is set
+    return jsonify(metrics.profiler.snapshot())
 
 @app.route('/')
 def index():
@@ -14,37 +118,413 @@ def index():
 
 @app.route('/api/currency')
 def get_currency():
-    global CURRENCY_CACHE
-    # Simple caching strategy: If we have data, use it. In prod, check timestamp.
-    # For this demo, we'll fetch every time to be "real-time" or cache for session.
-    try:
-        if not CURRENCY_CACHE:
-             print("Fetching currency data...")
-             response = requests.get(CURRENCY_API_URL)
-             CURRENCY_CACHE = response.json()
-        return jsonify(CURRENCY_CACHE)
+    # Served from the shared rate cache: stale entries are returned while a
+    # single background refresh runs, so this never blocks once warm.
+    with REQUEST_TIME.time("currency"):
+        return _get_currency()
+
+def _get_currency():
+    # Each snapshot is encoded once per format; an unchanged table costs a 304
+    base = request.args.get('base', 'USD').upper()
+    if not rates.valid_base(base):
+        return jsonify({"error": "Invalid base currency"}), 400
+    try:
+        snapshot = RATE_CACHE.get(base)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    fmt = wire.negotiate(request.accept_mimetypes)
+    body, etag = snapshot.encoded(fmt, wire.dumps)
+    headers = {'ETag': etag, 'Vary': 'Accept', 'Age': str(int(snapshot.age)),
+               'Cache-Control': f'max-age={max(0, int(RATE_CACHE.ttl - snapshot.age))}'}
+    if request.if_none_match.contains_weak(etag.strip('"')):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype=fmt, headers=headers)
+
+@app.route('/api/units')
+def get_units():
+    return jsonify(units.registry.to_dict())
+
+@app.route('/api/convert', methods=['POST'])
+def convert_values():
+    """
+    Convert many values in one call. Either JSON
+    {"category": "length", "from": "km", "to": "mi", "values": [...]}
+    or a text/csv body with category/from/to/column in the query string
+    (column is a header name or a 0-based index). Unparseable cells come
+    back as null.
+    """
+    if request.mimetype == 'text/csv':
+        params = request.args
+        values = _csv_column(request.get_data(as_text=True), params.get('column', '0'))
+    else:
+        params = request.json
+        if 'csv' in params:
+            values = _csv_column(params['csv'], str(params.get('column', '0')))
+        else:
+            values = params.get('values', [])
+    name = params.get('category', '')
+    category = units.registry.get(name)
+    if category is None and name.lower() == 'currency':
+        # Rates are fetched on first use; the refresh rebuilds the category
+        try:
+            RATE_CACHE.get('USD')
+        except Exception as e:
+            return jsonify({"error": f"Currency rates unavailable: {e}"}), 503
+        category = units.registry.get(name)
+    if category is None:
+        return jsonify({"error": "Unknown category"}), 400
+    try:
+        result = category.convert_many(values, params.get('from'), params.get('to'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"result": result})
+
+def _encode(payload, floats=None):
+    """
+    payload in the format the client asked for. `floats` is the same result
+    as a float64 array (or a list with None for failures); when given it is
+    also offered as raw application/octet-stream.
+    """
+    fmt = wire.negotiate(request.accept_mimetypes, floats is not None)
+    if fmt == wire.JSON:
+        response = jsonify(payload)
+    elif fmt == wire.FLOAT64:
+        response = Response(wire.float64(floats), mimetype=fmt)
+    else:
+        response = Response(wire.dumps(payload, fmt), mimetype=fmt)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+def _float_result(result, mode):
+    # Only float-mode results have a lossless float64 encoding
+    return [result] if mode == 'float' and isinstance(result, (int, float)) else None
+
+def _csv_column(text, column):
+    rows = csv.reader(io.StringIO(text))
+    if column.isdigit():
+        index = int(column)
+    else:
+        header = next(rows, [])
+        index = header.index(column) if column in header else -1
+    return [row[index] if 0 <= index < len(row) else None for row in rows]
 
 @app.route('/api/calc', methods=['POST'])
 def calculate():
     """
-    Optional: Server-side calculation if needed.
-    Currently, we will do most logic in JS for speed.
-    This is just a placeholder for complex operations.
+    Server-side calculation.
+    Expressions are parsed and validated against engine.ALLOWED_NAMES, then
+    compiled once and cached, so repeated formulas skip the parse step.
+
+    Optional "mode" ("float", "decimal" or "rational") and "precision" pick
+    the numeric backend; decimal and rational results come back as strings.
+    Results are recorded in the history store, and a repeated calculation is
+    answered from there without being evaluated again.
+
+    An expression like "rate = 0.07" or "f(x) = x^2 + 1" defines a name for
+    the rest of the session instead, and returns {"defined": name,
+    "definitions": [...]}. Results that use definitions are cached in the
+    session rather than the shared history.
+
+    Bulk mode: {"expressions": [...], "vars": {...}} evaluates the whole list
+    as one DAG so shared subexpressions are computed once, and returns
+    {"result": [...], "error": [...]} in input order.
+
+    Requests are charged to the client's budget by estimated cost, and get
+    429 with Retry-After once it is spent.
+
+    Responses are JSON unless the Accept header asks for application/msgpack
+    (same structure) or, for float results, application/octet-stream:
+    little-endian float64, one per result, NaN for errors.
     """
     data = request.json
-    expression = data.get('expression', '')
-    try:
-        # VERY UNSAFE in production to eval(), but fine for this local demo.
-        # We will restrict the namespace for safety.
-        allowed_names = {"math": math, "sin": math.sin, "cos": math.cos,
-                         "tan": math.tan, "log": math.log10, "ln": math.log,
-                         "sqrt": math.sqrt, "pi": math.pi, "e": math.e}
-        result = eval(expression, {"__builtins__": None}, allowed_names)
-        return jsonify({"result": result})
+    with REQUEST_TIME.time("calc"):
+        if 'expressions' in data:
+            return _calculate_bulk(data)
+        expression = data.get('expression', '')
+        mode = data.get('mode', 'float')
+        if environment.is_definition(expression):
+            return _define(expression)
+        with metrics.tracing(str(expression)) as trace:
+            try:
+                precision = int(data.get('precision', numeric.DEFAULT_PRECISION))
+                env = _session_environment()
+                if env is not None and env.uses(expression):
+                    result = numeric.check_result(_evaluate_in_session(env, expression, mode, precision))
+                    CALC_RESULTS.inc("ok")
+                    return _encode({"result": numeric.to_json(result)}, _float_result(result, mode))
+                # Charged before the history lookup, so recalled answers count too
+                _admit(admission.estimate(expression))
+                start = time.perf_counter()
+                result = (_history_store().recall(expression, mode, precision)
+                          if isinstance(expression, str) else None)
+                trace.add("history", time.perf_counter() - start)
+                if result is not None:
+                    CALC_RESULTS.inc("history")
+                    # Still recorded, so it shows up in this session's history
+                    _history_store().append(expression, result, mode, precision, _session_id(create=True))
+                    return _encode({"result": numeric.to_json(result)}, _float_result(result, mode))
+                result = numeric.check_result(
+                    EXECUTOR.run(numeric.evaluate, expression, None, mode, precision))
+                start = time.perf_counter()
+                response = _encode({"result": numeric.to_json(result)}, _float_result(result, mode))
+                trace.add("serialize", time.perf_counter() - start)
+                _history_store().append(expression, result, mode, precision, _session_id(create=True))
+            except executor.ExecutorError as e:
+                CALC_RESULTS.inc("error")
+                return _executor_error(e)
+            except Exception as e:
+                CALC_RESULTS.inc("error")
+                return jsonify({"error": "Invalid Expression"}), 400
+        CALC_RESULTS.inc("ok")
+        return response
+
+def _define(text):
+    env = _session_environment(create=True)
+    try:
+        _admit(admission.estimate(environment.parse_definition(text)[2].text))
+        # Constants are evaluated in a worker, under its time and size limits
+        EXECUTOR.run(environment.define_in, env.definitions(), text)
+        definition = env.define(text, check=False)
+    except executor.ExecutorError as e:
+        return _executor_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e) or "Invalid Definition"}), 400
+    return jsonify({"defined": definition.name, "definitions": env.definitions()})
+
+def _evaluate_in_session(env, expression, mode, precision):
+    result = env.lookup(expression, mode, precision)
+    if result is None:
+        # Workers get the definition texts and keep their own compiled copy
+        definitions, version = env.snapshot()
+        _admit(admission.estimate(expression))
+        result = EXECUTOR.run(environment.evaluate_in, definitions, expression, None, mode, precision)
+        env.remember(expression, mode, precision, result, version)
+    return result
+
+def _calculate_bulk(data):
+    expressions = data['expressions']
+    if not isinstance(expressions, list):
+        return jsonify({"error": "Invalid Expression"}), 400
+    if not all(isinstance(text, str) for text in expressions):
+        return jsonify({"error": "Expressions must be strings"}), 400
+    # Entries fail on their own (see engine.evaluate_many); only the whole
+    # request failing to run is an error response
+    with metrics.tracing(f"<bulk of {len(expressions)}>"):
+        try:
+            _admit(admission.estimate_many(expressions))
+            env = _session_environment()
+            if env is not None and len(env):
+                values, errors = EXECUTOR.run(environment.evaluate_many_in, env.definitions(),
+                                              expressions, data.get('vars'))
+            else:
+                values, errors = EXECUTOR.run(engine.evaluate_many, expressions, data.get('vars'))
+            return _encode({"result": values, "error": errors}, values)
+        except executor.ExecutorError as e:
+            return _executor_error(e)
+        except Exception as e:
+            return jsonify({"error": "Invalid Expression"}), 400
+
+@app.route('/api/calc/batch', methods=['POST'])
+def calculate_batch():
+    """
+    Evaluate one expression over many bindings, e.g.
+    {"expression": "sin(x)*y + ln(z)", "columns": {"x": [...], "y": [...], "z": [...]}}.
+    Returns {"result": [...], "error": [...]} with null results for failed rows,
+    or with Accept: application/octet-stream one little-endian float64 per
+    row, NaN where it failed.
+    """
+    try:
+        expression, columns = _batch_request(request.get_json(silent=True))
+        _admit(admission.estimate(expression, _column_rows(columns)))
+    except executor.ExecutorError as e:
+        return _executor_error(e)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if wire.negotiate(request.accept_mimetypes, engine.np is not None) == wire.FLOAT64:
+        return _calculate_batch_array(expression, columns)
+    try:
+        chunks = EXECUTOR.map(engine.evaluate_batch,
+                              [(expression, part) for part in _split_columns(columns)])
+    except executor.ExecutorError as e:
+        return _executor_error(e)
+    except Exception as e:
+        return jsonify({"error": "Invalid Expression"}), 400
+    values = [v for chunk_values, _ in chunks for v in chunk_values]
+    errors = [e for _, chunk_errors in chunks for e in chunk_errors]
+    return _encode({"result": values, "error": errors})
+
+def _calculate_batch_array(expression, columns):
+    # Workers hand back float64 buffers that go out without per-value formatting
+    try:
+        chunks = EXECUTOR.map(engine.evaluate_batch_array,
+                              [(expression, part) for part in _split_columns(columns)])
+    except executor.ExecutorError as e:
+        return _executor_error(e)
     except Exception as e:
         return jsonify({"error": "Invalid Expression"}), 400
+    result = chunks[0] if len(chunks) == 1 else engine.np.concatenate(chunks)
+    response = Response(wire.float64(result), mimetype=wire.FLOAT64)
+    response.headers['Vary'] = 'Accept'
+    return response
+
+def _batch_request(data):
+    # The body's shape is checked before anything indexes into it
+    if not isinstance(data, dict):
+        raise ValueError("Expected a JSON object")
+    columns = data.get('columns') or {}
+    if not isinstance(columns, dict) or not all(isinstance(c, list) for c in columns.values()):
+        raise ValueError("Columns must map names to lists")
+    if len({len(c) for c in columns.values()}) > 1:
+        raise ValueError("Columns must all have the same length")
+    return data.get('expression', ''), columns
+
+def _column_rows(columns):
+    return max((len(c) for c in columns.values()), default=0)
+
+def _split_columns(columns):
+    # One chunk per worker for large batches, so they use every core
+    rows = _column_rows(columns)
+    parts = min(EXECUTOR.size, -(-rows // BATCH_CHUNK_ROWS)) or 1
+    step = -(-rows // parts) or 1
+    if parts == 1:
+        return [columns]
+    return [{name: col[i:i + step] for name, col in columns.items()} for i in range(0, rows, step)]
+
+@app.route('/api/calc/stream', methods=['POST'])
+def calculate_stream():
+    """
+    Evaluate a newline-delimited upload of expressions (or {id, expression,
+    vars} records) and stream NDJSON results back while it is still arriving.
+    The body is read incrementally from request.stream, never buffered.
+    """
+    client = _client_id()
+
+    def evaluate(expression, variables):
+        # Over budget, a record fails on its own and the stream carries on
+        ADMISSION.admit(client, admission.estimate(expression))
+        return EXECUTOR.run(engine.evaluate, expression, variables)
+
+    body = stream.evaluate_stream(request.stream, evaluate)
+    return Response(stream_with_context(body), mimetype='application/x-ndjson')
+
+@app.route('/api/sample', methods=['GET', 'POST'])
+def sample_function():
+    """
+    Sample an expression in x for plotting, e.g.
+    ?expression=sin(x)/x&min=-10&max=10&n=1000 (or the same as JSON).
+    Optional "derivative" (0-3) samples the symbolic derivative instead, and
+    "adaptive" (default on) adds points where the curve bends, up to
+    "max_points". The body is little-endian float64: every x, then every y,
+    with NaN where f is undefined. X-Sample-Count gives the number of points
+    and X-Expression the expression that was sampled.
+    """
+    params = request.get_json(silent=True) or request.args
+    try:
+        lo = float(params.get('min', -10))
+        hi = float(params.get('max', 10))
+        n = int(params.get('n', 1000))
+        order = int(params.get('derivative', 0))
+        max_points = int(params.get('max_points', 0)) or None
+        adaptive = str(params.get('adaptive', '1')).lower() not in ('0', 'false')
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid sampling parameters"}), 400
+    if not (2 <= n <= sampler.MAX_POINTS and lo < hi and hi - lo < float('inf')):
+        return jsonify({"error": "Invalid sampling range"}), 400
+    try:
+        _admit(admission.estimate(params.get('expression', ''), max_points or (4 * n if adaptive else n)))
+        payload, count, sampled = EXECUTOR.run(sampler.sample_bytes, params.get('expression', ''),
+                                               lo, hi, n, order, adaptive, max_points)
+    except executor.ExecutorError as e:
+        return _executor_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e) or "Invalid Expression"}), 400
+    return Response(payload, mimetype='application/octet-stream',
+                    headers={'X-Sample-Count': str(count), 'X-Expression': sampled})
+
+@app.route('/api/solve', methods=['POST'])
+def solve_equations():
+    """
+    Root finding over a batch of parameter sets, e.g.
+    {"equation": "x^3 - a*x = 1", "params": {"a": [1, 2, 3]}}, or a system:
+    {"equations": ["x^2 + y^2 = r^2", "y = k*x"], "unknowns": ["x", "y"],
+     "params": {"r": [...], "k": [...]}, "guess": {"x": 1, "y": 1}}.
+    A "bracket": [lo, hi] (one unknown only) switches to safeguarded Newton
+    inside it. Returns {"solution": {unknown: [...]}, "converged": [...],
+    "iterations": n}, with null for rows that didn't converge.
+    """
+    data = request.get_json(silent=True) or {}
+    equations = data.get('equations') or data.get('equation', '')
+    try:
+        bracket = data.get('bracket')
+        if bracket is not None:
+            bracket = (float(bracket[0]), float(bracket[1]))
+        max_iter = min(int(data.get('max_iter') or 0), 1000) or None
+        params = data.get('params') or {}
+        rows = max((len(v) for v in params.values() if isinstance(v, list)), default=1)
+        _admit(admission.estimate_many(equations if isinstance(equations, list) else [equations], rows))
+        solutions, converged, iterations = solver.solve(
+            equations, data.get('unknowns', ['x']), data.get('params'), data.get('guess'), bracket,
+            float(data.get('tol', solver.TOLERANCE)), max_iter,
+            run=EXECUTOR.run, run_many=EXECUTOR.map)
+    except executor.ExecutorError as e:
+        return _executor_error(e)
+    except Exception as e:
+        return jsonify({"error": str(e) or "Invalid Expression"}), 400
+    failed = ~converged
+    result = {}
+    for name, values in solutions.items():
+        values = values.tolist()
+        for i in failed.nonzero()[0].tolist():
+            values[i] = None
+        result[name] = values
+    return jsonify({"solution": result, "converged": converged.tolist(), "iterations": iterations})
+
+@app.route('/api/history')
+def get_history():
+    """
+    This session's recent calculations, newest first. ?q=text searches
+    (substring, or prefix with &prefix=1); page with &before=<last id seen>.
+    """
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+        before = request.args.get('before', type=int)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    query = request.args.get('q', '')
+    prefix = request.args.get('prefix') in ('1', 'true')
+    session_id = _session_id()
+    if session_id is None:
+        return jsonify([])
+    return jsonify(_history_store().search(query, prefix, limit, before, session_id))
+
+@app.route('/api/definitions', methods=['GET', 'DELETE'])
+def definitions():
+    """This session's definitions; DELETE removes them all."""
+    env = _session_environment()
+    if env is None:
+        return jsonify({"definitions": []})
+    if request.method == 'DELETE':
+        env.clear()
+    return jsonify({"definitions": env.definitions()})
+
+@app.route('/api/definitions/<name>', methods=['DELETE'])
+def delete_definition(name):
+    env = _session_environment()
+    try:
+        if env is None:
+            raise KeyError(name)
+        env.remove(name)
+    except KeyError:
+        return jsonify({"error": f"{name!r} is not defined"}), 404
+    except engine.ExpressionError as e:
+        return jsonify({"error": str(e)}), 409
+    return jsonify({"definitions": env.definitions()})
+
+@app.route('/api/calc/stats')
+def calc_stats():
+    # In process mode each worker keeps its own expression cache; these are
+    # the server process's numbers.
+    return jsonify(dict(engine.cache_stats(), executor=EXECUTOR.metrics()))
 
 if __name__ == '__main__':
     app.run(debug=True)
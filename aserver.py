@@ -0,0 +1,253 @@
+"""
+Asyncio serving mode for the calculation API.
+
+Runs alongside the Flask app (app.py) and serves /api/calc and
+/api/currency from a single event loop with HTTP/1.1 keep-alive, so one
+process can hold thousands of idle client connections. Identical requests
+that arrive while one is already in flight share its result instead of
+doing the work again, though each is still charged to its client's budget
+(see admission.py) and gets 429 once it is spent. Evaluation and currency
+fetches run off the loop.
+
+    python aserver.py --port 8000
+"""
+import argparse
+import asyncio
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+
+import admission
+import engine
+import executor
+import numeric
+import rates
+
+MAX_BODY = 1 << 20          # Largest accepted request body, in bytes
+KEEP_ALIVE_TIMEOUT = 75     # Seconds an idle connection is kept open
+BACKLOG = 4096
+
+
+class Coalescer:
+    """Share one in-flight task between identical concurrent requests."""
+
+    def __init__(self):
+        self._inflight = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def run(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            self.started += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # A client that goes away mustn't cancel the work others wait on
+        return await asyncio.shield(task)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None, retry_after=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class CalcServer:
+    def __init__(self, evaluator=None, rate_cache=None, blocking_threads=64, admission_control=None):
+        self.executor = evaluator or executor.create()
+        self.rate_cache = rate_cache or rates.RateCache()
+        self.admission = admission_control or admission.create()
+        self.coalescer = Coalescer()
+        # Waiting on the process pool or upstream blocks a thread, never the loop
+        self._threads = ThreadPoolExecutor(max_workers=blocking_threads)
+        self.routes = {
+            ("POST", "/api/calc"): self.calculate,
+            ("GET", "/api/currency"): self.get_currency,
+        }
+
+    async def offload(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._threads, func, *args)
+
+    async def admit(self, client, cost):
+        # Queued work sleeps on the loop rather than in a thread
+        try:
+            wait = self.admission.charge(client, cost)
+        except admission.Rejected as e:
+            raise HTTPError(HTTPStatus.TOO_MANY_REQUESTS, str(e), max(1, math.ceil(e.retry_after)))
+        except admission.TooExpensive as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # --- Routes ---
+    async def calculate(self, query, body, client):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid JSON")
+        if 'expressions' in data:
+            expressions = data['expressions']
+            if not isinstance(expressions, list):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Expression")
+            if not all(isinstance(text, str) for text in expressions):
+                raise HTTPError(HTTPStatus.BAD_REQUEST, "Expressions must be strings")
+            await self.admit(client, admission.estimate_many(expressions))
+            key = ("bulk", tuple(engine.normalize(text) for text in expressions),
+                   json.dumps(data.get('vars'), sort_keys=True))
+            work = lambda: self.offload(self.executor.run, engine.evaluate_many,
+                                        expressions, data.get('vars'))
+            values, errors = await self._evaluate(key, work)
+            return HTTPStatus.OK, {"result": values, "error": errors}
+        expression = str(data.get('expression', ''))
+        mode = data.get('mode', 'float')
+        try:
+            precision = int(data.get('precision', numeric.DEFAULT_PRECISION))
+        except (TypeError, ValueError, OverflowError):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid precision")
+        await self.admit(client, admission.estimate(expression))
+        key = ("calc", engine.normalize(expression), str(mode), precision)
+        work = lambda: self.offload(self._calculate, expression, mode, precision)
+        return HTTPStatus.OK, {"result": await self._evaluate(key, work)}
+
+    def _calculate(self, expression, mode, precision):
+        # The same checks as app.py, so complex and non-finite results are a 400
+        result = self.executor.run(numeric.evaluate, expression, None, mode, precision)
+        return numeric.to_json(numeric.check_result(result))
+
+    async def _evaluate(self, key, work):
+        try:
+            return await self.coalescer.run(key, work)
+        except executor.QueueFull as e:
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE, str(e))
+        except executor.ExecutorError as e:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, str(e))
+        except Exception:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid Expression")
+
+    async def get_currency(self, query, body, client):
+        base = query.get('base', 'USD').upper()
+        if not rates.valid_base(base):
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "Invalid base currency")
+        try:
+            snapshot = await self.coalescer.run(("currency", base),
+                                                lambda: self.offload(self.rate_cache.get, base))
+        except Exception as e:
+            raise HTTPError(HTTPStatus.INTERNAL_SERVER_ERROR, str(e))
+        payload = dict(snapshot.data)
+        payload["cache"] = snapshot.metadata(self.rate_cache.ttl)
+        return HTTPStatus.OK, payload
+
+    # --- HTTP/1.1 ---
+    def client_id(self, headers, writer):
+        if admission.CLIENT_HEADER and headers.get(admission.CLIENT_HEADER.lower()):
+            return headers[admission.CLIENT_HEADER.lower()]
+        peer = writer.get_extra_info("peername")
+        return peer[0] if peer else ""
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    break
+                except ValueError:
+                    # readline() raises ValueError past the stream's line limit
+                    self.write_response(writer, HTTPStatus.REQUEST_URI_TOO_LONG,
+                                        {"error": "Request line too long"}, False)
+                    await writer.drain()
+                    break
+                if not request_line.strip():
+                    break
+                keep_alive = await self.handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, request_line, reader, writer):
+        try:
+            method, target, version = request_line.decode("latin-1").split()
+        except ValueError:
+            self.write_response(writer, HTTPStatus.BAD_REQUEST, {"error": "Bad request line"}, False)
+            return False
+        headers = {}
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                self.write_response(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                    {"error": "Header line too long"}, False)
+                return False
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        path, _, query_string = target.partition("?")
+        query = dict(parse_qsl(query_string))
+        retry_after = None
+
+        try:
+            if "transfer-encoding" in headers:
+                raise HTTPError(HTTPStatus.LENGTH_REQUIRED)
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY:
+                raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            body = await reader.readexactly(length) if length else b""
+            handler = self.routes.get((method, path))
+            if handler is None:
+                raise HTTPError(HTTPStatus.NOT_FOUND)
+            status, payload = await handler(query, body, self.client_id(headers, writer))
+        except HTTPError as e:
+            status, payload, retry_after = e.status, {"error": str(e)}, e.retry_after
+            keep_alive = keep_alive and e.status not in (HTTPStatus.LENGTH_REQUIRED,
+                                                          HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+        except (ValueError, asyncio.IncompleteReadError):
+            status, payload, keep_alive = HTTPStatus.BAD_REQUEST, {"error": "Bad request"}, False
+        self.write_response(writer, status, payload, keep_alive, retry_after)
+        return keep_alive
+
+    def write_response(self, writer, status, payload, keep_alive, retry_after=None):
+        try:
+            body = json.dumps(payload, allow_nan=False).encode()
+        except (TypeError, ValueError):
+            # Results are checked before they get here; never send an empty reply
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            body = json.dumps({"error": "Result could not be encoded"}).encode()
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n")
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            retry_after = retry_after or 1
+        if retry_after is not None:
+            head += f"Retry-After: {retry_after}\r\n"
+        writer.write(head.encode() + b"\r\n" + body)
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        server = await asyncio.start_server(self.handle_connection, host, port, backlog=BACKLOG)
+        print(f"Serving on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Asyncio server for the calc API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    asyncio.run(CalcServer().serve(args.host, args.port))
@@ -0,0 +1 @@
+"""Benchmarks for the calculator. Run modules from the repo root, e.g. `python -m bench.backends`."""
@@ -0,0 +1,54 @@
+"""
+Run the benchmark suite and write machine-readable results.
+
+    python -m bench [--output results.json] [--skip-load] [--quick]
+    python -m bench.compare old.json new.json
+
+Results are a JSON document with the commit they were measured on and one
+entry per benchmark, so runs from different commits can be diffed.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from bench import backends, load, micro
+
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--output", default="bench_output.json", help="'-' for stdout")
+    parser.add_argument("--skip-load", action="store_true", help="micro-benchmarks only")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations, shorter load runs")
+    parser.add_argument("--executor", default="inline", choices=["inline", "process"])
+    args = parser.parse_args()
+
+    number = 2000 if args.quick else 20000
+    results = micro.run(number) + backends.run(number)
+    if not args.skip_load:
+        results += load.run(duration=1.0 if args.quick else 5.0, executor_kind=args.executor)
+
+    document = {"commit": _commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(), "platform": platform.platform(),
+                "results": results}
+    text = json.dumps(document, indent=2)
+    if args.output == "-":
+        print(text)
+    else:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""
+Compare the float, decimal and rational numeric backends.
+
+    python -m bench.backends [--number N] [--precision P]
+
+Each expression is compiled once up front, so the numbers are per-evaluation
+costs. "int" expressions hit the native-int fast path in the precise modes.
+"""
+import argparse
+import timeit
+
+import numeric
+
+EXPRESSIONS = [
+    ("int", "2**64 + 3*7 - 10//3"),
+    ("mixed", "1.07**12 * 2500 / 3"),
+    ("funcs", "sqrt(2) * sin(pi/6) + ln(10)"),
+    ("vars", "x*y + x/y"),
+]
+VARIABLES = {"x": 1.25, "y": 0.4}
+
+
+def run(number=20000, precision=numeric.DEFAULT_PRECISION):
+    results = []
+    for label, text in EXPRESSIONS:
+        variables = VARIABLES if "x" in text else None
+        for mode in numeric.MODES:
+            call = lambda: numeric.evaluate(text, variables, mode, precision)
+            call()  # warm the expression cache and backend
+            seconds = min(timeit.repeat(call, number=number, repeat=3))
+            results.append({"name": f"backend.{label}.{mode}", "expression": text,
+                            "mode": mode, "ns_per_op": seconds / number * 1e9})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--precision", type=int, default=numeric.DEFAULT_PRECISION)
+    args = parser.parse_args()
+    for row in run(args.number, args.precision):
+        print(f"{row['name']:<28} {row['ns_per_op']:>10.0f} ns/op")
+
+
+if __name__ == "__main__":
+    main()
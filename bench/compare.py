@@ -0,0 +1,50 @@
+"""
+Compare two benchmark result files.
+
+    python -m bench.compare old.json new.json [--threshold 0.10]
+
+Prints the relative change for every benchmark present in both files and
+exits non-zero if any got worse by more than the threshold. Time metrics
+(ns_per_op, p50_ms, p99_ms) regress when they grow, rps when it shrinks.
+"""
+import argparse
+import json
+import sys
+
+# metric -> True if bigger is better
+METRICS = {"ns_per_op": False, "p50_ms": False, "p99_ms": False, "rps": True}
+
+
+def _load(path):
+    with open(path) as f:
+        return {row["name"]: row for row in json.load(f)["results"]}
+
+
+def compare(old, new, threshold):
+    regressions = []
+    for name in sorted(old.keys() & new.keys()):
+        for metric, higher_is_better in METRICS.items():
+            if metric not in old[name] or metric not in new[name] or not old[name][metric]:
+                continue
+            change = (new[name][metric] - old[name][metric]) / old[name][metric]
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > threshold else ""
+            print(f"{name:<36} {metric:<10} {old[name][metric]:>12.2f} -> "
+                  f"{new[name][metric]:>12.2f} {change:+8.1%} {flag}")
+            if flag:
+                regressions.append((name, metric))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare benchmark results")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+    regressions = compare(_load(args.old), _load(args.new), args.threshold)
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+HTTP load generator for the Flask app.
+
+    python -m bench.load [--duration S] [--concurrency N] [--executor inline|process]
+
+Starts a stub currency server and the Flask app on local ports, then drives
+each route from N keep-alive client threads and reports p50/p99 latency and
+throughput.
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+from bench import stub_currency
+
+# A payload is a dict, or a function of the request number for routes that
+# would otherwise answer repeats from history
+SCENARIOS = [
+    ("calc", "POST", "/api/calc", lambda n: {"expression": f"sqrt(2)*sin(pi/4)+ln({n + 10})"}),
+    ("calc_bulk", "POST", "/api/calc",
+     lambda n: {"expressions": [f"sqrt(a*a+b*b)*{i}+{n}" for i in range(50)], "vars": {"a": 3, "b": 4}}),
+    ("calc_batch", "POST", "/api/calc/batch",
+     {"expression": "sin(x)*y", "columns": {"x": list(range(1000)), "y": list(range(1000))}}),
+    ("convert", "POST", "/api/convert",
+     {"category": "length", "from": "km", "to": "mi", "values": list(range(1000))}),
+    ("currency", "GET", "/api/currency", None),
+]
+
+
+def start_app(executor_kind):
+    """
+    Start app.py's Flask app on a free port, pointed at a stub currency
+    server, with admission control off and a throwaway history.
+    """
+    stub, url = stub_currency.start()
+    os.environ["CALCIFY_CURRENCY_URL"] = url
+    os.environ["CALCIFY_EXECUTOR"] = executor_kind
+    os.environ["CALCIFY_RATE_LIMIT"] = "0"
+    os.environ["CALCIFY_HISTORY_PATH"] = os.path.join(tempfile.mkdtemp(), "history.db")
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import app
+
+    class QuietHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, stub
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def drive(port, method, path, payload, duration, concurrency, counter=None):
+    if callable(payload):
+        counter = counter or itertools.count()
+        make_body = lambda: json.dumps(payload(next(counter))).encode()
+    else:
+        body = json.dumps(payload).encode() if payload is not None else None
+        make_body = lambda: body
+    headers = {"Content-Type": "application/json"} if payload is not None else {}
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        local = []
+        failed = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                conn.request(method, path, body=make_body(), headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status >= 400:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port)
+                continue
+            local.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors[0],
+            "rps": len(latencies) / elapsed if elapsed else 0.0,
+            "p50_ms": _percentile(latencies, 0.50) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000}
+
+
+def run(duration=5.0, concurrency=8, executor_kind="inline"):
+    server, stub = start_app(executor_kind)
+    port = server.server_port
+    results = []
+    try:
+        for name, method, path, payload in SCENARIOS:
+            # One counter per route, so the warm-up's expressions aren't repeated
+            counter = itertools.count()
+            drive(port, method, path, payload, min(0.5, duration), 1, counter)  # warm up
+            stats = drive(port, method, path, payload, duration, concurrency, counter)
+            results.append(dict(stats, name=f"http.{name}"))
+    finally:
+        server.shutdown()
+        stub.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load generator")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per route")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--executor", default="inline", choices=["inline", "process"])
+    args = parser.parse_args()
+    for row in run(args.duration, args.concurrency, args.executor):
+        print(f"{row['name']:<20} {row['rps']:>9.1f} req/s  p50 {row['p50_ms']:7.2f} ms  "
+              f"p99 {row['p99_ms']:7.2f} ms  errors {row['errors']}")
+
+
+if __name__ == "__main__":
+    main()
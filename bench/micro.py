@@ -0,0 +1,61 @@
+"""
+Micro-benchmarks for the hot paths.
+
+    python -m bench.micro [--number N]
+
+Covers expression parse/compile/evaluate (the work /api/calc and
+Calculator.evaluate() do per request) and unit conversion.
+"""
+import argparse
+import timeit
+
+import engine
+import units
+
+EXPRESSIONS = {
+    "short": "2+3*4",
+    "sci": "sqrt(16)+math.sin(math.pi/4)*ln(10)",
+    "long": "+".join(f"{i}*{i + 1}" for i in range(50)),
+}
+_NAMES = dict(engine.ALLOWED_NAMES)
+
+
+def _bench(name, func, number):
+    func()
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    return {"name": name, "ns_per_op": seconds / number * 1e9}
+
+
+def run(number=10000):
+    results = []
+    for label, text in EXPRESSIONS.items():
+        # What calculate() did before the engine: eval() from scratch every call
+        results.append(_bench(f"calc.{label}.eval_baseline",
+                              lambda: eval(text, {"__builtins__": None}, _NAMES), number))
+        results.append(_bench(f"calc.{label}.parse_compile",
+                              lambda: engine.compile_tree(engine.parse(text)), number // 10 or 1))
+        results.append(_bench(f"calc.{label}.cached_evaluate", lambda: engine.evaluate(text), number))
+
+    # Calculator.evaluate(): concatenate the running strings, then evaluate
+    total, current = "12*3+", "4"
+    results.append(_bench("desktop.evaluate", lambda: str(engine.evaluate(total + current)), number))
+
+    registry = units.registry
+    length = registry.get("length")
+    results.append(_bench("units.convert", lambda: registry.convert("length", 12.5, "km", "mi"), number))
+    values = [float(i) for i in range(10000)]
+    results.append(_bench("units.convert_many_10k",
+                          lambda: length.convert_many(values, "km", "mi"), max(number // 100, 1)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks")
+    parser.add_argument("--number", type=int, default=10000)
+    args = parser.parse_args()
+    for row in run(args.number):
+        print(f"{row['name']:<36} {row['ns_per_op']:>12.0f} ns/op")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Local stand-in for the exchange-rate API, for benchmarks and tests.
+
+    python -m bench.stub_currency --port 8765
+    CALCIFY_CURRENCY_URL=http://127.0.0.1:8765/latest/{base} python app.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RATES = {"USD": 1, "EUR": 0.92, "GBP": 0.79, "JPY": 149.5, "INR": 83.2,
+         "CAD": 1.36, "AUD": 1.52, "CHF": 0.88, "CNY": 7.24, "SEK": 10.6}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        base = self.path.rstrip("/").rsplit("/", 1)[-1].upper() or "USD"
+        scale = RATES.get(base, 1)
+        body = json.dumps({"base": base, "date": time.strftime("%Y-%m-%d"),
+                           "rates": {code: rate / scale for code, rate in RATES.items()}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(port=0, delay=0.0):
+    """Serve in a background thread. Returns (server, url template)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.requests = 0
+    server.delay = delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/latest/{{base}}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub exchange-rate server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to sleep per request")
+    args = parser.parse_args()
+    server, url = start(args.port, args.delay)
+    print(f"Serving rates at {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
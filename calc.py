@@ -1,10 +1,17 @@
+import time
+_STARTED = time.perf_counter()
+
 import tkinter as tk
-from tkinter import ttk, messagebox
-import math
+from tkinter import ttk
+import os
+import re
 import threading
-import json
-import urllib.request
-from datetime import datetime
+
+from decimal import Decimal
+
+import environment
+import incremental
+import numeric
 
 # --- Constants & Configuration ---
 LARGE_FONT_STYLE = ("Courier New", 40, "bold")
@@ -21,9 +28,11 @@ BTN_OP_BG = "#1A1A1A"      # Black for operators
 BTN_OP_FG = "#FFFFFF"      # White text
 BTN_ACCENT_BG = "#D71921"  # Nothing Red
 BTN_ACCENT_FG = "#FFFFFF"  # White text
+PREVIEW_FG = "#808080"     # Grey live result
 
-# Currency API
-CURRENCY_API_URL = "https://api.exchangerate-api.com/v4/latest/USD"
+# Set CALCIFY_STARTUP_REPORT=1 to print startup and mode switch timings
+STARTUP_REPORT = os.environ.get("CALCIFY_STARTUP_REPORT", "0") not in ("", "0")
+_IMPORTED = time.perf_counter()
 
 class Calculator:
     def __init__(self):
@@ -36,8 +45,17 @@ class Calculator:
         self.total_expression = ""
         self.current_expression = ""
         self.mode = "Standard"  # Standard, Scientific, Converter
+        self.numeric_mode = "float"  # float, decimal, rational (see numeric.py)
+        # Pasted definitions like "rate = 0.07" or "f(x) = x^2 + 1" are
+        # compiled once into this environment and usable from then on
+        self.environment = environment.Environment()
+        # Committed input is folded into a running result as it's entered
+        self.incremental = incremental.IncrementalEvaluator(self.environment.backend(self.numeric_mode))
+        self._history = None
+        self._history_browse = None  # (entries, index) while stepping with Up/Down
         
         # Currency Data
+        self._rate_cache = None
         self.currency_rates = {}
         self.currency_last_updated = None
         self.conversion_input_value = ""
@@ -45,15 +63,20 @@ class Calculator:
         # UI Setup
         self.create_menu()
         self.display_frame = self.create_display_frame()
-        self.total_label, self.label = self.create_display_labels()
-        
-        self.buttons_frame = self.create_buttons_frame()
+        self.total_label, self.label, self.preview_label = self.create_display_labels()
+        self.window.bind("<Control-v>", self.paste)
+        self.window.bind("<Up>", lambda event: self.browse_history(1))
+        self.window.bind("<Down>", lambda event: self.browse_history(-1))
         
+        # Each mode's buttons are built on first use, then kept and swapped in
+        self.buttons_frame = None
+        self.mode_frames = {}
+
         # Initial Render
-        self.render_standard_ui()
-        
-        # Start background currency fetch
-        self.fetch_currency_thread()
+        self.show_mode(self.mode)
+
+        # Saved rates and the network wait until the window is up
+        self.window.after_idle(self.on_startup_done)
 
     def create_menu(self):
         # A simple mode switcher at the top
@@ -67,24 +90,50 @@ class Calculator:
         mode_menu.pack(side=tk.LEFT)
         mode_menu.bind("<<ComboboxSelected>>", self.on_mode_change)
 
+        # Numeric backend for evaluate()
+        self.numeric_var = tk.StringVar(value=self.numeric_mode)
+        numeric_menu = ttk.Combobox(self.menu_frame, textvariable=self.numeric_var, values=numeric.MODES, state="readonly", font=SMALL_FONT_STYLE, width=8)
+        numeric_menu.pack(side=tk.RIGHT)
+        numeric_menu.bind("<<ComboboxSelected>>", self.on_numeric_mode_change)
+
+    def on_numeric_mode_change(self, event):
+        self.numeric_mode = self.numeric_var.get()
+        self.incremental.set_backend(self.environment.backend(self.numeric_mode))
+        self.update_label()
+
     def on_mode_change(self, event):
         new_mode = self.mode_var.get()
         if new_mode != self.mode:
             self.mode = new_mode
-            self.clear_ui()
-            if self.mode == "Standard":
-                self.render_standard_ui()
-            elif self.mode == "Scientific":
-                self.render_scientific_ui()
-            elif self.mode == "Converter":
-                self.render_converter_ui()
-
-    def clear_ui(self):
-        for widget in self.buttons_frame.winfo_children():
-            widget.destroy()
-        # Reset display for safety
+            self.reset_display()
+            self.show_mode(new_mode)
+
+    def show_mode(self, mode):
+        """Swap in the buttons for `mode`, building them the first time."""
+        start = time.perf_counter()
+        if self.buttons_frame is not None:
+            self.buttons_frame.pack_forget()
+        frame = self.mode_frames.get(mode)
+        if frame is None:
+            frame = self.buttons_frame = self.mode_frames[mode] = self.create_buttons_frame()
+            renderers = {"Standard": self.render_standard_ui,
+                         "Scientific": self.render_scientific_ui,
+                         "Converter": self.render_converter_ui}
+            renderers[mode]()
+            action = "built"
+        else:
+            self.buttons_frame = frame
+            frame.pack(expand=True, fill="both")
+            if mode == "Converter":
+                # Rates may have refreshed while it was hidden
+                self.refresh_converter_options()
+            action = "shown"
+        self.report_time(f"{mode} {action}", start)
+
+    def reset_display(self):
         self.current_expression = ""
         self.total_expression = ""
+        self.incremental.reset()
         self.update_label()
         self.update_total_label()
 
@@ -102,13 +151,29 @@ class Calculator:
                          fg=BTN_NUM_FG, padx=10, font=LARGE_FONT_STYLE)
         label.pack(expand=True, fill='both')
 
-        return total_label, label
+        preview_label = tk.Label(self.display_frame, text="", anchor=tk.E, bg=BG_COLOR,
+                                 fg=PREVIEW_FG, padx=10, font=SMALL_FONT_STYLE)
+        preview_label.pack(expand=True, fill='both')
+
+        return total_label, label, preview_label
 
     def create_buttons_frame(self):
         frame = tk.Frame(self.window, bg=BG_COLOR)
         frame.pack(expand=True, fill="both")
         return frame
 
+    def on_startup_done(self):
+        # First idle moment after the window is built
+        if STARTUP_REPORT:
+            now = time.perf_counter()
+            print(f"Startup: imports {(_IMPORTED - _STARTED) * 1000:.1f} ms, "
+                  f"ready {(now - _STARTED) * 1000:.1f} ms")
+        self.fetch_currency_thread()
+
+    def report_time(self, what, start):
+        if STARTUP_REPORT:
+            print(f"{what}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
     # --- Standard UI ---
     def render_standard_ui(self):
         digits = {
@@ -292,15 +357,10 @@ class Calculator:
         self.refresh_converter_options()
 
     def refresh_converter_options(self, event=None):
+        import units
         ctype = self.conv_type.get()
-        values = []
-        if ctype == "Length":
-            values = ["m", "km", "ft", "mi", "cm", "inch"]
-        elif ctype == "Weight":
-            values = ["kg", "g", "lb", "oz"]
-        elif ctype == "Currency":
-            values = list(self.currency_rates.keys()) if self.currency_rates else ["USD", "EUR", "GBP", "JPY", "INR"]
-            
+        values = list(units.registry.units(ctype))
+
         self.unit_from['values'] = values
         self.unit_to['values'] = values
         
@@ -318,6 +378,7 @@ class Calculator:
         self.convert()
         
     def convert(self, event=None):
+        import units
         try:
             val = float(self.current_expression) if self.current_expression else 0
             ctype = self.conv_type.get()
@@ -326,27 +387,18 @@ class Calculator:
             
             result = 0
             
-            if ctype == "Length":
-                # Base unit: meter
-                to_m = {"m":1, "km":1000, "ft":0.3048, "mi":1609.34, "cm":0.01, "inch":0.0254}
-                val_m = val * to_m.get(u_from, 1)
-                result = val_m / to_m.get(u_to, 1)
-                
-            elif ctype == "Weight":
-                # Base unit: kg
-                to_kg = {"kg":1, "g":0.001, "lb":0.453592, "oz":0.0283495}
-                val_kg = val * to_kg.get(u_from, 1)
-                result = val_kg / to_kg.get(u_to, 1)
-                
-            elif ctype == "Currency":
-                if self.currency_rates:
-                    rate_from = self.currency_rates.get(u_from, 1)
-                    rate_to = self.currency_rates.get(u_to, 1)
-                    # Convert to base (USD) then to target
-                    val_usd = val / rate_from
-                    result = val_usd * rate_to
+            if ctype == "Currency":
+                # Serves the cached rates and kicks off a background refresh once they go stale
+                self.rate_cache.get(wait=False)
+            # Factors come precomputed from the unit registry; currency is
+            # missing only on a first run, until the first rates arrive
+            category = units.registry.get(ctype)
+            if category is not None:
+                if ctype == "Currency":
+                    # Money goes through Decimal so the 4-place rounding is exact
+                    result = numeric.quantize(category.convert_exact(Decimal(self.current_expression or 0), u_from, u_to))
                 else:
-                     result = 0 # API not loaded
+                    result = category.convert(val, u_from, u_to)
             
             self.total_expression = f"= {result:.4f}"
             self.update_total_label()
@@ -369,8 +421,9 @@ class Calculator:
         self.update_label()
 
     def append_operator(self, operator):
-        self.current_expression += str(operator)
-        self.total_expression += self.current_expression
+        self.incremental.feed(self.current_expression + str(operator))
+        # Only the tail of a long chain is shown; the full text stays in the evaluator
+        self.total_expression = self.incremental.tail()
         self.current_expression = ""
         self.update_total_label()
         self.update_label()
@@ -378,6 +431,8 @@ class Calculator:
     def clear(self):
         self.current_expression = ""
         self.total_expression = ""
+        self.incremental.reset()
+        self._history_browse = None
         self.update_label()
         self.update_total_label()
 
@@ -389,7 +444,7 @@ class Calculator:
 
     def percent(self):
         try:
-            self.current_expression = str(eval(f"{self.current_expression}/100"))
+            self.current_expression = str(numeric.evaluate(f"{self.current_expression}/100", mode=self.numeric_mode))
             self.update_label()
         except:
             self.current_expression = "Error"
@@ -408,45 +463,140 @@ class Calculator:
         self.current_expression += f"{func_name}("
         self.update_label()
 
+    def paste(self, event=None):
+        if self.mode == "Converter":
+            return
+        try:
+            text = " ".join(self.window.clipboard_get().split())
+        except tk.TclError:
+            return
+        self.insert_text(text)
+
+    def insert_text(self, text):
+        # Commit everything up to the trailing operand, which stays editable
+        head, tail = re.match(r"(.*?)([\w.]*)$", self.current_expression + text).groups()
+        if head:
+            self.incremental.feed(head)
+            self.total_expression = self.incremental.tail()
+            self.update_total_label()
+        self.current_expression = tail
+        self.update_label()
+
     def evaluate(self):
-        self.total_expression += self.current_expression
+        text = self.incremental.text + self.current_expression
+        if environment.is_definition(text):
+            self.define(text)
+            return
         try:
-            # Allow math functions
-            self.current_expression = str(eval(self.total_expression, {"__builtins__": None}, {"math": math, "sin": math.sin, "cos": math.cos, "tan": math.tan}))
+            # Allow math functions (see engine.ALLOWED_NAMES) and definitions; "=" closes open brackets like the preview does
+            value = self.incremental.result(self.current_expression, close=True)
+            if not self.environment.uses(text):
+                # Results that use definitions only make sense in this session
+                self.history.append(text, value, self.numeric_mode)
+            self.current_expression = str(value)
             self.total_expression = ""
+            self.incremental.reset()
+            self._history_browse = None
         except Exception as e:
+            self.incremental.feed(self.current_expression)
+            self.total_expression = self.incremental.tail()
             self.current_expression = "Error"
             print(f"Eval error: {e}")
         finally:
             self.update_label()
             self.update_total_label()
 
+    def define(self, text):
+        try:
+            definition = self.environment.define(text)
+            self.total_expression = f"{definition.name} defined"
+            self.current_expression = ""
+        except Exception as e:
+            self.total_expression = ""
+            self.current_expression = "Error"
+            print(f"Definition error: {e}")
+        # The environment's namespace changed; start over against the new one
+        self.incremental.set_backend(self.environment.backend(self.numeric_mode))
+        self.incremental.reset()
+        self.update_label()
+        self.update_total_label()
+
+    @property
+    def rate_cache(self):
+        # Rates persist between runs, so the converter works offline and at
+        # launch; the network is only touched once the saved rates go stale.
+        # Loaded at the first idle moment (see on_startup_done), or by the
+        # converter if that comes first
+        if self._rate_cache is None:
+            import rates
+            import units
+            self._rate_cache = rates.RateCache(path=rates.SNAPSHOT_PATH)
+            self._rate_cache.subscribe(self._on_rates_refreshed)
+            units.registry.track(self._rate_cache)
+        return self._rate_cache
+
+    @property
+    def history(self):
+        # Imported and opened on first use so startup doesn't touch the disk
+        if self._history is None:
+            import history
+            self._history = history.HistoryStore()
+        return self._history
+
+    def browse_history(self, step):
+        """Load the previous (step=1) or next (step=-1) calculation from history."""
+        if self.mode == "Converter":
+            return
+        if self._history_browse is None:
+            self._history_browse = (self.history.recent(limit=100, owner=""), -1)
+        entries, index = self._history_browse
+        index = max(-1, min(index + step, len(entries) - 1))
+        self.current_expression = ""
+        self.total_expression = ""
+        self.incremental.reset()
+        if index >= 0:
+            self.insert_text(entries[index]["expression"])
+        self._history_browse = (entries, index)
+        self.update_label()
+        self.update_total_label()
+
     def update_total_label(self):
         self.total_label.config(text=self.total_expression)
 
     def update_label(self):
         self.label.config(text=self.current_expression or "0")
+        self.update_preview()
+
+    def update_preview(self):
+        # Live result of everything entered so far, with open brackets closed
+        text = ""
+        if self.mode != "Converter":
+            value = self.incremental.preview(self.current_expression)
+            if value is not None and str(value) != self.current_expression:
+                text = f"= {value}"
+        self.preview_label.config(text=text)
 
     # --- Networking ---
     def fetch_currency_thread(self):
-        thread = threading.Thread(target=self._fetch_currency_data, daemon=True)
+        # The cache is created here on the Tk thread, not on the fetch thread
+        thread = threading.Thread(target=self._fetch_currency_data, args=(self.rate_cache,), daemon=True)
         thread.start()
 
-    def _fetch_currency_data(self):
+    def _fetch_currency_data(self, rate_cache):
+        # Returns straight away with saved rates that are still fresh
         try:
-            print("Fetching currency data...")
-            with urllib.request.urlopen(CURRENCY_API_URL) as response:
-                data = json.loads(response.read().decode())
-                self.currency_rates = data.get("rates", {})
-                self.currency_last_updated = datetime.now()
-                print("Currency data fetched.")
-                # If in converter mode, refresh list
-                if self.mode == "Converter":
-                    self.window.after(0, self.refresh_converter_options)
+            rate_cache.get()
         except Exception as e:
             print(f"Failed to fetch currency: {e}")
-            # Fallback data could be set here
-            pass
+
+    def _on_rates_refreshed(self, base, snapshot):
+        # Runs on whichever thread loaded the saved rates, then on the fetch
+        # thread for every refresh
+        self.currency_rates = snapshot.rates
+        self.currency_last_updated = snapshot.last_updated
+        # If in converter mode, refresh list
+        if self.mode == "Converter":
+            self.window.after(0, self.refresh_converter_options)
 
     def run(self):
         self.window.mainloop()
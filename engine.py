@@ -0,0 +1,823 @@
+"""
+Expression engine shared by the web app and the desktop calculator.
+
+Expressions are tokenized and parsed into a small AST, validated against the
+allowed namespace and compiled once into a plain Python function. Compiled
+expressions live in an LRU cache keyed by the normalized expression text, so
+repeated formulas skip the parse/compile step entirely.
+"""
+import keyword
+import math
+import numbers
+import operator
+import re
+import threading
+import time
+import types
+from collections import OrderedDict, namedtuple
+
+import metrics
+
+# Names an expression is allowed to reference. Anything else is treated as a
+# free variable and has to be bound when the expression is evaluated.
+ALLOWED_NAMES = {"math": math, "sin": math.sin, "cos": math.cos,
+                 "tan": math.tan, "log": math.log10, "ln": math.log,
+                 "sqrt": math.sqrt, "pi": math.pi, "e": math.e}
+
+# The math module functions and constants that have a NumPy counterpart,
+# by numpy name. Only these are reachable as `math.<name>` over arrays.
+ARRAY_MATH = {"sin": "sin", "cos": "cos", "tan": "tan", "asin": "arcsin",
+              "acos": "arccos", "atan": "arctan", "atan2": "arctan2",
+              "sinh": "sinh", "cosh": "cosh", "tanh": "tanh", "asinh": "arcsinh",
+              "acosh": "arccosh", "atanh": "arctanh", "exp": "exp", "expm1": "expm1",
+              "log": "log", "log10": "log10", "log2": "log2", "log1p": "log1p",
+              "sqrt": "sqrt", "fabs": "fabs", "floor": "floor", "ceil": "ceil",
+              "trunc": "trunc", "hypot": "hypot", "copysign": "copysign",
+              "fmod": "fmod", "degrees": "degrees", "radians": "radians",
+              "pi": "pi", "e": "e", "inf": "inf", "nan": "nan"}
+
+CACHE_SIZE = 1024
+
+# NumPy is imported by the first batch, sample or solve, not with the engine,
+# so the desktop app doesn't pay for it at startup. `engine.np` and
+# `engine.ARRAY_NAMES` (the names above mapped onto NumPy ufuncs, for
+# evaluating whole columns of bindings in one pass) trigger the import and
+# are None without NumPy.
+_numpy_module = None
+_array_names = None
+
+
+def _numpy():
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+        except ImportError:  # Batch evaluation falls back to a per-row loop
+            numpy = False
+        _numpy_module = numpy
+    return _numpy_module or None
+
+
+def _array_namespace():
+    global _array_names
+    np = _numpy()
+    if _array_names is None and np is not None:
+        # Built once: compiled expressions are memoized per namespace object
+        _array_names = {"math": types.SimpleNamespace(**{name: getattr(np, attr)
+                                                         for name, attr in ARRAY_MATH.items()}),
+                        "sin": np.sin, "cos": np.cos,
+                        "tan": np.tan, "log": np.log10, "ln": np.log,
+                        "sqrt": np.sqrt, "pi": np.pi, "e": np.e}
+    return _array_names
+
+
+def __getattr__(name):
+    if name == "np":
+        return _numpy()
+    if name == "ARRAY_NAMES":
+        return _array_namespace()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class ExpressionError(ValueError):
+    """Raised when an expression can't be parsed, validated or bound."""
+
+
+# --- AST ---
+# Nodes are hashable tuples with structural equality, so identical subtrees
+# compare equal. Numbers keep their source text so each numeric backend can
+# decide how to read them.
+class _Node(tuple):
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__,) + tuple(self))
+
+
+class Num(_Node, namedtuple("Num", "text")):
+    __slots__ = ()
+
+
+class Name(_Node, namedtuple("Name", "id")):
+    __slots__ = ()
+
+
+class UnaryOp(_Node, namedtuple("UnaryOp", "op operand")):
+    __slots__ = ()
+
+
+class BinOp(_Node, namedtuple("BinOp", "op left right")):
+    __slots__ = ()
+
+
+class Call(_Node, namedtuple("Call", "func args")):
+    __slots__ = ()
+
+
+BINARY_OPS = ("+", "-", "*", "/", "//", "%", "**")
+
+
+# --- Tokenizer ---
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+      | (?P<name>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*)
+      | (?P<op>\*\*|//|[-+*/%^(),])
+    )""", re.VERBOSE)
+
+
+def tokenize(text):
+    """Split an expression into (kind, value) tokens."""
+    tokens = []
+    pos = 0
+    end = len(text.rstrip())
+    while pos < end:
+        match = _TOKEN_RE.match(text, pos)
+        if not match:
+            raise ExpressionError(f"Unexpected character at {pos}: {text[pos:pos + 1]!r}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if value == "^":
+            value = "**"
+        tokens.append((kind, value))
+        pos = match.end()
+    return tokens
+
+
+def normalize(text):
+    """Canonical cache key for an expression: collapsed whitespace."""
+    return " ".join(text.split())
+
+
+# --- Parser ---
+class _Parser:
+    # expr  := term (('+' | '-') term)*
+    # term  := unary (('*' | '/' | '//' | '%') unary)*
+    # unary := ('+' | '-') unary | power
+    # power := atom ('**' unary)?
+    # atom  := NUM | NAME | NAME '(' [expr (',' expr)*] ')' | '(' expr ')'
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def take(self, value=None):
+        kind, tok = self.peek()
+        if kind is None:
+            raise ExpressionError("Unexpected end of expression")
+        if value is not None and tok != value:
+            raise ExpressionError(f"Expected {value!r}, got {tok!r}")
+        self.pos += 1
+        return kind, tok
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError("Empty expression")
+        node = self.expr()
+        if self.pos != len(self.tokens):
+            raise ExpressionError(f"Unexpected token {self.peek()[1]!r}")
+        return node
+
+    def expr(self):
+        node = self.term()
+        while self.peek()[1] in ("+", "-"):
+            op = self.take()[1]
+            node = BinOp(op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.unary()
+        while self.peek()[1] in ("*", "/", "//", "%"):
+            op = self.take()[1]
+            node = BinOp(op, node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek()[1] in ("+", "-"):
+            op = self.take()[1]
+            return UnaryOp(op, self.unary())
+        return self.power()
+
+    def power(self):
+        node = self.atom()
+        if self.peek()[1] == "**":
+            self.take()
+            node = BinOp("**", node, self.unary())
+        return node
+
+    def atom(self):
+        kind, tok = self.take()
+        if kind == "num":
+            return Num(tok)
+        if kind == "name":
+            if self.peek()[1] == "(":
+                self.take()
+                args = []
+                if self.peek()[1] != ")":
+                    args.append(self.expr())
+                    while self.peek()[1] == ",":
+                        self.take()
+                        args.append(self.expr())
+                self.take(")")
+                return Call(tok, tuple(args))
+            return Name(tok)
+        if tok == "(":
+            node = self.expr()
+            self.take(")")
+            return node
+        raise ExpressionError(f"Unexpected token {tok!r}")
+
+
+def parse(text):
+    """Parse expression text into an AST."""
+    try:
+        return _Parser(tokenize(text)).parse()
+    except RecursionError:
+        raise ExpressionError("Expression is too deeply nested") from None
+
+
+# --- Validation & Compilation ---
+def resolve(name, namespace):
+    """Look a (possibly dotted) name up in the namespace, or raise KeyError."""
+    if name in namespace:
+        return namespace[name]
+    head, _, attr = name.partition(".")
+    if attr and "." not in attr and not attr.startswith("_") and head in namespace:
+        try:
+            return getattr(namespace[head], attr)
+        except AttributeError:
+            pass
+    raise KeyError(name)
+
+
+def float_literal(text):
+    """Read a numeric literal the way Python would: ints stay ints."""
+    if text.isdigit():
+        return int(text)
+    return float(text)
+
+
+def free_variables(node, namespace=None):
+    """Names in the tree that the namespace doesn't provide, sorted."""
+    namespace = ALLOWED_NAMES if namespace is None else namespace
+    found = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Name):
+            try:
+                resolve(node.id, namespace)
+            except KeyError:
+                found.add(node.id)
+        elif isinstance(node, UnaryOp):
+            stack.append(node.operand)
+        elif isinstance(node, BinOp):
+            stack.append(node.left)
+            stack.append(node.right)
+        elif isinstance(node, Call):
+            stack.extend(node.args)
+    return sorted(found)
+
+
+# Binding strength of each node when emitted as Python source
+_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2, "//": 2, "%": 2, "**": 4}
+_UNARY_PRECEDENCE = 3
+_ATOM_PRECEDENCE = 5
+
+# Python's own compiler recurses on long operator chains, so chains are split
+# into temporaries every this many terms.
+_CHAIN_CHUNK = 200
+
+
+def _precedence(node):
+    if isinstance(node, BinOp):
+        return _PRECEDENCE[node.op]
+    if isinstance(node, UnaryOp):
+        return _UNARY_PRECEDENCE
+    return _ATOM_PRECEDENCE
+
+
+class _Compiler:
+    def __init__(self, namespace, literal):
+        self.namespace = namespace
+        self.literal = literal
+        self.slots = {}
+        self.params = set()
+        self.lines = []
+
+    def slot(self, value):
+        name = f"_s{len(self.slots)}"
+        self.slots[name] = value
+        return name
+
+    def temp(self, text):
+        name = f"_t{len(self.lines)}"
+        self.lines.append(f"{name} = {text}")
+        return name
+
+    def wrap(self, node, parens):
+        text = self.emit(node)
+        return f"({text})" if parens else text
+
+    def emit(self, node):
+        if isinstance(node, Num):
+            value = self.literal(node.text)
+            if type(value) in (int, float) and math.isfinite(value):
+                return repr(value)
+            return self.slot(value)
+        if isinstance(node, Name):
+            try:
+                value = resolve(node.id, self.namespace)
+            except KeyError:
+                if "." in node.id or node.id.startswith("_") or keyword.iskeyword(node.id):
+                    raise ExpressionError(f"Unknown name {node.id!r}") from None
+                self.params.add(node.id)
+                return node.id
+            if callable(value) or not isinstance(value, numbers.Number):
+                raise ExpressionError(f"{node.id!r} is not a value")
+            return self.slot(value)
+        if isinstance(node, UnaryOp):
+            operand = self.wrap(node.operand, _precedence(node.operand) < _UNARY_PRECEDENCE)
+            return f"{node.op} {operand}"
+        if isinstance(node, BinOp) and node.op == "**":
+            left = self.wrap(node.left, _precedence(node.left) <= _PRECEDENCE["**"])
+            right = self.wrap(node.right, _precedence(node.right) < _UNARY_PRECEDENCE)
+            return f"{left}**{right}"
+        if isinstance(node, BinOp):
+            # Walk the left spine iteratively so long chains don't recurse
+            level = _PRECEDENCE[node.op]
+            chain = []
+            while isinstance(node, BinOp) and node.op != "**" and _PRECEDENCE[node.op] == level:
+                chain.append((node.op, node.right))
+                node = node.left
+            text = self.wrap(node, _precedence(node) < level)
+            for i, (op, right) in enumerate(reversed(chain)):
+                if op in self.namespace:
+                    # The backend supplies its own function for this operator
+                    text = self.temp(f"{self.slot(self.namespace[op])}({text}, {self.emit(right)})")
+                    continue
+                if i and i % _CHAIN_CHUNK == 0:
+                    text = self.temp(text)
+                text += op + self.wrap(right, _precedence(right) <= level)
+            return text
+        if isinstance(node, Call):
+            try:
+                func = resolve(node.func, self.namespace)
+            except KeyError:
+                raise ExpressionError(f"Unknown function {node.func!r}") from None
+            if not callable(func):
+                raise ExpressionError(f"{node.func!r} is not a function")
+            args = ", ".join(self.emit(arg) for arg in node.args)
+            return f"{self.slot(func)}({args})"
+        raise ExpressionError(f"Unsupported node {node!r}")
+
+
+def compile_tree(tree, namespace=None, literal=float_literal):
+    """
+    Compile a validated tree into a function taking its free variables as
+    keyword arguments. Returns (function, parameter names).
+    """
+    namespace = ALLOWED_NAMES if namespace is None else namespace
+    compiler = _Compiler(namespace, literal)
+    try:
+        body = compiler.emit(tree)
+    except RecursionError:
+        raise ExpressionError("Expression is too deeply nested") from None
+    params = sorted(compiler.params)
+    lines = [f"def _expr({', '.join(params)}):"]
+    lines.extend(f"    {line}" for line in compiler.lines)
+    lines.append(f"    return {body}")
+    scope = {"__builtins__": {}}
+    scope.update(compiler.slots)
+    try:
+        exec(compile("\n".join(lines), "<expression>", "exec"), scope)
+    except (RecursionError, SyntaxError, MemoryError):
+        raise ExpressionError("Expression is too deeply nested") from None
+    return scope["_expr"], tuple(params)
+
+
+def unparse(tree):
+    """Expression text for a tree, with only the parentheses it needs."""
+    if isinstance(tree, Num):
+        return tree.text
+    if isinstance(tree, Name):
+        return tree.id
+    if isinstance(tree, Call):
+        return f"{tree.func}({', '.join(unparse(arg) for arg in tree.args)})"
+    if isinstance(tree, UnaryOp):
+        operand = unparse(tree.operand)
+        if _precedence(tree.operand) < _UNARY_PRECEDENCE:
+            operand = f"({operand})"
+        return tree.op + operand
+    left, right = unparse(tree.left), unparse(tree.right)
+    if tree.op == "**":
+        left_parens = _precedence(tree.left) <= _PRECEDENCE["**"]
+        right_parens = _precedence(tree.right) < _UNARY_PRECEDENCE
+    else:
+        left_parens = _precedence(tree.left) < _PRECEDENCE[tree.op]
+        right_parens = _precedence(tree.right) <= _PRECEDENCE[tree.op]
+    if left_parens:
+        left = f"({left})"
+    if right_parens:
+        right = f"({right})"
+    spaced = tree.op in ("+", "-")
+    return f"{left} {tree.op} {right}" if spaced else f"{left}{tree.op}{right}"
+
+
+def is_exact_int(tree):
+    """
+    True if the tree only combines integer literals with + - * // % and
+    powers by non-negative integer literals, i.e. plain Python ints compute
+    it exactly and no float or higher-precision type is needed.
+    """
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Num):
+            if not node.text.isdigit():
+                return False
+        elif isinstance(node, UnaryOp):
+            stack.append(node.operand)
+        elif isinstance(node, BinOp) and node.op in ("+", "-", "*", "//", "%"):
+            stack.append(node.left)
+            stack.append(node.right)
+        elif isinstance(node, BinOp) and node.op == "**":
+            if not (isinstance(node.right, Num) and node.right.text.isdigit()):
+                return False
+            stack.append(node.left)
+        else:
+            return False
+    return True
+
+
+class Expression:
+    """A parsed expression with its compiled form memoized per namespace."""
+
+    def __init__(self, text):
+        self.text = normalize(text)
+        self.tree = parse(self.text)
+        self._compiled = {}
+        self._exact_int = None
+        self._lock = threading.Lock()
+
+    def compiled(self, namespace=None, literal=float_literal):
+        namespace = ALLOWED_NAMES if namespace is None else namespace
+        key = (id(namespace), literal)
+        entry = self._compiled.get(key)
+        if entry is not None and entry[0] is namespace:
+            return entry[1], entry[2]
+        func, params = compile_tree(self.tree, namespace, literal)
+        with self._lock:
+            self._compiled[key] = (namespace, func, params)
+        return func, params
+
+    @property
+    def exact_int(self):
+        """True if the expression evaluates exactly with native ints."""
+        if self._exact_int is None:
+            self._exact_int = is_exact_int(self.tree)
+        return self._exact_int
+
+    @property
+    def variables(self):
+        return self.compiled()[1]
+
+    def evaluate(self, variables=None, namespace=None, literal=float_literal):
+        func, params = self.compiled(namespace, literal)
+        if not params:
+            return func()
+        variables = variables or {}
+        missing = [name for name in params if name not in variables]
+        if missing:
+            raise ExpressionError(f"Unknown name {missing[0]!r}")
+        return func(**{name: variables[name] for name in params})
+
+    def __repr__(self):
+        return f"Expression({self.text!r})"
+
+
+# --- Cache ---
+class ExpressionCache:
+    """Bounded LRU of parsed expressions keyed by normalized text."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text):
+        key = normalize(text)
+        expr = self.lookup(key)
+        if expr is None:
+            # Parse outside the lock; a racing duplicate parse is harmless
+            expr = self.store(Expression(key))
+        return expr
+
+    def lookup(self, key):
+        """Cached Expression for a normalized key, counting the hit or miss."""
+        with self._lock:
+            expr = self._data.get(key)
+            if expr is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return expr
+            self.misses += 1
+            return None
+
+    def store(self, expr):
+        with self._lock:
+            self._data[expr.text] = expr
+            self._data.move_to_end(expr.text)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+        return expr
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "maxsize": self.maxsize,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_cache = ExpressionCache()
+
+
+def compile_expression(text):
+    """Return the cached Expression for this text, parsing it on a miss."""
+    return _cache.get(text)
+
+
+def evaluate(text, variables=None, namespace=None):
+    """Parse (or fetch from cache), compile and evaluate an expression."""
+    trace = metrics.current()
+    if trace is None:
+        return compile_expression(text).evaluate(variables, namespace)
+    return _evaluate_traced(trace, text, variables, namespace)
+
+
+def _evaluate_traced(trace, text, variables, namespace):
+    # Same work as evaluate(), with each stage timed into the active trace
+    clock = time.perf_counter
+    start = clock()
+    key = normalize(text)
+    expr = _cache.lookup(key)
+    now = clock()
+    trace.add("cache_lookup", now - start)
+    if expr is None:
+        start = now
+        expr = _cache.store(Expression(key))
+        now = clock()
+        trace.add("parse", now - start)
+    start = now
+    expr.compiled(namespace)
+    now = clock()
+    trace.add("compile", now - start)
+    try:
+        return expr.evaluate(variables, namespace)
+    finally:
+        trace.add("execute", clock() - now)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+# --- Bulk evaluation ---
+_BINARY_FUNCS = {"+": operator.add, "-": operator.sub, "*": operator.mul,
+                 "/": operator.truediv, "//": operator.floordiv,
+                 "%": operator.mod, "**": operator.pow}
+_UNARY_FUNCS = {"-": operator.neg, "+": operator.pos}
+_COMMUTATIVE = ("+", "*")
+
+
+class _Failed:
+    """Marker for a DAG node whose evaluation raised."""
+    __slots__ = ()
+
+
+_FAILED = _Failed()
+
+
+def build_dag(trees):
+    """
+    Merge trees into one DAG with structurally identical subtrees shared.
+
+    Returns (nodes, roots): `nodes` is a topologically ordered list of
+    (kind, payload, child indexes) and `roots[i]` is the index of tree i.
+    Operands of + and * are put in a canonical order so `a*b` and `b*a`
+    share a node.
+    """
+    nodes = []
+    index = {}
+    seen = {}  # id(tree node) -> DAG index, for subtrees reused by the cache
+    roots = []
+    for tree in trees:
+        stack = [(tree, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if id(node) in seen:
+                continue
+            if isinstance(node, UnaryOp):
+                children = (node.operand,)
+            elif isinstance(node, BinOp):
+                children = (node.left, node.right)
+            elif isinstance(node, Call):
+                children = node.args
+            else:
+                children = ()
+            if children and not expanded:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+                continue
+            child_ids = tuple(seen[id(child)] for child in children)
+            if isinstance(node, BinOp) and node.op in _COMMUTATIVE:
+                child_ids = tuple(sorted(child_ids))
+            key = (type(node).__name__, node[0], child_ids)
+            position = index.get(key)
+            if position is None:
+                position = index[key] = len(nodes)
+                nodes.append(key)
+            seen[id(node)] = position
+        roots.append(seen[id(tree)])
+    return nodes, roots
+
+
+def evaluate_many(texts, variables=None, namespace=None):
+    """
+    Evaluate a list of expressions as one deduplicated DAG.
+
+    Shared subexpressions (and constant subtrees) are computed once across
+    the whole list. Returns (values, errors) in input order, with None for
+    expressions that failed to parse or evaluate, or whose result is complex
+    or not finite.
+    """
+    namespace = ALLOWED_NAMES if namespace is None else namespace
+    variables = variables or {}
+    trees = []
+    for text in texts:
+        try:
+            trees.append(compile_expression(text).tree)
+        except Exception:
+            trees.append(None)
+
+    nodes, roots = build_dag([tree for tree in trees if tree is not None])
+    results = []
+    for kind, payload, children in nodes:
+        args = [results[i] for i in children]
+        try:
+            if any(arg is _FAILED for arg in args):
+                value = _FAILED
+            elif kind == "Num":
+                value = float_literal(payload)
+            elif kind == "Name":
+                value = _resolve_value(payload, namespace, variables)
+            elif kind == "UnaryOp":
+                value = _UNARY_FUNCS[payload](*args)
+            elif kind == "BinOp":
+                value = _BINARY_FUNCS[payload](*args)
+            else:
+                value = _resolve_function(payload, namespace)(*args)
+        except Exception:
+            value = _FAILED
+        results.append(value)
+
+    values = []
+    errors = []
+    roots = iter(roots)
+    for tree in trees:
+        value = _FAILED if tree is None else results[next(roots)]
+        failed = value is _FAILED or not is_finite(value)
+        values.append(None if failed else value)
+        errors.append(failed)
+    return values, errors
+
+
+def is_finite(value):
+    """True for an int, a Fraction or a finite float; False for complex, inf and NaN."""
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, numbers.Rational)
+
+
+def _resolve_value(name, namespace, variables):
+    try:
+        value = resolve(name, namespace)
+    except KeyError:
+        return variables[name]
+    if callable(value) or not isinstance(value, numbers.Number):
+        raise ExpressionError(f"{name!r} is not a value")
+    return value
+
+
+def _resolve_function(name, namespace):
+    func = resolve(name, namespace)
+    if not callable(func):
+        raise ExpressionError(f"{name!r} is not a function")
+    return func
+
+
+# --- Batch evaluation ---
+def evaluate_batch(text, columns):
+    """
+    Evaluate one expression over columns of variable bindings.
+
+    `columns` maps each free variable to an equal-length sequence. Returns
+    (values, errors): a list of floats with None for rows that failed and a
+    matching list of booleans. Rows fail individually (domain errors,
+    division by zero, non-finite results); a missing or ragged column fails
+    the whole batch with ExpressionError.
+    """
+    expr, params, size = _batch_columns(text, columns)
+    np = _numpy()
+    if np is None:
+        return _evaluate_rows(expr, params, columns, size)
+    result = _column_array(expr, params, columns, size)
+    if result is None:
+        return _evaluate_rows(expr, params, columns, size)
+    errors = np.isnan(result)
+    values = result.tolist()
+    if errors.any():
+        for i in np.flatnonzero(errors).tolist():
+            values[i] = None
+    return values, errors.tolist()
+
+
+def evaluate_batch_array(text, columns):
+    """
+    Like evaluate_batch, but returns one float64 array with NaN for the rows
+    that failed, for callers that ship the buffer as is. NumPy only.
+    """
+    np = _numpy()
+    if np is None:
+        raise ExpressionError("Array results need NumPy")
+    expr, params, size = _batch_columns(text, columns)
+    result = _column_array(expr, params, columns, size)
+    if result is None:
+        values, _ = _evaluate_rows(expr, params, columns, size)
+        result = np.array([math.nan if v is None else v for v in values], dtype=np.float64)
+    return result
+
+
+def _batch_columns(text, columns):
+    expr = compile_expression(text)
+    params = expr.variables
+    missing = [name for name in params if name not in columns]
+    if missing:
+        raise ExpressionError(f"Missing column {missing[0]!r}")
+    lengths = {len(columns[name]) for name in params}
+    if len(lengths) > 1:
+        raise ExpressionError("Columns must all have the same length")
+    return expr, params, lengths.pop() if lengths else 0
+
+
+def _column_array(expr, params, columns, size):
+    # Float64 results with NaN for failed rows, or None when a column isn't
+    # all numbers or a constant part raised (e.g. 1/0), and the scalar path
+    # has to give a per-row answer
+    np = _numpy()
+    func = expr.compiled(_array_namespace())[0]
+    with np.errstate(all="ignore"):
+        try:
+            arrays = {name: np.asarray(columns[name], dtype=np.float64) for name in params}
+            result = np.array(np.broadcast_to(np.asarray(func(**arrays), dtype=np.float64), (size,)))
+        except (ArithmeticError, TypeError, ValueError):
+            return None
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+def _evaluate_rows(expr, params, columns, size):
+    func = expr.compiled()[0]
+    values = [None] * size
+    errors = [True] * size
+    for i in range(size):
+        row = {name: columns[name][i] for name in params}
+        # A string cell would otherwise be repeated or concatenated by the operators
+        if not all(isinstance(v, numbers.Number) for v in row.values()):
+            continue
+        try:
+            value = float(func(**row))
+        except Exception:
+            continue
+        if math.isfinite(value):
+            values[i] = value
+            errors[i] = False
+    return values, errors
@@ -0,0 +1,428 @@
+"""
+User-defined constants and functions, e.g. `rate = 0.07` or `f(x) = x^2 + 1`.
+
+An Environment layers one user's definitions over the built-in names of
+each numeric backend. A definition is parsed once and compiled once per
+backend into a plain value or function, so an expression that uses it only
+compiles a call. The environment knows which definitions use which:
+redefining a name recompiles just the definitions that depend on it and
+drops just the cached results that did.
+
+The web app keeps an Environment per session (see Sessions) and checks
+each new definition in an executor worker (see define_in) before adding it;
+the desktop calculator has one of its own.
+"""
+import keyword
+import os
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+import engine
+import numeric
+from engine import BinOp, Call, Name, UnaryOp
+
+MAX_DEFINITIONS = 100
+CACHE_SIZE = 256
+MAX_SESSIONS = int(os.environ.get("CALCIFY_MAX_SESSIONS", 1000))
+# Environments rebuilt from definition texts, per process (see evaluate_in)
+SHARED_SIZE = 32
+
+_DEFINITION_RE = re.compile(r"\s*([A-Za-z_]\w*)\s*(?:\(([^()]*)\))?\s*=(?!=)(.*)", re.S)
+_NAME_RE = re.compile(r"[A-Za-z_]\w*")
+
+_MISSING = object()
+
+# `params` is None for a constant, else the parameter names in order.
+# `uses` holds the other definitions the body refers to directly.
+Definition = namedtuple("Definition", "name params body uses")
+
+
+def is_definition(text):
+    """True if text has the `name = ...` or `name(args) = ...` shape."""
+    return isinstance(text, str) and _DEFINITION_RE.fullmatch(text) is not None
+
+
+def parse_definition(text):
+    """(name, params, body Expression) for definition text; params is None for a constant."""
+    match = _DEFINITION_RE.fullmatch(text) if isinstance(text, str) else None
+    if match is None:
+        raise engine.ExpressionError("Not a definition")
+    name, params, body = match.groups()
+    if name in engine.ALLOWED_NAMES or not _valid_name(name):
+        raise engine.ExpressionError(f"Can't define {name!r}")
+    if params is not None:
+        params = tuple(param.strip() for param in params.split(",")) if params.strip() else ()
+        for param in params:
+            if not _valid_name(param):
+                raise engine.ExpressionError(f"Invalid parameter {param!r}")
+        if len(set(params)) != len(params):
+            raise engine.ExpressionError(f"Repeated parameter in {name!r}")
+    return name, params, engine.compile_expression(body)
+
+
+def _valid_name(name):
+    return _NAME_RE.fullmatch(name) is not None and not name.startswith("_") and not keyword.iskeyword(name)
+
+
+def definition_text(definition):
+    body = definition.body.text
+    if definition.params is None:
+        return f"{definition.name} = {body}"
+    return f"{definition.name}({', '.join(definition.params)}) = {body}"
+
+
+def _names(tree):
+    # Every name and function name in the tree
+    found = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Name):
+            found.add(node.id)
+        elif isinstance(node, UnaryOp):
+            stack.append(node.operand)
+        elif isinstance(node, BinOp):
+            stack.extend((node.left, node.right))
+        elif isinstance(node, Call):
+            found.add(node.func)
+            stack.extend(node.args)
+    return found
+
+
+def _user_function(name, params, func, used):
+    # compile_tree's function takes the parameters the body uses, sorted
+    if used == params:
+        return func
+    index = [params.index(param) for param in used]
+
+    def call(*args):
+        if len(args) != len(params):
+            raise TypeError(f"{name}() takes {len(params)} arguments")
+        return func(*[args[i] for i in index])
+    return call
+
+
+class Environment:
+    def __init__(self):
+        self._definitions = OrderedDict()
+        # (mode, precision) -> built-in names plus compiled definitions
+        self._namespaces = {}
+        self._backends = {}
+        # (text, mode, precision) -> [func, params, definitions used, value]
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        # Bumped on every change, so late results from old definitions are dropped
+        self.version = 0
+
+    def __len__(self):
+        return len(self._definitions)
+
+    # --- Definitions ---
+    def define(self, text, check=True):
+        """
+        Add or replace the definition in `text`; returns its Definition.
+        With check=False nothing is compiled or evaluated here: the caller
+        has already checked it with define_in, and compiled namespaces are
+        dropped rather than rebuilt.
+        """
+        name, params, body = parse_definition(text)
+        with self._lock:
+            if name not in self._definitions and len(self._definitions) >= MAX_DEFINITIONS:
+                raise engine.ExpressionError(f"At most {MAX_DEFINITIONS} definitions")
+            uses = frozenset(n for n in _names(body.tree) - set(params or ())
+                             if n in self._definitions or n == name)
+            if name in uses or name in self._closure(uses):
+                raise engine.ExpressionError(f"{name!r} can't depend on itself")
+            definition = Definition(name, params, body, uses)
+            previous = self._definitions.get(name)
+            self._definitions[name] = definition
+            if not check:
+                self._changed(name, recompile=False)
+                return definition
+            try:
+                self._changed(name)
+                # Compiling for float checks the body's names (and constants' values)
+                self.namespace(numeric.FLOAT)
+            except Exception:
+                if previous is None:
+                    del self._definitions[name]
+                else:
+                    self._definitions[name] = previous
+                self._changed(name)
+                raise
+        return definition
+
+    def remove(self, name):
+        with self._lock:
+            if name not in self._definitions:
+                raise KeyError(name)
+            users = sorted(self._dependents(name) - {name})
+            if users:
+                raise engine.ExpressionError(f"{name!r} is used by {users[0]!r}")
+            del self._definitions[name]
+            self._changed(name)
+
+    def clear(self):
+        with self._lock:
+            self._definitions.clear()
+            self._namespaces.clear()
+            self._backends.clear()
+            self._cache.clear()
+            self.version += 1
+
+    def definitions(self):
+        """Definition texts, each after the ones it uses, so they can be replayed."""
+        with self._lock:
+            return [definition_text(self._definitions[name]) for name in self._order(self._definitions)]
+
+    def snapshot(self):
+        """(definitions(), version), taken together."""
+        with self._lock:
+            return self.definitions(), self.version
+
+    def uses(self, text):
+        """Names of the definitions `text` depends on, directly or not."""
+        try:
+            names = _names(engine.compile_expression(text).tree)
+        except (engine.ExpressionError, TypeError, AttributeError):
+            return frozenset()
+        with self._lock:
+            direct = {name for name in names if name in self._definitions}
+            return frozenset(direct | self._closure(direct))
+
+    # --- Namespaces ---
+    def namespace(self, backend):
+        """`backend`'s names plus every definition compiled for it."""
+        key = (backend.mode, backend.precision)
+        with self._lock:
+            namespace = self._namespaces.get(key)
+            if namespace is None:
+                namespace = dict(backend.namespace)
+                for name in self._order(self._definitions):
+                    namespace[name] = self._compile(self._definitions[name], namespace, backend)
+                self._namespaces[key] = namespace
+            return namespace
+
+    def backend(self, mode="float", precision=numeric.DEFAULT_PRECISION):
+        """A numeric.Backend that resolves names through this environment."""
+        base = numeric.get_backend(mode, precision)
+        key = (base.mode, base.precision)
+        with self._lock:
+            backend = self._backends.get(key)
+            if backend is None:
+                backend = self._backends[key] = numeric.Backend(
+                    base.mode, self.namespace(base), base.literal, base.promote, base.precision)
+            return backend
+
+    def _compile(self, definition, namespace, backend):
+        if definition.params is None:
+            func, params = engine.compile_tree(definition.body.tree, namespace, backend.literal)
+            if params:
+                raise engine.ExpressionError(f"Unknown name {params[0]!r}")
+            return backend.call(func, params)
+        # Parameters shadow built-in and defined names inside the body
+        scope = namespace
+        if any(param in namespace for param in definition.params):
+            scope = {k: v for k, v in namespace.items() if k not in definition.params}
+        func, used = engine.compile_tree(definition.body.tree, scope, backend.literal)
+        unknown = [name for name in used if name not in definition.params]
+        if unknown:
+            raise engine.ExpressionError(f"Unknown name {unknown[0]!r}")
+        return _user_function(definition.name, definition.params, func, used)
+
+    # Caller holds self._lock
+    def _changed(self, name, recompile=True):
+        # Recompile `name` and its dependents into new namespaces; everything
+        # else (and code already compiled against it) stays valid
+        affected = self._dependents(name)
+        order = [n for n in self._order(self._definitions) if n in affected]
+        if not recompile:
+            # Rebuilt from the definitions on next use
+            self._namespaces.clear()
+            self._backends.clear()
+        for key, old in list(self._namespaces.items()):
+            namespace = {k: v for k, v in old.items() if k not in affected}
+            try:
+                for n in order:
+                    namespace[n] = self._compile(self._definitions[n], namespace, numeric.get_backend(*key))
+            except Exception:
+                # Rebuilt in full on next use, where the error surfaces
+                del self._namespaces[key]
+            else:
+                self._namespaces[key] = namespace
+            self._backends.pop(key, None)
+        for key in [key for key, entry in self._cache.items() if entry[2] & affected]:
+            del self._cache[key]
+        self.version += 1
+
+    # Caller holds self._lock
+    def _dependents(self, name):
+        affected = {name}
+        grew = True
+        while grew:
+            grew = False
+            for definition in self._definitions.values():
+                if definition.name not in affected and definition.uses & affected:
+                    affected.add(definition.name)
+                    grew = True
+        return affected
+
+    # Caller holds self._lock
+    def _closure(self, names):
+        found = set()
+        stack = list(names)
+        while stack:
+            definition = self._definitions.get(stack.pop())
+            if definition is not None:
+                for name in definition.uses - found:
+                    found.add(name)
+                    stack.append(name)
+        return found
+
+    # Caller holds self._lock
+    def _order(self, names):
+        # Depth-first, so every definition comes after the ones it uses
+        order = []
+        seen = set()
+
+        def visit(name):
+            if name in seen:
+                return
+            seen.add(name)
+            for dep in sorted(self._definitions[name].uses):
+                visit(dep)
+            order.append(name)
+        for name in names:
+            visit(name)
+        return order
+
+    # --- Evaluation ---
+    def evaluate(self, text, variables=None, mode="float", precision=numeric.DEFAULT_PRECISION):
+        """Evaluate `text` with these definitions in scope."""
+        backend = numeric.get_backend(mode, precision)
+        expr = engine.compile_expression(text)
+        key = (expr.text, backend.mode, backend.precision)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[0] is None:
+                func, params = engine.compile_tree(expr.tree, self.namespace(backend), backend.literal)
+                if entry is None:
+                    entry = [None, None, self._depends(expr.tree), _MISSING]
+                entry[0], entry[1] = func, params
+                self._store(key, entry)
+            else:
+                self._cache.move_to_end(key)
+        if not variables and entry[3] is not _MISSING:
+            return entry[3]
+        value = backend.call(entry[0], entry[1], variables)
+        if not variables:
+            entry[3] = value
+        return value
+
+    def lookup(self, text, mode="float", precision=numeric.DEFAULT_PRECISION):
+        """Cached result of `text` in this environment, or None."""
+        backend = numeric.get_backend(mode, precision)
+        key = (engine.normalize(text), backend.mode, backend.precision)
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None or entry[3] is _MISSING:
+                return None
+            self._cache.move_to_end(key)
+            return entry[3]
+
+    def remember(self, text, mode, precision, value, version=None):
+        """
+        Cache a result computed elsewhere (e.g. by evaluate_in in a worker),
+        unless the definitions changed since `version`.
+        """
+        backend = numeric.get_backend(mode, precision)
+        key = (engine.normalize(text), backend.mode, backend.precision)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            entry = self._cache.get(key)
+            if entry is None:
+                entry = [None, None, self._depends(engine.compile_expression(text).tree), value]
+            entry[3] = value
+            self._store(key, entry)
+
+    # Caller holds self._lock
+    def _depends(self, tree):
+        # Free names count too: defining one changes what the expression means
+        names = _names(tree)
+        return frozenset(names | self._closure(names & self._definitions.keys()))
+
+    # Caller holds self._lock
+    def _store(self, key, entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+
+class Sessions:
+    """Environments by session id; the least recently used are dropped."""
+
+    def __init__(self, max_sessions=MAX_SESSIONS):
+        self.max_sessions = max_sessions
+        self._environments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, create=False):
+        with self._lock:
+            environment = self._environments.get(session_id)
+            if environment is not None:
+                self._environments.move_to_end(session_id)
+            elif create:
+                environment = self._environments[session_id] = Environment()
+                while len(self._environments) > self.max_sessions:
+                    self._environments.popitem(last=False)
+            return environment
+
+
+# --- Executor entry points ---
+# Compiled definitions can't be pickled, so jobs carry the definition texts
+# and each process rebuilds (and keeps) an Environment per distinct set.
+_shared = OrderedDict()
+_shared_lock = threading.Lock()
+
+
+def _environment_for(definitions):
+    key = tuple(definitions)
+    with _shared_lock:
+        environment = _shared.get(key)
+        if environment is not None:
+            _shared.move_to_end(key)
+            return environment
+    environment = Environment()
+    for text in definitions:
+        environment.define(text)
+    with _shared_lock:
+        _shared[key] = environment
+        while len(_shared) > SHARED_SIZE:
+            _shared.popitem(last=False)
+    return environment
+
+
+def define_in(definitions, text):
+    """
+    Check that `text` can be added to `definitions`, evaluating its value and
+    those of the constants that use it. Returns the constants' float values,
+    so the executor's result limits apply to them too.
+    """
+    environment = _environment_for(list(definitions) + [text])
+    namespace = environment.namespace(numeric.FLOAT)
+    with environment._lock:
+        return [namespace[d.name] for d in environment._definitions.values() if d.params is None]
+
+
+def evaluate_in(definitions, text, variables=None, mode="float", precision=numeric.DEFAULT_PRECISION):
+    """Evaluate `text` with `definitions` (Environment.definitions()) in scope."""
+    return _environment_for(definitions).evaluate(text, variables, mode, precision)
+
+
+def evaluate_many_in(definitions, texts, variables=None):
+    """engine.evaluate_many with `definitions` in scope."""
+    namespace = _environment_for(definitions).namespace(numeric.FLOAT)
+    return engine.evaluate_many(texts, variables, namespace)
@@ -0,0 +1,258 @@
+"""
+Pluggable evaluation executors.
+
+InlineExecutor runs jobs in the calling thread. ProcessExecutor ships them
+to a warm pool of worker processes, so a runaway expression like 9**9**9
+only ever ties up one worker: each job gets a wall-clock budget, and a
+worker that blows it is killed and replaced.
+"""
+import contextlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from fractions import Fraction
+
+import metrics
+
+EXECUTOR = os.environ.get("CALCIFY_EXECUTOR", "process")   # "process" or "inline"
+POOL_SIZE = int(os.environ.get("CALCIFY_POOL_SIZE", 0)) or os.cpu_count() or 1
+QUEUE_DEPTH = int(os.environ.get("CALCIFY_QUEUE_DEPTH", 64))
+TIME_LIMIT = float(os.environ.get("CALCIFY_TIME_LIMIT", 2.0))
+MAX_RESULT_DIGITS = int(os.environ.get("CALCIFY_MAX_RESULT_DIGITS", 4000))
+
+
+class ExecutorError(Exception):
+    """Base class for jobs the executor refused or gave up on."""
+
+
+class QueueFull(ExecutorError):
+    """More jobs are waiting than the configured queue depth."""
+
+
+class EvaluationTimeout(ExecutorError):
+    """The job ran past its wall-clock budget and was cancelled."""
+
+
+class ResultTooLarge(ExecutorError):
+    """The job's result exceeded the result-size budget."""
+
+
+def check_result(value, max_digits=MAX_RESULT_DIGITS):
+    """Raise ResultTooLarge for oversized ints, Decimals or Fractions anywhere in a result."""
+    if isinstance(value, int):
+        # bit_length is cheap; ~3.32 bits per decimal digit
+        too_large = value.bit_length() > max_digits * 3.33
+    elif isinstance(value, Fraction):
+        too_large = value.numerator.bit_length() + value.denominator.bit_length() > max_digits * 3.33
+    elif isinstance(value, Decimal):
+        too_large = len(value.as_tuple().digits) > max_digits
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            if isinstance(item, (int, Fraction, Decimal, list, tuple)):
+                check_result(item, max_digits)
+        return value
+    else:
+        return value
+    if too_large:
+        raise ResultTooLarge(f"Result has more than {max_digits} digits")
+    return value
+
+
+class _Stats:
+    def __init__(self):
+        self.jobs = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, wait, elapsed):
+        with self._lock:
+            self.jobs += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self.exec_total += elapsed
+            self.exec_max = max(self.exec_max, elapsed)
+
+    def as_dict(self):
+        with self._lock:
+            jobs = self.jobs or 1
+            return {"jobs": self.jobs, "timeouts": self.timeouts, "rejected": self.rejected,
+                    "queue_wait_avg": self.wait_total / jobs, "queue_wait_max": self.wait_max,
+                    "exec_avg": self.exec_total / jobs, "exec_max": self.exec_max}
+
+
+class InlineExecutor:
+    """Runs jobs in the calling thread. Time limits are not enforced."""
+
+    size = 1
+
+    def __init__(self):
+        self.stats = _Stats()
+
+    def run(self, func, *args, timeout=None):
+        start = time.perf_counter()
+        try:
+            return check_result(func(*args))
+        finally:
+            self.stats.record(0.0, time.perf_counter() - start)
+
+    def map(self, func, arg_lists, timeout=None):
+        return [self.run(func, *args, timeout=timeout) for args in arg_lists]
+
+    def shutdown(self):
+        pass
+
+    def metrics(self):
+        return dict(self.stats.as_dict(), kind="inline", size=1)
+
+
+def _worker_main(conn, max_digits):
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        func, args, traced = job
+        # Time stages only when the parent is tracing this request
+        with metrics.tracing(record=False) if traced else contextlib.nullcontext() as trace:
+            try:
+                reply = (True, check_result(func(*args), max_digits))
+            except BaseException as e:
+                reply = (False, e)
+        # Stage timings go back to the parent, which owns the request's trace
+        stages = trace.stages if traced else None
+        try:
+            conn.send(reply + (stages,))
+        except Exception as e:
+            # e.g. an unpicklable result
+            conn.send((False, ExecutorError(str(e)), stages))
+
+
+class _Worker:
+    def __init__(self, context, max_digits):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child, max_digits), daemon=True)
+        self.process.start()
+        child.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class ProcessExecutor:
+    """
+    Warm pool of worker processes.
+
+    At most `size` jobs execute at once and at most `queue_depth` more wait
+    for a free worker; beyond that run() raises QueueFull. Each job has
+    `time_limit` seconds of wall-clock time before its worker is killed.
+    """
+
+    def __init__(self, size=POOL_SIZE, queue_depth=QUEUE_DEPTH, time_limit=TIME_LIMIT,
+                 max_digits=MAX_RESULT_DIGITS):
+        self.size = size
+        self.queue_depth = queue_depth
+        self.time_limit = time_limit
+        self.max_digits = max_digits
+        self.stats = _Stats()
+        # Spawned (not forked) workers don't inherit the server's threads or locks
+        self._context = multiprocessing.get_context("spawn")
+        self._slots = threading.BoundedSemaphore(size + queue_depth)
+        self._idle = None
+        self._start_lock = threading.Lock()
+        self._threads = None
+
+    def _start(self):
+        # Workers are started on first use, not at import time
+        with self._start_lock:
+            if self._idle is None:
+                idle = queue.Queue()
+                for _ in range(self.size):
+                    idle.put(_Worker(self._context, self.max_digits))
+                self._threads = ThreadPoolExecutor(max_workers=self.size)
+                self._idle = idle
+
+    def run(self, func, *args, timeout=None):
+        """Run func(*args) in a worker. `func` must be picklable (module-level)."""
+        if self._idle is None:
+            self._start()
+        if not self._slots.acquire(blocking=False):
+            self.stats.rejected += 1
+            raise QueueFull("Evaluation queue is full")
+        try:
+            queued = time.perf_counter()
+            worker = self._idle.get()
+            started = time.perf_counter()
+            trace = metrics.current()
+            if trace is not None:
+                trace.add("queue_wait", started - queued)
+            try:
+                worker.conn.send((func, args, trace is not None))
+                if not worker.conn.poll(self.time_limit if timeout is None else timeout):
+                    self.stats.timeouts += 1
+                    worker.kill()
+                    worker = _Worker(self._context, self.max_digits)
+                    raise EvaluationTimeout("Evaluation took too long")
+                ok, value, stages = worker.conn.recv()
+                if stages:
+                    trace.merge(stages)
+            except (EOFError, OSError):
+                # The worker died under us (e.g. out of memory)
+                worker.kill()
+                worker = _Worker(self._context, self.max_digits)
+                raise ExecutorError("Worker process died")
+            finally:
+                self._idle.put(worker)
+                self.stats.record(started - queued, time.perf_counter() - started)
+        finally:
+            self._slots.release()
+        if not ok:
+            raise value
+        return value
+
+    def map(self, func, arg_lists, timeout=None):
+        """Run func over many argument tuples across the pool, in order."""
+        if self._idle is None:
+            self._start()
+        futures = [self._threads.submit(self.run, func, *args, timeout=timeout) for args in arg_lists]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        with self._start_lock:
+            if self._idle is None:
+                return
+            while not self._idle.empty():
+                worker = self._idle.get()
+                try:
+                    worker.conn.send(None)
+                except OSError:
+                    pass
+                worker.process.join(1)
+                if worker.process.is_alive():
+                    worker.kill()
+            self._threads.shutdown(wait=False)
+            self._idle = None
+
+    def metrics(self):
+        return dict(self.stats.as_dict(), kind="process", size=self.size,
+                    queue_depth=self.queue_depth, time_limit=self.time_limit)
+
+
+def create(kind=EXECUTOR, **options):
+    if kind == "inline":
+        return InlineExecutor()
+    if kind == "process":
+        return ProcessExecutor(**options)
+    raise ValueError(f"Unknown executor {kind!r}")
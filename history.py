@@ -0,0 +1,320 @@
+"""
+Calculation history shared by the web app and the desktop calculator.
+
+Every evaluation is appended to a local SQLite table with an index on the
+normalized expression, so a repeated calculation is answered from history
+instead of being evaluated again. Results are stored with their type, and
+each row has an owner (a web session, or "" for the desktop app) that
+listing and search can be limited to. Recent lookups are memoized in memory,
+writes are batched, and substring search goes through an FTS5 trigram index
+when the SQLite build has one.
+
+    python history.py search <text>     newest matches first
+    python history.py compact           keep the newest row per calculation
+"""
+import argparse
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+from fractions import Fraction
+
+import engine
+import numeric
+
+HISTORY_PATH = os.environ.get(
+    "CALCIFY_HISTORY_PATH", os.path.join(os.path.expanduser("~"), ".calcify", "history.db"))
+# Rows are written in batches of this many, or once the oldest has waited this long
+FLUSH_ROWS = 128
+FLUSH_SECONDS = 1.0
+MEMO_SIZE = 4096
+# Compaction runs on its own once the table grows past this
+MAX_ROWS = int(os.environ.get("CALCIFY_HISTORY_MAX_ROWS", 5_000_000))
+COMPACT_EVERY = 100_000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY,
+    expression TEXT NOT NULL,
+    normalized TEXT NOT NULL,
+    result TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    precision INTEGER NOT NULL,
+    timestamp REAL NOT NULL,
+    kind TEXT NOT NULL,
+    owner TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS history_recall ON history (normalized, mode, precision);
+"""
+
+# Substring search index, kept in step with the table by triggers
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts
+    USING fts5(normalized, content='history', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history BEGIN
+    INSERT INTO history_fts (rowid, normalized) VALUES (new.id, new.normalized);
+END;
+CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history BEGIN
+    INSERT INTO history_fts (history_fts, rowid, normalized) VALUES ('delete', old.id, old.normalized);
+END;
+"""
+
+_MISSING = object()
+
+
+def normalize(text):
+    """Canonical form for recall: tokens joined without whitespace, ^ as **."""
+    try:
+        return "".join(value for _, value in engine.tokenize(text))
+    except engine.ExpressionError:
+        return engine.normalize(text)
+
+
+def _precision(mode, precision):
+    # Part of the recall key; only decimal results depend on it
+    if mode == "decimal":
+        return int(precision or numeric.DEFAULT_PRECISION)
+    return 0
+
+
+def encode(value):
+    """(kind, text) for a result; decode() turns them back into the same type."""
+    if isinstance(value, float):
+        return "float", repr(value)
+    if isinstance(value, Decimal):
+        return "decimal", str(value)
+    if isinstance(value, Fraction):
+        return "fraction", str(value)
+    return "int", str(value)
+
+
+_DECODERS = {"float": float, "decimal": Decimal, "fraction": Fraction, "int": int}
+
+
+def decode(text, kind):
+    return _DECODERS[kind](text)
+
+
+class HistoryStore:
+    def __init__(self, path=None, max_rows=MAX_ROWS):
+        self.path = path or HISTORY_PATH
+        self.max_rows = max_rows
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.execute("CREATE INDEX IF NOT EXISTS history_owner ON history (owner, id)")
+        try:
+            self._db.executescript(_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # No FTS5 or no trigram tokenizer: substring search scans instead
+            self.fts = False
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._pending_since = 0.0
+        self._memo = OrderedDict()
+        self._appended = 0
+        self._compactor = None
+        atexit.register(self.flush)
+
+    # --- Writing ---
+    def append(self, expression, result, mode="float", precision=None, owner=""):
+        """Record one successful calculation made by `owner`."""
+        normalized = normalize(expression)
+        precision = _precision(mode, precision)
+        encoded = encode(result)
+        with self._lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append((expression, normalized, encoded[1], mode, precision, time.time(),
+                                  encoded[0], owner))
+            self._remember((normalized, mode, precision), encoded)
+            self._appended += 1
+            if (len(self._pending) >= FLUSH_ROWS
+                    or time.monotonic() - self._pending_since >= FLUSH_SECONDS):
+                self._flush()
+            if self._appended % COMPACT_EVERY == 0 and not self._compacting():
+                # Off the request path: counting and deleting millions of rows takes a while
+                self._compactor = threading.Thread(target=self._compact_if_full, daemon=True)
+                self._compactor.start()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    # Caller holds self._lock
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO history (expression, normalized, result, mode, precision, timestamp,"
+                " kind, owner) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    # --- Recall ---
+    def recall(self, expression, mode="float", precision=None):
+        """The most recent result for this calculation by anyone, or None."""
+        key = (normalize(expression), mode, _precision(mode, precision))
+        with self._lock:
+            encoded = self._memo.get(key, _MISSING)
+            if encoded is _MISSING:
+                row = self._db.execute(
+                    "SELECT kind, result FROM history WHERE normalized = ? AND mode = ? AND precision = ?"
+                    " ORDER BY id DESC LIMIT 1", key).fetchone()
+                # Misses are memoized too; append() overwrites them
+                encoded = row
+            self._remember(key, encoded)
+        if encoded is None:
+            return None
+        try:
+            return decode(encoded[1], encoded[0])
+        except (KeyError, ValueError, ArithmeticError):
+            return None
+
+    # Caller holds self._lock
+    def _remember(self, key, encoded):
+        self._memo[key] = encoded
+        self._memo.move_to_end(key)
+        if len(self._memo) > MEMO_SIZE:
+            self._memo.popitem(last=False)
+
+    # --- Search ---
+    def recent(self, limit=50, before=None, owner=None):
+        """
+        Newest entries first; pass the last id seen as `before` to page.
+        With `owner`, only that owner's entries.
+        """
+        return self._select("", (), limit, before, owner)
+
+    def search(self, text, prefix=False, limit=50, before=None, owner=None):
+        """
+        Entries whose normalized expression starts with (prefix=True) or
+        contains `text`, newest first, optionally only `owner`'s.
+        """
+        text = normalize(text)
+        if not text:
+            return self.recent(limit, before, owner)
+        if prefix:
+            # A range scan on the index; U+10FFFF sorts after any real character
+            return self._select("normalized >= ? AND normalized < ?", (text, text + "\U0010ffff"),
+                                limit, before, owner)
+        if self.fts and len(text) >= 3:
+            return self._select("id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)",
+                                ('"' + text.replace('"', '""') + '"',), limit, before, owner)
+        # Trigram queries need 3 characters; shorter ones scan
+        escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return self._select("normalized LIKE ? ESCAPE '\\'", ("%" + escaped + "%",), limit, before,
+                            owner)
+
+    def _select(self, where, params, limit, before, owner=None):
+        clauses = [where] if where else []
+        if owner is not None:
+            clauses.append("owner = ?")
+            params += (owner,)
+        if before is not None:
+            clauses.append("id < ?")
+            params += (before,)
+        sql = "SELECT id, expression, result, mode, precision, timestamp FROM history"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY id DESC LIMIT ?"
+        with self._lock:
+            self._flush()
+            rows = self._db.execute(sql, params + (int(limit),)).fetchall()
+        return [{"id": id, "expression": expression, "result": result, "mode": mode,
+                 "precision": precision or None, "timestamp": timestamp}
+                for id, expression, result, mode, precision, timestamp in rows]
+
+    # --- Maintenance ---
+    def compact(self, vacuum=False):
+        """
+        Drop all but the newest row per (owner, normalized, mode, precision), then
+        the oldest rows beyond max_rows. Returns the number of rows removed.
+        """
+        removed = self._compact()
+        if vacuum:
+            with self._lock:
+                self._db.execute("VACUUM")
+        return removed
+
+    def _compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    def _compact_if_full(self):
+        with self._lock:
+            full = self._count() > self.max_rows
+        if full:
+            self._compact()
+
+    # Caller holds self._lock
+    def _count(self):
+        self._flush()
+        return self._db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def _compact(self):
+        # The lock is taken per statement so appends and recalls get in between
+        removed = 0
+        with self._lock:
+            self._flush()
+            with self._db:
+                removed += self._db.execute(
+                    "DELETE FROM history WHERE id NOT IN"
+                    " (SELECT MAX(id) FROM history GROUP BY owner, normalized, mode, precision)"
+                ).rowcount
+        with self._lock, self._db:
+            removed += self._db.execute(
+                "DELETE FROM history WHERE id <= (SELECT id FROM history ORDER BY id DESC"
+                " LIMIT 1 OFFSET ?)", (self.max_rows,)).rowcount
+        if self.fts:
+            with self._lock, self._db:
+                self._db.execute("INSERT INTO history_fts (history_fts) VALUES ('optimize')")
+        with self._lock:
+            self._memo.clear()
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._pending = []
+            self._memo.clear()
+            with self._db:
+                self._db.execute("DELETE FROM history")
+
+    def close(self):
+        atexit.unregister(self.flush)
+        if self._compactor is not None:
+            self._compactor.join()
+        with self._lock:
+            self._flush()
+            self._db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search or compact the calculation history")
+    parser.add_argument("--path", default=HISTORY_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    search = commands.add_parser("search")
+    search.add_argument("text")
+    search.add_argument("--prefix", action="store_true")
+    search.add_argument("--limit", type=int, default=20)
+    commands.add_parser("compact")
+    args = parser.parse_args()
+
+    store = HistoryStore(args.path)
+    if args.command == "search":
+        for entry in store.search(args.text, args.prefix, args.limit):
+            print(f"{entry['expression']} = {entry['result']}  ({entry['mode']})")
+    else:
+        print(f"Removed {store.compact(vacuum=True)} rows")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Incremental expression evaluation for the desktop calculator.
+
+Text is fed in as it's committed (an operand plus its operator) and reduced
+shunting-yard style as soon as precedence allows, so the pending state only
+holds open brackets and operators still waiting on a right-hand side. A chain
+of thousands of terms is folded into a running value as it arrives; each key
+press costs the size of that small state, not the length of the expression.
+
+Operators, precedence and associativity match engine's parser, and values
+come from the same numeric backends, so results agree with numeric.evaluate.
+That includes its exact-int fast path: the decimal and rational modes also
+run a native-int state for as long as the input stays exact-int.
+"""
+import contextlib
+import numbers
+import operator
+from decimal import Context, Decimal, localcontext
+
+import engine
+import numeric
+
+# Same binding strengths as engine's parser; unary sits between * and **
+_PRECEDENCE = {"+": 1, "-": 1, "*": 2, "/": 2, "//": 2, "%": 2, "**": 4}
+_UNARY_PRECEDENCE = 3
+_BINARY_FUNCS = {"+": operator.add, "-": operator.sub, "*": operator.mul,
+                 "/": operator.truediv, "//": operator.floordiv,
+                 "%": operator.mod, "**": operator.pow}
+
+# Committed text is kept for the display and history; only this much is shown
+TAIL_CHARS = 64
+
+
+class _State:
+    """Operand and operator stacks, plus what the next token must be."""
+
+    __slots__ = ("literal", "values", "ops", "expect_operand", "name", "error", "exact", "exponent")
+
+    def __init__(self, literal, exact=False):
+        self.literal = literal
+        self.values = []
+        # ("bin", op) | ("unary", op) | ("(",) | ("call", func, first value index)
+        self.ops = []
+        self.expect_operand = True
+        self.name = None    # a name that may still turn out to be a call
+        self.error = None
+        # Whether the input is still exact-int (see engine.is_exact_int), and
+        # where we are in a `** <literal>` (1: want literal, 2: just had it)
+        self.exact = exact
+        self.exponent = 0
+
+    def copy(self):
+        state = _State(self.literal)
+        for name in self.__slots__[1:]:
+            setattr(state, name, getattr(self, name))
+        state.values = list(self.values)
+        state.ops = list(self.ops)
+        return state
+
+    def track_exact(self, kind, value):
+        if self.exponent == 1:
+            self.exponent = 2
+            self.exact = kind == "num" and value.isdigit()
+            return
+        if self.exponent == 2:
+            self.exponent = 0
+            if value == "**":
+                # The exponent is itself a power, not a literal
+                self.exact = False
+                return
+        if kind == "num":
+            self.exact = value.isdigit()
+        elif kind == "name" or value in ("/", ","):
+            self.exact = False
+        elif value == "**":
+            self.exponent = 1
+
+
+class IncrementalEvaluator:
+    def __init__(self, backend=numeric.FLOAT):
+        self.backend = backend
+        self.reset()
+
+    def reset(self):
+        self._state = _State(self.backend.literal)
+        # Shadow state in native ints, dropped once the input isn't exact-int
+        self._exact = None if self.backend.mode == "float" else _State(engine.float_literal, exact=True)
+        self._parts = []
+        self._tail = ""
+
+    @property
+    def text(self):
+        """All committed text so far."""
+        return "".join(self._parts)
+
+    def tail(self, chars=TAIL_CHARS):
+        if len(self._tail) > chars:
+            return "…" + self._tail[-chars:]
+        return self._tail
+
+    def set_backend(self, backend):
+        """Switch numeric backend, replaying what was committed so far."""
+        text = self.text
+        self.backend = backend
+        self.reset()
+        if text:
+            self.feed(text)
+
+    def feed(self, text):
+        """Commit more expression text. Errors are kept until reset()."""
+        self._parts.append(text)
+        self._tail = (self._tail + text)[-TAIL_CHARS - 1:]
+        with self._context():
+            self._push_text(self._state, text)
+        if self._exact is not None:
+            self._push_text(self._exact, text)
+            if not self._exact.exact:
+                self._exact = None
+
+    def preview(self, pending=""):
+        """
+        Value of the committed text plus `pending` (the operand still being
+        typed), with open brackets closed. None while that isn't a complete,
+        valid expression.
+        """
+        try:
+            return self._finish(pending, close=True)
+        except Exception:
+            return None
+
+    def result(self, pending="", close=False):
+        """
+        Value of the committed text plus `pending`; raises like evaluate().
+        With close=True open brackets are closed first, as in preview().
+        """
+        return self._finish(pending, close)
+
+    # --- Internals ---
+    def _context(self):
+        # Decimal backends round every step at their precision
+        if self.backend.precision is None:
+            return contextlib.nullcontext()
+        return localcontext(Context(prec=self.backend.precision))
+
+    def _finish(self, pending, close):
+        if self._exact is not None:
+            state = self._exact.copy()
+            self._push_text(state, pending)
+            if state.exact:
+                value = self._reduce(state, close)
+                if self.backend.precision is None:
+                    return self.backend.promote(value)
+                with self._context():
+                    return +Decimal(value)
+        state = self._state.copy()
+        with self._context():
+            self._push_text(state, pending)
+            return self._reduce(state, close)
+
+    def _reduce(self, state, close):
+        if state.error is not None:
+            raise state.error
+        self._flush_name(state)
+        if state.expect_operand:
+            raise engine.ExpressionError("Unexpected end of expression" if state.ops or state.values
+                                         else "Empty expression")
+        while state.ops:
+            entry = state.ops[-1]
+            if entry[0] in ("(", "call"):
+                if not close:
+                    raise engine.ExpressionError("Expected ')', got None")
+                self._push_token(state, "op", ")")
+            else:
+                self._apply(state, state.ops.pop())
+        return state.values[-1]
+
+    def _push_text(self, state, text):
+        if state.error is not None:
+            return
+        try:
+            for kind, value in engine.tokenize(text):
+                self._push_token(state, kind, value)
+        except Exception as e:
+            state.error = e
+
+    def _push_token(self, state, kind, value):
+        if state.exact:
+            state.track_exact(kind, value)
+            if not state.exact:
+                return
+        if state.name is not None:
+            name, state.name = state.name, None
+            if value == "(":
+                state.ops.append(("call", self._function(name), len(state.values)))
+                state.expect_operand = True
+                return
+            state.values.append(self._value(name))
+
+        if kind == "num":
+            self._operand(state)
+            state.values.append(state.literal(value))
+            state.expect_operand = False
+        elif kind == "name":
+            self._operand(state)
+            state.name = value
+            state.expect_operand = False
+        elif value == "(":
+            self._operand(state)
+            state.ops.append(("(",))
+        elif value in (")", ","):
+            self._close(state, value)
+        elif state.expect_operand:
+            if value not in ("+", "-"):
+                raise engine.ExpressionError(f"Unexpected token {value!r}")
+            state.ops.append(("unary", value))
+        else:
+            precedence = _PRECEDENCE[value]
+            right = value == "**"
+            while state.ops:
+                top = state.ops[-1]
+                if top[0] == "bin":
+                    top_precedence = _PRECEDENCE[top[1]]
+                elif top[0] == "unary":
+                    top_precedence = _UNARY_PRECEDENCE
+                else:
+                    break
+                if top_precedence < precedence or (right and top_precedence == precedence):
+                    break
+                self._apply(state, state.ops.pop())
+            state.ops.append(("bin", value))
+            state.expect_operand = True
+
+    def _operand(self, state):
+        if not state.expect_operand:
+            raise engine.ExpressionError("Unexpected token after operand")
+
+    def _close(self, state, value):
+        ops = state.ops
+        empty_call = (value == ")" and state.expect_operand and ops and ops[-1][0] == "call"
+                      and ops[-1][2] == len(state.values))
+        if state.expect_operand and not empty_call:
+            raise engine.ExpressionError(f"Unexpected token {value!r}")
+        while ops and ops[-1][0] in ("bin", "unary"):
+            self._apply(state, ops.pop())
+        if not ops:
+            raise engine.ExpressionError(f"Unexpected token {value!r}")
+        if value == ",":
+            if ops[-1][0] != "call":
+                raise engine.ExpressionError("Unexpected token ','")
+            state.expect_operand = True
+            return
+        entry = ops.pop()
+        if entry[0] == "call":
+            _, func, start = entry
+            args = state.values[start:]
+            del state.values[start:]
+            state.values.append(func(*args))
+        state.expect_operand = False
+
+    def _flush_name(self, state):
+        if state.name is not None:
+            name, state.name = state.name, None
+            state.values.append(self._value(name))
+
+    def _function(self, name):
+        try:
+            func = engine.resolve(name, self.backend.namespace)
+        except KeyError:
+            raise engine.ExpressionError(f"Unknown function {name!r}") from None
+        if not callable(func):
+            raise engine.ExpressionError(f"{name!r} is not a function")
+        return func
+
+    def _value(self, name):
+        try:
+            value = engine.resolve(name, self.backend.namespace)
+        except KeyError:
+            raise engine.ExpressionError(f"Unknown name {name!r}") from None
+        if callable(value) or not isinstance(value, numbers.Number):
+            raise engine.ExpressionError(f"{name!r} is not a value")
+        return value
+
+    def _apply(self, state, entry):
+        if entry[0] == "unary":
+            operand = state.values.pop()
+            state.values.append(-operand if entry[1] == "-" else +operand)
+            return
+        right = state.values.pop()
+        left = state.values.pop()
+        op = entry[1]
+        func = self.backend.namespace.get(op) or _BINARY_FUNCS[op]
+        state.values.append(func(left, right))
+
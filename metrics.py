@@ -0,0 +1,238 @@
+"""
+Lightweight instrumentation: counters, histograms and per-request traces,
+exported in Prometheus text format by the web app's /metrics route.
+
+Hot paths only pay for timing when a trace is active on the current thread
+(the web app starts one per request); the desktop app never does.
+"""
+import bisect
+import heapq
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from 10us to 10s
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Keep the N slowest traced requests with their stage timings (0 = off)
+PROFILE_SLOWEST = int(os.environ.get("CALCIFY_PROFILE_SLOWEST", 0))
+
+
+def _labels_text(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels_text(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}   # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    le = _labels_text(self.labels, values, [("le", repr(bound))])
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                le = _labels_text(self.labels, values, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{le} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels_text(self.labels, values)} {series[-2]}")
+                lines.append(f"{self.name}_count{_labels_text(self.labels, values)} {series[-1]}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Gauge:
+    """A value read from a callback at scrape time."""
+
+    def __init__(self, name, help, read):
+        self.name = name
+        self.help = help
+        self.read = read
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge",
+                f"{self.name} {self.read()}"]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        # Re-registering a name returns the existing metric (module reloads)
+        return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                continue
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labels=()):
+    return REGISTRY.register(Counter(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labels, buckets))
+
+
+def gauge(name, help, read):
+    return REGISTRY.register(Gauge(name, help, read))
+
+
+def render():
+    return REGISTRY.render()
+
+
+# --- Traces ---
+STAGES = histogram("calc_stage_seconds", "Time spent in each evaluation stage", ["stage"])
+
+_local = threading.local()
+
+
+class Trace:
+    """Stage timings for one request, accumulated on the current thread."""
+
+    __slots__ = ("label", "stages", "start")
+
+    def __init__(self, label):
+        self.label = label
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def merge(self, stages):
+        for stage, seconds in stages.items():
+            self.add(stage, seconds)
+
+
+def current():
+    """The active trace on this thread, or None."""
+    return getattr(_local, "trace", None)
+
+
+class tracing:
+    """
+    Activate a Trace for the duration of a with-block. On exit its stage
+    timings are recorded into calc_stage_seconds and offered to the
+    slowest-N profiler. With record=False (worker processes) the timings are
+    only collected, for the caller to ship back.
+    """
+
+    def __init__(self, label="", record=True):
+        self.trace = Trace(label)
+        self.record = record
+
+    def __enter__(self):
+        self._previous = current()
+        _local.trace = self.trace
+        return self.trace
+
+    def __exit__(self, *exc):
+        _local.trace = self._previous
+        if self.record:
+            finish(self.trace)
+
+
+def finish(trace):
+    for stage, seconds in trace.stages.items():
+        STAGES.observe(seconds, stage)
+    if PROFILE_SLOWEST:
+        profiler.offer(time.perf_counter() - trace.start, trace)
+
+
+class SlowestProfiler:
+    """Keeps the N slowest traces seen (a min-heap on total time)."""
+
+    def __init__(self, size):
+        self.size = size
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def offer(self, total, trace):
+        with self._lock:
+            self._counter += 1
+            entry = (total, self._counter, trace.label[:200], dict(trace.stages))
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, entry)
+            elif total > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+
+    def snapshot(self):
+        with self._lock:
+            entries = sorted(self._heap, reverse=True)
+        return [{"expression": label, "total": total, "stages": stages}
+                for total, _, label, stages in entries]
+
+
+profiler = SlowestProfiler(PROFILE_SLOWEST)
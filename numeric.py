@@ -0,0 +1,232 @@
+"""
+Selectable numeric backends for expression evaluation.
+
+    float     native floats via `math` (the default, unchanged fast path)
+    decimal   decimal.Decimal at a configurable precision
+    rational  exact fractions.Fraction; irrational functions fall back to float
+
+Expressions that only combine integer literals with + - * // % and integer
+powers are exact in native ints, so the decimal and rational modes evaluate
+those on the plain compiled function and only convert the final result.
+"""
+import threading
+from collections import OrderedDict
+from decimal import Decimal, localcontext, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN
+from fractions import Fraction
+from types import SimpleNamespace
+
+import engine
+
+MODES = ("float", "decimal", "rational")
+DEFAULT_PRECISION = 28
+MAX_PRECISION = 1000
+
+
+# --- Decimal functions ---
+# Series recipes from the decimal module docs; they work at the precision of
+# the current context.
+def _d(x):
+    if isinstance(x, Decimal):
+        return x
+    if isinstance(x, float):
+        return Decimal(repr(x))
+    return Decimal(x)
+
+
+def _dec_pi():
+    with localcontext() as ctx:
+        ctx.prec += 2
+        three = Decimal(3)
+        lasts, t, s, n, na, d, da = 0, three, 3, 1, 0, 0, 24
+        while s != lasts:
+            lasts = s
+            n, na = n + na, na + 8
+            d, da = d + da, da + 32
+            t = (t * n) / d
+            s += t
+    return +s
+
+
+def _dec_series(x, i, s, num):
+    # Shared tail of the sin/cos Taylor series
+    with localcontext() as ctx:
+        ctx.prec += 2
+        lasts, fact, sign = 0, 1, 1
+        while s != lasts:
+            lasts = s
+            i += 2
+            fact *= i * (i - 1)
+            num *= x * x
+            sign *= -1
+            s += num / fact * sign
+    return +s
+
+
+def _dec_reduce(x):
+    # Bring the argument into [-2pi, 2pi] so the series converges quickly
+    x = _d(x)
+    return x % (2 * _dec_pi())
+
+
+def _dec_sin(x):
+    x = _dec_reduce(x)
+    return _dec_series(x, 1, x, x)
+
+
+def _dec_cos(x):
+    x = _dec_reduce(x)
+    return _dec_series(x, 0, Decimal(1), Decimal(1))
+
+
+def _dec_tan(x):
+    return _dec_sin(x) / _dec_cos(x)
+
+
+def _dec_floordiv(a, b):
+    # Decimal's // and % truncate toward zero; floor them to match int,
+    # float and Fraction
+    a, b = _d(a), _d(b)
+    quotient, remainder = divmod(a, b)
+    if remainder and (remainder < 0) != (b < 0):
+        quotient -= 1
+    return quotient
+
+
+def _dec_mod(a, b):
+    a, b = _d(a), _d(b)
+    remainder = a % b
+    if remainder and (remainder < 0) != (b < 0):
+        remainder += b
+    return remainder
+
+
+def _decimal_names():
+    # Built inside the backend's context so pi and e carry its precision
+    funcs = {"sin": _dec_sin, "cos": _dec_cos, "tan": _dec_tan,
+             "log": lambda x: _d(x).log10(), "ln": lambda x: _d(x).ln(),
+             "sqrt": lambda x: _d(x).sqrt(), "exp": lambda x: _d(x).exp()}
+    consts = {"pi": _dec_pi(), "e": Decimal(1).exp()}
+    math_ns = SimpleNamespace(log10=funcs["log"], log=funcs["ln"], fabs=lambda x: abs(_d(x)),
+                              floor=lambda x: _d(x).to_integral_value(rounding=ROUND_FLOOR),
+                              ceil=lambda x: _d(x).to_integral_value(rounding=ROUND_CEILING),
+                              **{k: v for k, v in funcs.items() if k not in ("log", "ln")},
+                              **consts)
+    # Operator keys aren't valid names, so only the compiler looks them up
+    return dict(funcs, math=math_ns, **consts, **{"//": _dec_floordiv, "%": _dec_mod})
+
+
+# --- Backends ---
+class Backend:
+    def __init__(self, mode, namespace, literal, promote, precision=None):
+        self.mode = mode
+        self.namespace = namespace
+        self.literal = literal
+        self.promote = promote
+        self.precision = precision
+
+    def evaluate(self, expr, variables=None):
+        return self.call(*expr.compiled(self.namespace, self.literal), variables)
+
+    def call(self, func, params, variables=None):
+        """Run a function compiled against this backend (see engine.compile_tree)."""
+        args = {}
+        if params:
+            variables = variables or {}
+            missing = [name for name in params if name not in variables]
+            if missing:
+                raise engine.ExpressionError(f"Unknown name {missing[0]!r}")
+            args = {name: self.promote(variables[name]) for name in params}
+        if self.precision is None:
+            return func(**args)
+        with localcontext() as ctx:
+            ctx.prec = self.precision
+            return +_d(func(**args))
+
+
+def _decimal_literal(text):
+    return Decimal(text)
+
+
+def _fraction_literal(text):
+    return Fraction(text)
+
+
+def _to_fraction(value):
+    if isinstance(value, float):
+        return Fraction(repr(value))
+    return Fraction(value)
+
+
+FLOAT = Backend("float", engine.ALLOWED_NAMES, engine.float_literal, lambda value: value)
+# math functions accept Fractions and return floats, which is the intended
+# fallback for irrational results
+RATIONAL = Backend("rational", dict(engine.ALLOWED_NAMES), _fraction_literal, _to_fraction)
+
+_decimal_backends = OrderedDict()
+_decimal_lock = threading.Lock()
+
+
+def decimal_backend(precision=DEFAULT_PRECISION):
+    """Decimal backend at `precision` significant digits (a few are kept)."""
+    precision = max(1, min(int(precision), MAX_PRECISION))
+    with _decimal_lock:
+        backend = _decimal_backends.get(precision)
+        if backend is not None:
+            _decimal_backends.move_to_end(precision)
+            return backend
+    with localcontext() as ctx:
+        ctx.prec = precision
+        namespace = _decimal_names()
+    backend = Backend("decimal", namespace, _decimal_literal, _d, precision)
+    with _decimal_lock:
+        _decimal_backends[precision] = backend
+        while len(_decimal_backends) > 8:
+            _decimal_backends.popitem(last=False)
+    return backend
+
+
+def get_backend(mode="float", precision=DEFAULT_PRECISION):
+    if mode == "float":
+        return FLOAT
+    if mode == "decimal":
+        return decimal_backend(precision)
+    if mode == "rational":
+        return RATIONAL
+    raise ValueError(f"Unknown numeric mode {mode!r}")
+
+
+def evaluate(text, variables=None, mode="float", precision=DEFAULT_PRECISION):
+    """Evaluate an expression with the chosen numeric backend."""
+    backend = get_backend(mode, precision)
+    if backend is FLOAT:
+        return engine.evaluate(text, variables)
+    expr = engine.compile_expression(text)
+    if not variables and expr.exact_int:
+        # Fast path: exact in native ints, only the result is promoted
+        value = expr.evaluate()
+        if backend.precision is None:
+            return backend.promote(value)
+        with localcontext() as ctx:
+            ctx.prec = backend.precision
+            return +Decimal(value)
+    return backend.evaluate(expr, variables)
+
+
+def to_json(value):
+    """JSON-safe form of a result: Decimals and Fractions become strings."""
+    if isinstance(value, (Decimal, Fraction)):
+        return str(value)
+    return value
+
+
+def check_result(value):
+    """value, or ValueError if it is complex or not finite (JSON has no form for it)."""
+    finite = value.is_finite() if isinstance(value, Decimal) else engine.is_finite(value)
+    if not finite:
+        raise ValueError("Result is not a finite real number")
+    return value
+
+
+def quantize(value, places=4):
+    """Round a Decimal (or anything Decimal accepts) half-even to `places`."""
+    return _d(value).quantize(Decimal(1).scaleb(-places), rounding=ROUND_HALF_EVEN)
@@ -0,0 +1,317 @@
+"""
+Currency rate cache shared by the web app and the desktop calculator.
+
+Rates are cached per base currency with a TTL. Once an entry goes stale it
+is still served while a single background refresh runs, and concurrent cold
+requests wait on one upstream fetch instead of each hitting the API.
+
+A cache given a path also persists its snapshots there (see
+write_snapshots for the format), so a restart starts from the last known
+rates: they are read on first use, and only refetched once stale.
+"""
+import hashlib
+import json
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import metrics
+
+# `{base}` is filled with the requested base currency. Point this at a local
+# stub server for testing.
+CURRENCY_API_URL = os.environ.get(
+    "CALCIFY_CURRENCY_URL", "https://api.exchangerate-api.com/v4/latest/{base}")
+CURRENCY_TTL = float(os.environ.get("CALCIFY_CURRENCY_TTL", 3600))
+FETCH_TIMEOUT = 10
+# A failed fetch is remembered this long, so a down upstream (or a bad
+# base) isn't retried by every request for it
+FAILURE_TTL = float(os.environ.get("CALCIFY_CURRENCY_FAILURE_TTL", 30))
+MAX_ENTRIES = 16
+# Where the desktop app keeps its rates between runs
+SNAPSHOT_PATH = os.environ.get(
+    "CALCIFY_RATES_PATH", os.path.join(os.path.expanduser("~"), ".calcify", "rates.bin"))
+
+FETCH_TIME = metrics.histogram("currency_fetch_seconds", "Upstream rate fetch latency")
+
+_BASE = re.compile(r"[A-Z]{3}")
+
+
+def valid_base(base):
+    """True for a three-letter upper-case currency code, the only thing put into the URL."""
+    return isinstance(base, str) and _BASE.fullmatch(base) is not None
+
+
+class RateSnapshot:
+    """One fetched payload plus when it was fetched."""
+
+    def __init__(self, data, fetched_at, version=1):
+        self.data = data
+        self.fetched_at = fetched_at
+        # Bumped by merged() whenever a rate actually changes
+        self.version = version
+        # Response bodies per wire format, encoded on first use
+        self._encoded = {}
+
+    @property
+    def rates(self):
+        return self.data.get("rates", {})
+
+    @property
+    def age(self):
+        return max(0.0, time.time() - self.fetched_at)
+
+    @property
+    def last_updated(self):
+        return datetime.fromtimestamp(self.fetched_at)
+
+    def metadata(self, ttl):
+        return {"last_updated": self.last_updated.isoformat(timespec="seconds"),
+                "age": round(self.age, 3),
+                "stale": self.age > ttl}
+
+    def merged(self, data, fetched_at):
+        """
+        A newer snapshot from a fresh payload. Rates missing from `data` are
+        kept; the version only moves on if some rate changed.
+        """
+        rates = dict(self.rates)
+        new_rates = data.get("rates", {})
+        changed = any(rates.get(code) != rate for code, rate in new_rates.items())
+        rates.update(new_rates)
+        return RateSnapshot(dict(data, rates=rates), fetched_at, self.version + changed)
+
+    def encoded(self, fmt, encode):
+        """
+        (body, etag) for this snapshot in wire format `fmt`, encoded once by
+        `encode(payload, fmt)`. The body only changes on refresh; age and
+        staleness belong in response headers.
+        """
+        cached = self._encoded.get(fmt)
+        if cached is None:
+            payload = dict(self.data)
+            payload["cache"] = {"last_updated": self.last_updated.isoformat(timespec="seconds")}
+            body = encode(payload, fmt)
+            cached = self._encoded[fmt] = (body, '"%s"' % hashlib.sha1(body).hexdigest()[:20])
+        return cached
+
+
+# --- Persistence ---
+_MAGIC = b"CRS"
+_FORMAT = 1
+_HEADER = struct.Struct("<3sBH")       # magic, format, snapshot count
+_SNAPSHOT = struct.Struct("<8sIdH")    # base, version, fetched_at, rate count
+_RATE = struct.Struct("<8sd")          # currency code, rate
+
+
+def write_snapshots(path, snapshots):
+    """
+    Write {base: RateSnapshot} to `path` atomically. The file is a small
+    header, then per snapshot its base, version, fetch time and rate count
+    followed by (code, float64 rate) records, all little-endian.
+    """
+    parts = [_HEADER.pack(_MAGIC, _FORMAT, len(snapshots))]
+    for base, snapshot in snapshots.items():
+        rates = snapshot.rates
+        parts.append(_SNAPSHOT.pack(base.encode(), snapshot.version, snapshot.fetched_at, len(rates)))
+        parts.extend(_RATE.pack(code.encode(), rate) for code, rate in rates.items())
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, "wb") as f:
+        f.write(b"".join(parts))
+    os.replace(temp, path)
+
+
+def read_snapshots(path):
+    """{base: RateSnapshot} from a file written by write_snapshots; {} if unreadable."""
+    try:
+        with open(path, "rb") as f:
+            blob = f.read()
+        magic, fmt, count = _HEADER.unpack_from(blob)
+        if magic != _MAGIC or fmt != _FORMAT:
+            return {}
+        snapshots = {}
+        offset = _HEADER.size
+        for _ in range(count):
+            base, version, fetched_at, size = _SNAPSHOT.unpack_from(blob, offset)
+            offset += _SNAPSHOT.size
+            rates = {code.rstrip(b"\0").decode(): rate
+                     for code, rate in _RATE.iter_unpack(blob[offset:offset + size * _RATE.size])}
+            offset += size * _RATE.size
+            base = base.rstrip(b"\0").decode()
+            snapshots[base] = RateSnapshot({"base": base, "rates": rates}, fetched_at, version)
+        return snapshots
+    except (OSError, struct.error, UnicodeDecodeError):
+        return {}
+
+
+class _Flight:
+    """An upstream fetch in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+
+class RateCache:
+    def __init__(self, url=None, ttl=None, max_entries=MAX_ENTRIES, timeout=FETCH_TIMEOUT, path=None,
+                 failure_ttl=FAILURE_TTL):
+        self.url = url or CURRENCY_API_URL
+        self.ttl = CURRENCY_TTL if ttl is None else ttl
+        self.failure_ttl = failure_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.fetch_count = 0
+        self._entries = OrderedDict()
+        # base -> (when, error) for the last failed fetch
+        self._failures = OrderedDict()
+        self._flights = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self.path = path
+        # Persisted snapshots are read on first use, not at construction
+        self._loaded = path is None
+        self._save_lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """Call `callback(base, snapshot)` after every successful refresh."""
+        self._listeners.append(callback)
+
+    def get(self, base="USD", wait=True):
+        """
+        Return the RateSnapshot for `base`.
+
+        Fresh entries are returned as-is. Stale entries are returned while a
+        background refresh runs. With no entry at all, the caller waits on a
+        single shared fetch (or, with wait=False, gets None right away while
+        the fetch runs in the background). Fetch errors propagate only when
+        there is nothing cached to fall back on, and are raised again
+        without a fetch for `failure_ttl` seconds. Raises ValueError for a
+        base that isn't a currency code.
+        """
+        if not valid_base(base):
+            raise ValueError(f"Invalid base currency {base!r}")
+        self._load()
+        with self._lock:
+            snapshot = self._entries.get(base)
+            if snapshot is not None:
+                self._entries.move_to_end(base)
+                if snapshot.age > self.ttl and not self._failed_recently(base):
+                    self._start_flight(base, background=True)
+                return snapshot
+            if self._failed_recently(base):
+                if not wait:
+                    return None
+                raise self._failures[base][1]
+            flight, leader = self._start_flight(base, background=not wait)
+        if not wait:
+            return None
+        if leader:
+            self._refresh(base, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        with self._lock:
+            return self._entries[base]
+
+    def peek(self, base="USD"):
+        """Cached snapshot for `base` without fetching, or None."""
+        self._load()
+        with self._lock:
+            return self._entries.get(base)
+
+    def invalidate(self, base=None):
+        with self._lock:
+            if base is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(base, None)
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            loaded = read_snapshots(self.path)
+            for base, snapshot in loaded.items():
+                if base not in self._entries and len(self._entries) < self.max_entries:
+                    self._entries[base] = snapshot
+        # Listeners see a loaded snapshot like a refresh
+        for base, snapshot in loaded.items():
+            self._notify(base, snapshot)
+
+    def _save(self):
+        with self._lock:
+            snapshots = dict(self._entries)
+        with self._save_lock:
+            try:
+                write_snapshots(self.path, snapshots)
+            except OSError as e:
+                print(f"Failed to save currency rates: {e}")
+
+    def _notify(self, base, snapshot):
+        for callback in list(self._listeners):
+            callback(base, snapshot)
+
+    # Caller holds self._lock
+    def _failed_recently(self, base):
+        failure = self._failures.get(base)
+        return failure is not None and time.time() - failure[0] < self.failure_ttl
+
+    # Caller holds self._lock
+    def _start_flight(self, base, background):
+        flight = self._flights.get(base)
+        if flight is not None:
+            return flight, False
+        flight = self._flights[base] = _Flight()
+        if background:
+            threading.Thread(target=self._refresh, args=(base, flight), daemon=True).start()
+            return flight, False
+        return flight, True
+
+    def _refresh(self, base, flight):
+        snapshot = None
+        try:
+            data = self._fetch(base)
+        except Exception as e:
+            flight.error = e
+        with self._lock:
+            if flight.error is not None:
+                self._failures[base] = (time.time(), flight.error)
+                self._failures.move_to_end(base)
+                while len(self._failures) > self.max_entries:
+                    self._failures.popitem(last=False)
+            else:
+                self._failures.pop(base, None)
+                # Merged into what we had, so codes missing from a partial payload survive
+                previous = self._entries.get(base)
+                if previous is None:
+                    snapshot = RateSnapshot(data, time.time())
+                else:
+                    snapshot = previous.merged(data, time.time())
+                self._entries[base] = snapshot
+                self._entries.move_to_end(base)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            del self._flights[base]
+        flight.done.set()
+        if snapshot is not None:
+            if self.path is not None:
+                self._save()
+            self._notify(base, snapshot)
+
+    def _fetch(self, base):
+        # urllib.request (and the TLS setup behind it) is only loaded once
+        # a fetch is actually needed
+        import urllib.request
+        self.fetch_count += 1
+        print(f"Fetching currency data ({base})...")
+        with FETCH_TIME.time():
+            with urllib.request.urlopen(self.url.format(base=base), timeout=self.timeout) as response:
+                return json.loads(response.read().decode())
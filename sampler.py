@@ -0,0 +1,153 @@
+"""
+Compiled function sampling for plotting.
+
+A Function parses an expression in one variable once, optionally
+differentiates it symbolically (see symbolic.py), and compiles it against
+NumPy ufuncs so a whole grid of points is evaluated in a single call.
+sample() then refines adaptively: midpoints are added where the curve bends
+sharply or crosses in or out of its domain, until it is smooth to the
+tolerance or the point budget runs out.
+"""
+import sys
+import threading
+from collections import OrderedDict
+
+import engine
+import symbolic
+
+# Bound to NumPy by the first Function rather than on import (see
+# engine._numpy); sampling is NumPy-only
+np = None
+
+
+def _numpy():
+    global np
+    if np is None:
+        np = engine.np
+    return np
+
+MAX_POINTS = 1_000_000
+MAX_ORDER = 3
+REFINE_ROUNDS = 12
+# Chord deviation allowed before an interval is split, relative to the y range
+TOLERANCE = 1e-3
+CACHE_SIZE = 64
+
+
+class Function:
+    def __init__(self, text, var="x", order=0):
+        if _numpy() is None:
+            raise engine.ExpressionError("Function sampling needs NumPy")
+        if not 0 <= order <= MAX_ORDER:
+            raise engine.ExpressionError(f"Derivative order must be 0 to {MAX_ORDER}")
+        tree = engine.compile_expression(text).tree
+        if order:
+            tree = symbolic.derivative(tree, var, order)
+        self.var = var
+        self.order = order
+        self.text = engine.unparse(tree)
+        self._func, params = engine.compile_tree(tree, engine.ARRAY_NAMES)
+        extra = [name for name in params if name != var]
+        if extra:
+            raise engine.ExpressionError(f"Unknown name {extra[0]!r}")
+        self._takes_var = bool(params)
+
+    def __call__(self, xs):
+        """f over an array of points, with NaN wherever it is undefined."""
+        xs = np.asarray(xs, dtype=np.float64)
+        with np.errstate(all="ignore"):
+            try:
+                ys = self._func(**{self.var: xs}) if self._takes_var else self._func()
+                ys = np.array(np.broadcast_to(np.asarray(ys, dtype=np.float64), xs.shape))
+            except (ArithmeticError, TypeError, ValueError):
+                # A constant part raised (e.g. 1/0), so it fails everywhere
+                return np.full(xs.shape, np.nan)
+        ys[~np.isfinite(ys)] = np.nan
+        return ys
+
+
+_functions = OrderedDict()
+_functions_lock = threading.Lock()
+
+
+def get_function(text, var="x", order=0):
+    """Compiled Function, memoized on (text, var, order)."""
+    key = (text, var, order)
+    with _functions_lock:
+        function = _functions.get(key)
+        if function is not None:
+            _functions.move_to_end(key)
+            return function
+    function = Function(text, var, order)
+    with _functions_lock:
+        _functions[key] = function
+        while len(_functions) > CACHE_SIZE:
+            _functions.popitem(last=False)
+    return function
+
+
+def sample(function, lo, hi, n, adaptive=True, max_points=None, tolerance=TOLERANCE):
+    """
+    Sample `function` on [lo, hi]: n evenly spaced points, then (if
+    adaptive) up to max_points in total, default 4n. Returns (xs, ys).
+    """
+    xs = np.linspace(lo, hi, n)
+    ys = function(xs)
+    if not adaptive:
+        return xs, ys
+    max_points = min(max_points or 4 * n, MAX_POINTS)
+    # Intervals narrower than this are as refined as float64 allows
+    min_width = abs(hi - lo) * 1e-12
+    for _ in range(REFINE_ROUNDS):
+        room = max_points - len(xs)
+        if room <= 0 or len(xs) < 3:
+            break
+        scores = _interval_scores(xs, ys)
+        scores[np.diff(xs) <= min_width] = 0
+        split = np.flatnonzero(scores > tolerance)
+        if not len(split):
+            break
+        if len(split) > room:
+            split = np.sort(split[np.argpartition(-scores[split], room - 1)[:room]])
+        mids = (xs[split] + xs[split + 1]) / 2
+        xs = np.insert(xs, split + 1, mids)
+        ys = np.insert(ys, split + 1, function(mids))
+    return xs, ys
+
+
+def _interval_scores(xs, ys):
+    """How badly each interval needs splitting; > tolerance means split."""
+    finite = ys[np.isfinite(ys)]
+    span = float(finite.max() - finite.min()) if finite.size else 0.0
+    scale = span or 1.0
+    # Distance of each interior point from the chord through its neighbours
+    x0, x1, x2 = xs[:-2], xs[1:-1], xs[2:]
+    y0, y1, y2 = ys[:-2], ys[1:-1], ys[2:]
+    with np.errstate(all="ignore"):
+        deviation = np.abs(y1 - (y0 + (x1 - x0) / (x2 - x0) * (y2 - y0))) / scale
+    deviation = np.nan_to_num(deviation, nan=0.0)
+    # Both intervals either side of a bent point get split
+    scores = np.zeros(len(xs) - 1)
+    scores[:-1] = deviation
+    scores[1:] = np.maximum(scores[1:], deviation)
+    # Edges of the domain (a finite value next to NaN) are always refined
+    defined = np.isfinite(ys)
+    scores[defined[:-1] != defined[1:]] = np.inf
+    return scores
+
+
+def encode(xs, ys):
+    """Little-endian float64: all x values, then all y values."""
+    if sys.byteorder == "little":
+        return xs.tobytes() + ys.tobytes()
+    return xs.astype("<f8").tobytes() + ys.astype("<f8").tobytes()
+
+
+def sample_bytes(text, lo, hi, n, order=0, adaptive=True, max_points=None, var="x"):
+    """
+    Executor entry point for /api/sample. Returns (payload, point count,
+    the expression actually sampled).
+    """
+    function = get_function(text, var, order)
+    xs, ys = sample(function, lo, hi, n, adaptive, max_points)
+    return encode(xs, ys), len(xs), function.text
@@ -0,0 +1,373 @@
+"""
+Vectorized root finding: f(x) = 0 for one unknown, or square systems of
+equations, solved for a whole batch of parameter sets at once.
+
+Equations are parsed once and compiled against the NumPy names together
+with their symbolic Jacobian (see symbolic.py), so each iteration is a
+handful of array operations across the batch however many rows it has.
+One unknown with a bracket [lo, hi] uses safeguarded Newton: Newton steps
+that stay inside the shrinking bracket, bisection otherwise. Everything
+else uses Newton with step halving.
+
+solve() splits large batches across an executor's workers and warm-starts
+each row from the cached solution with the nearest parameters.
+"""
+import threading
+from collections import OrderedDict
+
+import engine
+import symbolic
+from engine import BinOp
+
+# Bound to NumPy by the first System or solve() rather than on import (see
+# engine._numpy); solving is NumPy-only
+np = None
+
+
+def _numpy():
+    global np
+    if np is None:
+        np = engine.np
+    return np
+
+TOLERANCE = 1e-12
+MAX_ITERATIONS = 100
+BRACKET_ITERATIONS = 200
+# Batches larger than this are split across the executor's workers
+CHUNK_ROWS = 20000
+MAX_ROWS = 1_000_000
+CACHE_SIZE = 64
+# Solutions remembered per system for warm starts
+WARM_POINTS = 256
+
+
+def _residual(text):
+    """Tree for `lhs - rhs` of 'lhs = rhs', or of the expression itself."""
+    if text.count("=") > 1:
+        raise engine.ExpressionError("An equation has at most one '='")
+    lhs, _, rhs = text.partition("=")
+    tree = engine.compile_expression(lhs).tree
+    if rhs:
+        tree = BinOp("-", tree, engine.compile_expression(rhs).tree)
+    return tree
+
+
+class _Compiled:
+    """One tree compiled for arrays, called with whichever names it uses."""
+
+    def __init__(self, tree):
+        self.func, self.names = engine.compile_tree(tree, engine.ARRAY_NAMES)
+
+    def __call__(self, env, size):
+        with np.errstate(all="ignore"):
+            try:
+                value = self.func(**{name: env[name] for name in self.names})
+                return np.array(np.broadcast_to(np.asarray(value, dtype=np.float64), (size,)))
+            except (ArithmeticError, TypeError, ValueError):
+                return np.full(size, np.nan)
+
+
+class _FiniteDifference:
+    """Central difference for terms symbolic.derivative can't handle."""
+
+    def __init__(self, residual, unknown):
+        self.residual = residual
+        self.unknown = unknown
+
+    def __call__(self, env, size):
+        x = env[self.unknown]
+        h = 1e-7 * (1 + np.abs(x))
+        up = self.residual(dict(env, **{self.unknown: x + h}), size)
+        down = self.residual(dict(env, **{self.unknown: x - h}), size)
+        return (up - down) / (2 * h)
+
+
+class System:
+    """Residuals and Jacobian of square system of equations, for arrays."""
+
+    def __init__(self, equations, unknowns):
+        if _numpy() is None:
+            raise engine.ExpressionError("Solving needs NumPy")
+        if not equations or len(equations) != len(unknowns):
+            raise engine.ExpressionError("Need as many equations as unknowns")
+        trees = [_residual(text) for text in equations]
+        self.unknowns = tuple(unknowns)
+        names = set()
+        for tree in trees:
+            names.update(engine.free_variables(tree))
+        self.params = tuple(sorted(names - set(unknowns)))
+        self._residuals = [_Compiled(tree) for tree in trees]
+        self._jacobian = []
+        for tree, residual in zip(trees, self._residuals):
+            row = []
+            for unknown in unknowns:
+                try:
+                    row.append(_Compiled(symbolic.derivative(tree, unknown)))
+                except engine.ExpressionError:
+                    row.append(_FiniteDifference(residual, unknown))
+            self._jacobian.append(row)
+
+    def _env(self, x, params):
+        return dict(params, **dict(zip(self.unknowns, x)))
+
+    def residuals(self, x, params):
+        """(n, rows) residuals at unknowns x (n, rows)."""
+        env = self._env(x, params)
+        return np.stack([f(env, x.shape[1]) for f in self._residuals])
+
+    def jacobian(self, x, params):
+        """(rows, n, n) Jacobian at unknowns x (n, rows)."""
+        env = self._env(x, params)
+        size = x.shape[1]
+        return np.stack([np.stack([d(env, size) for d in row], axis=-1) for row in self._jacobian], axis=1)
+
+
+_systems = OrderedDict()
+_systems_lock = threading.Lock()
+
+
+def get_system(equations, unknowns):
+    """Compiled System, memoized on its equations and unknowns."""
+    key = (tuple(equations), tuple(unknowns))
+    with _systems_lock:
+        system = _systems.get(key)
+        if system is not None:
+            _systems.move_to_end(key)
+            return system
+    system = System(equations, unknowns)
+    with _systems_lock:
+        _systems[key] = system
+        while len(_systems) > CACHE_SIZE:
+            _systems.popitem(last=False)
+    return system
+
+
+# --- Methods ---
+def _take(params, rows):
+    return {name: value[rows] for name, value in params.items()}
+
+
+def newton(system, x, params, tol=TOLERANCE, max_iter=MAX_ITERATIONS):
+    """
+    Damped Newton on every row at once. x is (n, rows) and is updated in
+    place. Returns (converged mask, iterations used).
+    """
+    rows = x.shape[1]
+    converged = np.zeros(rows, dtype=bool)
+    failed = np.zeros(rows, dtype=bool)
+    residual = np.max(np.abs(system.residuals(x, params)), axis=0)
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        converged |= residual <= tol
+        failed |= ~np.isfinite(residual)
+        active = np.flatnonzero(~converged & ~failed)
+        if not len(active):
+            break
+        xa = x[:, active]
+        pa = _take(params, active)
+        f = system.residuals(xa, pa)
+        jac = system.jacobian(xa, pa)
+        with np.errstate(all="ignore"):
+            try:
+                step = np.linalg.solve(jac, -f.T[..., None])[..., 0].T
+            except np.linalg.LinAlgError:
+                # Some row is singular; the pseudo-inverse copes row by row
+                step = np.einsum("rij,rj->ir", np.linalg.pinv(jac), -f.T)
+        step[~np.isfinite(step)] = np.nan
+        # Halve the step until the residual stops growing
+        current = residual[active]
+        scale = np.ones(len(active))
+        for _ in range(8):
+            trial = xa + scale * step
+            trial_residual = np.max(np.abs(system.residuals(trial, pa)), axis=0)
+            worse = ~(trial_residual <= current)
+            if not worse.any():
+                break
+            scale[worse] /= 2
+        x[:, active] = trial
+        residual[active] = trial_residual
+        # A step that no longer moves x ends the row; it counts as converged
+        # if the residual is still small
+        stalled = np.max(np.abs(scale * step), axis=0) <= tol * (1 + np.max(np.abs(trial), axis=0))
+        stalled_rows = active[stalled]
+        converged[stalled_rows] |= trial_residual[stalled] <= np.sqrt(tol)
+        failed[stalled_rows] |= ~converged[stalled_rows]
+    converged |= residual <= tol
+    return converged, iterations
+
+
+def bracketed(system, x, params, lo, hi, tol=TOLERANCE, max_iter=BRACKET_ITERATIONS):
+    """
+    Safeguarded Newton for one unknown inside [lo, hi] on every row: Newton
+    steps that land inside the current bracket are taken, bisection
+    otherwise. Rows without a sign change fail. x is (1, rows) and is
+    updated in place. Returns (converged mask, iterations used).
+    """
+    rows = x.shape[1]
+    a = np.broadcast_to(np.asarray(lo, dtype=np.float64), (rows,)).copy()
+    b = np.broadcast_to(np.asarray(hi, dtype=np.float64), (rows,)).copy()
+    fa = system.residuals(a[None, :], params)[0]
+    fb = system.residuals(b[None, :], params)[0]
+    valid = np.isfinite(fa) & np.isfinite(fb) & (np.sign(fa) != np.sign(fb))
+    valid |= (fa == 0) | (fb == 0)
+    xs = x[0]
+    inside = (xs > a) & (xs < b)
+    xs[~inside] = (a[~inside] + b[~inside]) / 2
+    xs[fa == 0] = a[fa == 0]
+    xs[fb == 0] = b[fb == 0]
+    converged = ~valid  # Excluded from the loop; flipped back below
+    iterations = 0
+    for iterations in range(1, max_iter + 1):
+        active = np.flatnonzero(~converged)
+        if not len(active):
+            break
+        point = xs[active][None, :]
+        pa = _take(params, active)
+        fx = system.residuals(point, pa)[0]
+        done = (np.abs(fx) <= tol) | (b[active] - a[active] <= tol * (1 + np.abs(xs[active])))
+        converged[active[done]] = True
+        # Shrink the bracket around the sign change
+        left = np.sign(fx) == np.sign(fa[active])
+        a[active[left]], fa[active[left]] = xs[active[left]], fx[left]
+        b[active[~left]] = xs[active[~left]]
+        dfx = system.jacobian(point, pa)[:, 0, 0]
+        with np.errstate(all="ignore"):
+            step = xs[active] - fx / dfx
+        aa, bb = a[active], b[active]
+        ok = np.isfinite(step) & (step > aa) & (step < bb)
+        nxt = np.where(ok, step, (aa + bb) / 2)
+        xs[active[~done]] = nxt[~done]
+    converged &= valid
+    xs[~valid] = np.nan
+    return converged, iterations
+
+
+def solve_rows(equations, unknowns, params, guesses, bracket=None, tol=TOLERANCE, max_iter=None):
+    """
+    Solve one chunk of rows; the executor entry point. `params` maps names
+    to (rows,) arrays and `guesses` is (n, rows). Returns (solutions (n,
+    rows), converged (rows,), iterations).
+    """
+    system = get_system(equations, unknowns)
+    missing = [name for name in system.params if name not in params]
+    if missing:
+        raise engine.ExpressionError(f"Missing parameter {missing[0]!r}")
+    x = np.array(guesses, dtype=np.float64)
+    if bracket is not None:
+        if len(unknowns) != 1:
+            raise engine.ExpressionError("A bracket needs exactly one unknown")
+        converged, iterations = bracketed(system, x, params, bracket[0], bracket[1], tol,
+                                          max_iter or BRACKET_ITERATIONS)
+    else:
+        converged, iterations = newton(system, x, params, tol, max_iter or MAX_ITERATIONS)
+    return x, converged, iterations
+
+
+# --- Warm starts ---
+class WarmStarts:
+    """Recent solutions per system, looked up by nearest parameter vector."""
+
+    def __init__(self, points=WARM_POINTS, systems=CACHE_SIZE):
+        self.points = points
+        self.systems = systems
+        self._entries = OrderedDict()  # key -> (params (m, k), solutions (m, n))
+        self._lock = threading.Lock()
+
+    def guess(self, key, params):
+        """(n, rows) starting points for params (rows, k), or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            return None
+        stored_params, stored = entry
+        if not stored_params.shape[1]:
+            return np.repeat(stored[-1][:, None], len(params), axis=1)
+        nearest = np.empty(len(params), dtype=np.intp)
+        for start in range(0, len(params), 2048):
+            chunk = params[start:start + 2048]
+            distance = ((chunk[:, None, :] - stored_params[None, :, :]) ** 2).sum(axis=-1)
+            nearest[start:start + 2048] = np.argmin(distance, axis=1)
+        return stored[nearest].T
+
+    def store(self, key, params, solutions, converged):
+        """Remember up to `points` converged rows, spread across the batch."""
+        rows = np.flatnonzero(converged)
+        if not len(rows):
+            return
+        if len(rows) > self.points:
+            rows = rows[np.linspace(0, len(rows) - 1, self.points).astype(np.intp)]
+        new_params, new_solutions = params[rows], solutions[:, rows].T
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                new_params = np.concatenate([entry[0], new_params])[-self.points:]
+                new_solutions = np.concatenate([entry[1], new_solutions])[-self.points:]
+            self._entries[key] = (new_params, new_solutions)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.systems:
+                self._entries.popitem(last=False)
+
+
+warm_starts = WarmStarts()
+
+
+def solve(equations, unknowns=("x",), params=None, guess=None, bracket=None,
+          tol=TOLERANCE, max_iter=None, run=None, run_many=None):
+    """
+    Solve `equations` for `unknowns` over a batch of parameter sets.
+
+    `params` maps parameter names to scalars or equal-length sequences (one
+    row per entry). `guess` maps unknowns to starting values (scalars or
+    per-row sequences); rows without one start from the cached solution with
+    the nearest parameters, else 1.0 (or the middle of `bracket`). `run` and
+    `run_many` are an executor's run/map, used to farm chunks out.
+
+    Returns (solutions {unknown: array}, converged array, iterations).
+    """
+    if _numpy() is None:
+        raise engine.ExpressionError("Solving needs NumPy")
+    equations = [equations] if isinstance(equations, str) else list(equations)
+    unknowns = [unknowns] if isinstance(unknowns, str) else list(unknowns)
+    params = dict(params or {})
+    lengths = {len(v) for v in params.values() if isinstance(v, (list, tuple))}
+    if guess:
+        lengths |= {len(v) for v in guess.values() if isinstance(v, (list, tuple))}
+    if len(lengths) > 1:
+        raise engine.ExpressionError("Parameter columns must all have the same length")
+    rows = lengths.pop() if lengths else 1
+    if rows > MAX_ROWS:
+        raise engine.ExpressionError(f"At most {MAX_ROWS} rows per solve")
+    try:
+        columns = {name: np.broadcast_to(np.asarray(value, dtype=np.float64), (rows,))
+                   for name, value in params.items()}
+    except (TypeError, ValueError):
+        raise engine.ExpressionError("Parameters must be numbers") from None
+
+    # Warm start from the nearest cached parameters; explicit guesses win
+    key = (tuple(equations), tuple(unknowns), tuple(sorted(columns)))
+    param_matrix = np.stack([columns[name] for name in sorted(columns)], axis=1) if columns \
+        else np.empty((rows, 0))
+    guesses = warm_starts.guess(key, param_matrix)
+    if guesses is None:
+        start = 1.0 if bracket is None else (bracket[0] + bracket[1]) / 2
+        guesses = np.full((len(unknowns), rows), start)
+    for i, unknown in enumerate(unknowns):
+        if guess and unknown in guess:
+            guesses[i] = np.broadcast_to(np.asarray(guess[unknown], dtype=np.float64), (rows,))
+
+    run = run or (lambda func, *args: func(*args))
+    if rows <= CHUNK_ROWS or run_many is None:
+        x, converged, iterations = run(solve_rows, equations, unknowns, columns, guesses,
+                                       bracket, tol, max_iter)
+    else:
+        bounds = range(0, rows, CHUNK_ROWS)
+        chunks = run_many(solve_rows, [
+            (equations, unknowns, {name: col[i:i + CHUNK_ROWS] for name, col in columns.items()},
+             guesses[:, i:i + CHUNK_ROWS], bracket, tol, max_iter) for i in bounds])
+        x = np.concatenate([chunk[0] for chunk in chunks], axis=1)
+        converged = np.concatenate([chunk[1] for chunk in chunks])
+        iterations = max(chunk[2] for chunk in chunks)
+    warm_starts.store(key, param_matrix, x, converged)
+    return dict(zip(unknowns, x)), converged, iterations
@@ -5,6 +5,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const modeSelector = document.getElementById('mode-selector');
     const converterControls = document.getElementById('converter-controls');
     const sciKeypad = document.getElementById('sci-keypad');
+    const plotControls = document.getElementById('plot-controls');
 
     // Converter Elements
     const convType = document.getElementById('conv-type');
@@ -34,8 +35,14 @@ document.addEventListener('DOMContentLoaded', () => {
         // Visibility Toggles
         sciKeypad.classList.add('hidden');
         converterControls.classList.add('hidden');
+        plotControls.classList.add('hidden');
+        keypad.classList.remove('hidden');
 
-        if (mode === 'scientific') {
+        if (mode === 'plot') {
+            plotControls.classList.remove('hidden');
+            keypad.classList.add('hidden');
+            plot();
+        } else if (mode === 'scientific') {
             sciKeypad.classList.remove('hidden');
         } else if (mode === 'converter') {
             converterControls.classList.remove('hidden');
@@ -141,15 +148,23 @@ document.addEventListener('DOMContentLoaded', () => {
         updateUnits();
     }
 
-    const units = {
-        'length': ['m', 'km', 'ft', 'mi', 'cm', 'inch'],
-        'weight': ['kg', 'g', 'lb', 'oz'],
-        'currency': ['USD', 'EUR', 'GBP', 'JPY', 'INR']
-    };
+    // Units and base factors come from the server's unit registry (/api/units)
+    let unitTable = {};
+    const defaultCurrencies = ['USD', 'EUR', 'GBP', 'JPY', 'INR'];
+
+    async function fetchUnits() {
+        try {
+            const res = await fetch('/api/units');
+            unitTable = await res.json();
+            if (mode === 'converter') updateUnits();
+        } catch (e) {
+            console.error("Unit table fetch failed", e);
+        }
+    }
 
     function updateUnits() {
         const type = convType.value;
-        const options = units[type] || [];
+        const options = unitTable[type] ? unitTable[type].units : (type === 'currency' ? defaultCurrencies : []);
 
         // Populate standard units
         if (type === 'currency' && Object.keys(currencyRates).length > 0) {
@@ -213,14 +228,9 @@ document.addEventListener('DOMContentLoaded', () => {
 
         if (isNaN(val)) return;
 
-        if (type === 'length') {
-            const toM = { "m": 1, "km": 1000, "ft": 0.3048, "mi": 1609.34, "cm": 0.01, "inch": 0.0254 };
-            const valM = val * toM[from];
-            result = valM / toM[to];
-        } else if (type === 'weight') {
-            const toKg = { "kg": 1, "g": 0.001, "lb": 0.453592, "oz": 0.0283495 };
-            const valKg = val * toKg[from];
-            result = valKg / toKg[to];
+        if (unitTable[type] && type !== 'currency') {
+            const factors = unitTable[type].factors;
+            result = val * factors[from] / factors[to];
         } else if (type === 'currency' && currencyRates[from]) {
             const rateFrom = currencyRates[from];
             const rateTo = currencyRates[to];
@@ -231,10 +241,86 @@ document.addEventListener('DOMContentLoaded', () => {
         displayHistory.textContent = `= ${result.toFixed(4)} ${to}`;
     }
 
+    // --- Plot ---
+    // /api/sample returns little-endian float64: every x, then every y
+    const plotCanvas = document.getElementById('plot-canvas');
+    const plotExpression = document.getElementById('plot-expression');
+    const plotOrder = document.getElementById('plot-order');
+    const plotMin = document.getElementById('plot-min');
+    const plotMax = document.getElementById('plot-max');
+
+    async function plot() {
+        const params = new URLSearchParams({
+            expression: plotExpression.value,
+            derivative: plotOrder.value,
+            min: plotMin.value,
+            max: plotMax.value,
+            n: plotCanvas.width * 2,
+        });
+        try {
+            const res = await fetch('/api/sample?' + params);
+            if (!res.ok) {
+                displayHistory.textContent = (await res.json()).error;
+                return;
+            }
+            const count = parseInt(res.headers.get('X-Sample-Count'), 10);
+            const data = new Float64Array(await res.arrayBuffer());
+            displayHistory.textContent = 'y = ' + res.headers.get('X-Expression');
+            drawPlot(data.subarray(0, count), data.subarray(count));
+        } catch (e) {
+            console.error("Sampling failed", e);
+        }
+    }
+
+    function drawPlot(xs, ys) {
+        const ctx = plotCanvas.getContext('2d');
+        const w = plotCanvas.width, h = plotCanvas.height;
+        ctx.clearRect(0, 0, w, h);
+
+        // Scale to the 1st-99th percentile so poles don't flatten the curve
+        const finite = Array.from(ys).filter(Number.isFinite).sort((a, b) => a - b);
+        if (!finite.length) return;
+        let yMin = finite[Math.floor(finite.length * 0.01)];
+        let yMax = finite[Math.ceil(finite.length * 0.99) - 1];
+        if (yMin === yMax) { yMin -= 1; yMax += 1; }
+        const pad = (yMax - yMin) * 0.05;
+        yMin -= pad; yMax += pad;
+        const xMin = xs[0], xMax = xs[xs.length - 1];
+        const px = x => (x - xMin) / (xMax - xMin) * w;
+        const py = y => h - (y - yMin) / (yMax - yMin) * h;
+
+        // Axes
+        ctx.strokeStyle = '#bbbbbb';
+        ctx.lineWidth = 1;
+        ctx.beginPath();
+        if (xMin < 0 && xMax > 0) { ctx.moveTo(px(0), 0); ctx.lineTo(px(0), h); }
+        if (yMin < 0 && yMax > 0) { ctx.moveTo(0, py(0)); ctx.lineTo(w, py(0)); }
+        ctx.stroke();
+
+        // Curve, broken wherever it is undefined
+        ctx.strokeStyle = getComputedStyle(document.documentElement).getPropertyValue('--btn-accent-bg');
+        ctx.lineWidth = 2;
+        ctx.beginPath();
+        let drawing = false;
+        for (let i = 0; i < xs.length; i++) {
+            if (!Number.isFinite(ys[i])) { drawing = false; continue; }
+            const y = Math.max(-h, Math.min(2 * h, py(ys[i])));
+            if (drawing) ctx.lineTo(px(xs[i]), y);
+            else ctx.moveTo(px(xs[i]), y);
+            drawing = true;
+        }
+        ctx.stroke();
+    }
+
+    document.getElementById('plot-go').addEventListener('click', plot);
+    plotExpression.addEventListener('keydown', (e) => { if (e.key === 'Enter') plot(); });
+    plotOrder.addEventListener('change', plot);
+
     unitFrom.addEventListener('change', convert);
     unitTo.addEventListener('change', convert);
 
     // Init
     attachListeners();
     setMode('standard');
+    fetchUnits();
 });
@@ -0,0 +1,83 @@
+"""
+NDJSON evaluation pipeline for /api/calc/stream.
+
+Each stage is a generator, so a request body is read one line at a time
+while results are written out; memory use doesn't grow with the upload.
+Input lines are either a bare expression or a JSON record
+{"id": ..., "expression": ..., "vars": {...}}.
+"""
+import json
+
+import engine
+from executor import ExecutorError
+
+MAX_LINE = 1 << 20          # Longest accepted input line, in bytes
+FLUSH_BYTES = 64 * 1024     # Output is sent in chunks of about this size
+FLUSH_LINES = 256           # ...or after this many results, whichever is first
+
+
+def iter_records(stream):
+    """Yield (id, expression, vars) for each non-blank line of a binary stream."""
+    number = 0
+    while True:
+        line = stream.readline(MAX_LINE)
+        if not line:
+            return
+        number += 1
+        if len(line) >= MAX_LINE and not line.endswith(b"\n"):
+            # Drain the rest of an oversized line without holding it
+            while True:
+                rest = stream.readline(MAX_LINE)
+                if not rest or rest.endswith(b"\n"):
+                    break
+            yield number, ValueError("Line too long"), None
+            continue
+        text = line.decode("utf-8", "replace").strip()
+        if not text:
+            continue
+        if not text.startswith("{"):
+            yield number, text, None
+            continue
+        try:
+            record = json.loads(text)
+            yield record.get("id", number), record["expression"], record.get("vars")
+        except (ValueError, KeyError, AttributeError):
+            yield number, ValueError("Invalid record"), None
+
+
+def evaluate_records(records, evaluate=engine.evaluate):
+    """Yield a result dict for each (id, expression, vars) record."""
+    for record_id, expression, variables in records:
+        if isinstance(expression, Exception):
+            yield {"id": record_id, "error": str(expression)}
+            continue
+        try:
+            yield {"id": record_id, "result": evaluate(expression, variables)}
+        except ExecutorError as e:
+            yield {"id": record_id, "error": str(e)}
+        except Exception:
+            yield {"id": record_id, "error": "Invalid Expression"}
+
+
+def encode_ndjson(results):
+    """Serialize results as NDJSON, grouped into chunks for the response."""
+    buffer = []
+    size = 0
+    for result in results:
+        try:
+            line = json.dumps(result, allow_nan=False, separators=(",", ":"))
+        except (TypeError, ValueError):
+            line = json.dumps({"id": result["id"], "error": "Invalid Result"})
+        buffer.append(line)
+        size += len(line) + 1
+        if size >= FLUSH_BYTES or len(buffer) >= FLUSH_LINES:
+            yield ("\n".join(buffer) + "\n").encode()
+            buffer = []
+            size = 0
+    if buffer:
+        yield ("\n".join(buffer) + "\n").encode()
+
+
+def evaluate_stream(stream, evaluate=engine.evaluate):
+    """Full pipeline: binary NDJSON in, chunks of NDJSON bytes out."""
+    return encode_ndjson(evaluate_records(iter_records(stream), evaluate))
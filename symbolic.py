@@ -0,0 +1,231 @@
+"""
+Symbolic differentiation of engine expression trees.
+
+derivative() works on the same AST the engine parses and compiles, so a
+derivative can be unparsed for display or compiled like any other
+expression. Results are simplified as they are built (0 and 1 terms drop
+out, constant subtrees fold) to keep repeated derivatives small.
+"""
+import math
+import operator
+
+import engine
+from engine import BinOp, Call, Name, Num, UnaryOp
+
+ZERO = Num("0")
+ONE = Num("1")
+
+_FOLD = {"+": operator.add, "-": operator.sub, "*": operator.mul,
+         "/": operator.truediv, "**": operator.pow}
+
+# Accepted spellings of each differentiable function
+_FUNCTIONS = {"sin": "sin", "math.sin": "sin", "cos": "cos", "math.cos": "cos",
+              "tan": "tan", "math.tan": "tan", "sqrt": "sqrt", "math.sqrt": "sqrt",
+              "ln": "ln", "math.log": "ln", "log": "log", "math.log10": "log",
+              "math.exp": "exp"}
+
+
+def derivative(tree, var="x", order=1):
+    """d^order(tree)/d(var)^order as a new tree."""
+    try:
+        for _ in range(order):
+            tree = _diff(tree, var)
+    except RecursionError:
+        raise engine.ExpressionError("Expression is too deeply nested") from None
+    return tree
+
+
+def differentiate(text, var="x", order=1):
+    """Derivative of expression text, as text."""
+    return engine.unparse(derivative(engine.parse(text), var, order))
+
+
+def depends_on(tree, var):
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Name):
+            if node.id == var:
+                return True
+        elif isinstance(node, UnaryOp):
+            stack.append(node.operand)
+        elif isinstance(node, BinOp):
+            stack.extend((node.left, node.right))
+        elif isinstance(node, Call):
+            stack.extend(node.args)
+    return False
+
+
+def _diff(node, var):
+    if not depends_on(node, var):
+        return ZERO
+    if isinstance(node, Name):
+        return ONE
+    if isinstance(node, UnaryOp):
+        inner = _diff(node.operand, var)
+        return _neg(inner) if node.op == "-" else inner
+    if isinstance(node, Call):
+        return _diff_call(node, var)
+
+    u, v = node.left, node.right
+    if node.op in ("+", "-"):
+        du, dv = _diff(u, var), _diff(v, var)
+        return _add(du, dv) if node.op == "+" else _sub(du, dv)
+    if node.op == "*":
+        return _add(_mul(_diff(u, var), v), _mul(u, _diff(v, var)))
+    if node.op == "/":
+        if not depends_on(v, var):
+            return _div(_diff(u, var), v)
+        return _div(_sub(_mul(_diff(u, var), v), _mul(u, _diff(v, var))), _pow(v, Num("2")))
+    if node.op == "//":
+        # Piecewise constant
+        return ZERO
+    if node.op == "%":
+        # u % v == u - v*(u//v), and u//v is piecewise constant
+        return _sub(_diff(u, var), _mul(_diff(v, var), BinOp("//", u, v)))
+    if node.op == "**":
+        if not depends_on(v, var):
+            # Power rule
+            return _mul(_mul(v, _pow(u, _sub(v, ONE))), _diff(u, var))
+        if not depends_on(u, var):
+            return _mul(_mul(node, _call("ln", u)), _diff(v, var))
+        # u**v * (v' ln u + v u'/u)
+        return _mul(node, _add(_mul(_diff(v, var), _call("ln", u)),
+                               _div(_mul(v, _diff(u, var)), u)))
+    raise engine.ExpressionError(f"Can't differentiate {node.op!r}")
+
+
+def _diff_call(node, var):
+    name = _FUNCTIONS.get(node.func)
+    if name is None or len(node.args) != 1:
+        raise engine.ExpressionError(f"Can't differentiate {node.func!r}")
+    u = node.args[0]
+    du = _diff(u, var)
+    if name == "sin":
+        outer = _call("cos", u)
+    elif name == "cos":
+        outer = _neg(_call("sin", u))
+    elif name == "tan":
+        outer = _div(ONE, _pow(_call("cos", u), Num("2")))
+    elif name == "sqrt":
+        outer = _div(ONE, _mul(Num("2"), node))
+    elif name == "ln":
+        outer = _div(ONE, u)
+    elif name == "log":
+        outer = _div(ONE, _mul(u, _call("ln", Num("10"))))
+    else:
+        outer = node
+    return _mul(outer, du)
+
+
+# --- Simplifying constructors ---
+def _const(node):
+    """The numeric value of a literal (or negated literal), else None."""
+    if isinstance(node, Num):
+        return engine.float_literal(node.text)
+    if isinstance(node, UnaryOp) and isinstance(node.operand, Num):
+        value = engine.float_literal(node.operand.text)
+        return -value if node.op == "-" else value
+    return None
+
+
+def _num(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53:
+        value = int(value)
+    node = Num(repr(abs(value)))
+    return UnaryOp("-", node) if value < 0 else node
+
+
+def _fold(op, a, b):
+    # Only fold when the result is an exact int or a clean finite float
+    left, right = _const(a), _const(b)
+    if left is None or right is None:
+        return None
+    if op == "/" and right == 0:
+        return None
+    if op == "**" and (isinstance(right, float) or abs(right) > 64 or left == 0):
+        return None
+    value = _FOLD[op](left, right)
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if op == "/" and not float(value).is_integer():
+        return None
+    if isinstance(value, int) and abs(value) > 10 ** 15:
+        return None
+    return _num(value)
+
+
+def _neg(a):
+    value = _const(a)
+    if value is not None:
+        return _num(-value)
+    if isinstance(a, UnaryOp) and a.op == "-":
+        return a.operand
+    return UnaryOp("-", a)
+
+
+def _add(a, b):
+    if a == ZERO:
+        return b
+    if b == ZERO:
+        return a
+    if isinstance(b, UnaryOp) and b.op == "-":
+        return _sub(a, b.operand)
+    return _fold("+", a, b) or BinOp("+", a, b)
+
+
+def _sub(a, b):
+    if b == ZERO:
+        return a
+    if a == ZERO:
+        return _neg(b)
+    return _fold("-", a, b) or BinOp("-", a, b)
+
+
+def _mul(a, b):
+    if a == ZERO or b == ZERO:
+        return ZERO
+    if a == ONE:
+        return b
+    if b == ONE:
+        return a
+    if isinstance(a, UnaryOp) and a.op == "-":
+        return _neg(_mul(a.operand, b))
+    if isinstance(b, UnaryOp) and b.op == "-":
+        return _neg(_mul(a, b.operand))
+    folded = _fold("*", a, b)
+    if folded is not None:
+        return folded
+    # (1/d)*b -> b/d
+    if isinstance(a, BinOp) and a.op == "/" and a.left == ONE:
+        return _div(b, a.right)
+    if isinstance(b, BinOp) and b.op == "/" and b.left == ONE:
+        return _div(a, b.right)
+    # Constants go in front: x*2 -> 2*x, and merge: 3*(2*x) -> 6*x
+    if _const(b) is not None and _const(a) is None:
+        a, b = b, a
+    if _const(a) is not None and isinstance(b, BinOp) and b.op == "*":
+        folded = _fold("*", a, b.left)
+        if folded is not None:
+            return _mul(folded, b.right)
+    return BinOp("*", a, b)
+
+
+def _div(a, b):
+    if a == ZERO:
+        return ZERO
+    if b == ONE:
+        return a
+    return _fold("/", a, b) or BinOp("/", a, b)
+
+
+def _pow(a, b):
+    if b == ZERO:
+        return ONE
+    if b == ONE:
+        return a
+    return _fold("**", a, b) or BinOp("**", a, b)
+
+
+def _call(name, arg):
+    return Call(name, (arg,))
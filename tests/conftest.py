@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+# Set before app (and the modules it configures from the environment) is
+# imported: jobs run in the test process, history and admission state go to
+# a scratch directory, and the default budget is left in place for the
+# admission tests to replace.
+_scratch = tempfile.mkdtemp(prefix="calcify-tests-")
+os.environ.setdefault("CALCIFY_EXECUTOR", "inline")
+os.environ.setdefault("CALCIFY_HISTORY_PATH", os.path.join(_scratch, "history.db"))
+os.environ.setdefault("CALCIFY_RATES_PATH", os.path.join(_scratch, "rates.bin"))
+os.environ.setdefault("CALCIFY_CURRENCY_URL", "http://127.0.0.1:9/{base}")
@@ -0,0 +1,73 @@
+import pytest
+
+import admission
+import app as calc_app
+
+
+def test_estimate_prices_nodes_and_powers():
+    assert admission.estimate("1+2") == 3
+    assert admission.estimate("1+2", rows=1001) == pytest.approx(3 + 3 * admission.ROW_COST * 1000)
+    assert admission.estimate("9**9**9") > admission.BURST
+    assert admission.estimate("1 +") == 1
+    assert admission.estimate_many(["1", "1+2"]) == 4
+
+
+def test_take_admits_queues_and_rejects():
+    # A full bucket of 10 at 10 units/s with up to 0.5s of queueing
+    tokens, admitted, wait = admission._take(10, 0, 0, 6, 10, 10, 0.5)
+    assert (tokens, admitted, wait) == (4, True, 0)
+    tokens, admitted, wait = admission._take(tokens, 0, 0, 8, 10, 10, 0.5)
+    assert admitted and wait == pytest.approx(0.4) and tokens == pytest.approx(-4)
+    tokens, admitted, wait = admission._take(tokens, 0, 0, 8, 10, 10, 0.5)
+    assert not admitted and wait == pytest.approx(0.7) and tokens == pytest.approx(-4)
+    # Refilled one second later
+    tokens, admitted, wait = admission._take(tokens, 0, 1, 6, 10, 10, 0.5)
+    assert admitted and wait == 0
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request):
+    if request.param == "memory":
+        return admission.MemoryBackend()
+    return admission.SQLiteBackend(":memory:")
+
+
+def test_admission_accept_queue_reject(backend):
+    gate = admission.Admission(rate=10, burst=10, max_wait=0.5, backend=backend)
+    assert gate.charge("a", 6) == 0
+    assert gate.charge("a", 8) == pytest.approx(0.4, abs=0.05)
+    with pytest.raises(admission.Rejected) as raised:
+        gate.charge("a", 8)
+    assert raised.value.retry_after == pytest.approx(0.7, abs=0.05)
+    # Budgets are per client
+    assert gate.charge("b", 10) == 0
+
+
+def test_admission_refuses_more_than_a_bucket(backend):
+    gate = admission.Admission(rate=10, burst=10, max_wait=0.5, backend=backend)
+    with pytest.raises(admission.TooExpensive):
+        gate.charge("a", 11)
+
+
+def test_admission_disabled_with_zero_rate():
+    gate = admission.Admission(rate=0, burst=1)
+    for _ in range(100):
+        assert gate.charge("a", 1000) == 0
+
+
+def test_app_answers_429_with_retry_after(monkeypatch):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission(rate=1, burst=6, max_wait=0))
+    client = calc_app.app.test_client()
+    assert client.post("/api/calc", json={"expression": "1+2"}).status_code == 200
+    assert client.post("/api/calc", json={"expression": "1+3"}).status_code == 200
+    response = client.post("/api/calc", json={"expression": "1+2"})
+    # Recalled answers are charged too
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_app_refuses_too_expensive(monkeypatch):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission())
+    client = calc_app.app.test_client()
+    response = client.post("/api/calc", json={"expression": "9**9**9"})
+    assert response.status_code == 400
@@ -0,0 +1,133 @@
+import math
+import struct
+
+import pytest
+
+import admission
+import app as calc_app
+import wire
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Unlimited budget unless a test sets its own
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission(rate=0))
+    return calc_app.app.test_client()
+
+
+def _floats(data):
+    return list(struct.unpack(f"<{len(data) // 8}d", data))
+
+
+# --- Bulk ---
+def test_bulk_masks_each_failed_entry(client):
+    response = client.post("/api/calc", json={
+        "expressions": ["a+b", "(-1)**0.5", "1/0", "1e308*10", "2**", "a*b"], "vars": {"a": 3, "b": 4}})
+    assert response.status_code == 200
+    assert response.json == {"result": [7, None, None, None, None, 12],
+                             "error": [False, True, True, True, True, False]}
+
+
+def test_bulk_rejects_non_string_entries(client):
+    response = client.post("/api/calc", json={"expressions": [1, None]})
+    assert response.status_code == 400
+    assert client.post("/api/calc", json={"expressions": "1+1"}).status_code == 400
+
+
+def test_bulk_float64(client):
+    response = client.post("/api/calc", json={"expressions": ["1+1", "1/0"]},
+                           headers={"Accept": wire.FLOAT64})
+    assert response.mimetype == wire.FLOAT64
+    values = _floats(response.data)
+    assert values[0] == 2 and math.isnan(values[1])
+
+
+# --- Single ---
+@pytest.mark.parametrize("text", ["(-1)**0.5", "1e308*10", "1/0", "2**", "__import__('os')"])
+def test_single_errors_are_400(client, text):
+    response = client.post("/api/calc", json={"expression": text})
+    assert response.status_code == 400
+    assert "error" in response.json
+
+
+# --- Batch ---
+def test_batch_masks_failed_rows(client):
+    response = client.post("/api/calc/batch", json={
+        "expression": "ln(x)*y", "columns": {"x": [1, 0, "a", math.e], "y": [1, 2, 3, 4]}})
+    assert response.status_code == 200
+    assert response.json["error"] == [False, True, True, False]
+    assert response.json["result"][:3] == [0, None, None]
+    assert response.json["result"][3] == pytest.approx(4)
+
+
+def test_batch_missing_column_is_400(client):
+    response = client.post("/api/calc/batch", json={"expression": "x+y", "columns": {"x": [1]}})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("body", [[1, 2], "x", {"expression": "x", "columns": [[1, 2]]},
+                                  {"expression": "x", "columns": {"x": 1}},
+                                  {"expression": "x", "columns": {"x": [1, 2], "y": [1]}}])
+def test_batch_malformed_body_is_400(client, body):
+    response = client.post("/api/calc/batch", json=body)
+    assert response.status_code == 400
+    assert "error" in response.json
+
+
+def test_batch_float64_has_nan_for_failed_rows(client):
+    if calc_app.engine.np is None:
+        pytest.skip("NumPy is not installed")
+    response = client.post("/api/calc/batch", json={"expression": "sqrt(x)", "columns": {"x": [4, -1, "a"]}},
+                           headers={"Accept": wire.FLOAT64})
+    assert response.mimetype == wire.FLOAT64
+    values = _floats(response.data)
+    assert values[0] == 2 and math.isnan(values[1]) and math.isnan(values[2])
+
+
+def test_sample_rejects_non_math_numpy_names(client):
+    response = client.get("/api/sample", query_string={"expression": "math.size(math.zeros(10))+x",
+                                                        "n": 10})
+    assert response.status_code == 400
+
+
+# --- Negotiation ---
+def test_json_by_default(client):
+    for headers in ({}, {"Accept": "*/*"}, {"Accept": "text/html"}):
+        response = client.post("/api/calc", json={"expression": "6*7"}, headers=headers)
+        assert response.mimetype == wire.JSON
+        assert response.json == {"result": 42}
+        assert "Accept" in response.headers["Vary"]
+
+
+def test_msgpack_when_asked(client):
+    msgpack = pytest.importorskip("msgpack")
+    response = client.post("/api/calc", json={"expression": "6*7"},
+                           headers={"Accept": "application/msgpack, application/json;q=0.5"})
+    assert response.mimetype == wire.MSGPACK
+    assert msgpack.unpackb(response.data) == {"result": 42}
+
+
+def test_msgpack_sends_wide_ints_as_strings(client):
+    msgpack = pytest.importorskip("msgpack")
+    headers = {"Accept": wire.MSGPACK}
+    response = client.post("/api/calc", json={"expression": "2**100"}, headers=headers)
+    assert response.status_code == 200
+    assert msgpack.unpackb(response.data) == {"result": str(2 ** 100)}
+    response = client.post("/api/calc", json={"expressions": ["2**100", "2**10"]}, headers=headers)
+    assert msgpack.unpackb(response.data) == {"result": [str(2 ** 100), 1024], "error": [False, False]}
+
+
+def test_float64_only_for_float_results(client):
+    response = client.post("/api/calc", json={"expression": "1/4"}, headers={"Accept": wire.FLOAT64})
+    assert response.mimetype == wire.FLOAT64
+    assert _floats(response.data) == [0.25]
+    response = client.post("/api/calc", json={"expression": "1/4", "mode": "rational"},
+                           headers={"Accept": wire.FLOAT64})
+    # Only float results have a lossless float64 form
+    assert response.mimetype == wire.JSON
+    assert response.json == {"result": "1/4"}
+
+
+def test_currency_rejects_bad_base(client):
+    for base in ("US", "usd/../x", "US1"):
+        assert client.get("/api/currency", query_string={"base": base}).status_code == 400
@@ -0,0 +1,132 @@
+import asyncio
+import json
+import threading
+import time
+
+import admission
+import aserver
+import executor
+import rates
+
+
+class SlowExecutor(executor.InlineExecutor):
+    """Counts jobs and holds each one long enough for others to pile up."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def run(self, func, *args, timeout=None):
+        with self._lock:
+            self.calls += 1
+        time.sleep(0.2)
+        return super().run(func, *args, timeout=timeout)
+
+
+def _server(evaluator=None, gate=None):
+    return aserver.CalcServer(evaluator=evaluator or executor.InlineExecutor(),
+                              rate_cache=rates.RateCache(url="http://127.0.0.1:9/{base}"),
+                              admission_control=gate or admission.Admission(rate=0))
+
+
+async def _request(port, raw):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    lines = head.decode().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, json.loads(body) if body else None
+
+
+def _post(body, path="/api/calc"):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    return (f"POST {path} HTTP/1.1\r\nConnection: close\r\nContent-Length: {len(body)}\r\n\r\n"
+            .encode() + body)
+
+
+def _serve(server, scenario):
+    """Run `scenario(port)` against `server` on a free port."""
+    async def main():
+        listener = await asyncio.start_server(server.handle_connection, "127.0.0.1", 0)
+        try:
+            return await scenario(listener.sockets[0].getsockname()[1])
+        finally:
+            listener.close()
+            await listener.wait_closed()
+    return asyncio.run(main())
+
+
+def test_calculate_with_modes():
+    async def scenario(port):
+        return [await _request(port, _post(body)) for body in (
+            {"expression": "1/3"}, {"expression": "1/3", "mode": "rational"},
+            {"expression": "1/3", "mode": "decimal", "precision": 5},
+            {"expressions": ["1+1", "(-1)**0.5"]})]
+    results = _serve(_server(), scenario)
+    assert [(status, body) for status, _, body in results] == [
+        (200, {"result": 1 / 3}), (200, {"result": "1/3"}), (200, {"result": "0.33333"}),
+        (200, {"result": [2, None], "error": [False, True]})]
+
+
+def test_error_paths():
+    async def scenario(port):
+        return [await _request(port, raw) for raw in (
+            _post({"expression": "(-1)**0.5"}), _post({"expression": "1e308*10"}),
+            _post(b'{"expression": "1", "precision": 1e400}'), _post({"expressions": [1]}),
+            _post(b"not json"), _post({}, path="/nowhere"),
+            b"GET /api/currency?base=x/y HTTP/1.1\r\nConnection: close\r\n\r\n")]
+    statuses = [status for status, _, _ in _serve(_server(), scenario)]
+    assert statuses == [400, 400, 400, 400, 400, 404, 400]
+
+
+def test_oversized_lines_get_a_response():
+    async def scenario(port):
+        header = b"X-Big: " + b"a" * 70000 + b"\r\n"
+        return (await _request(port, b"POST /api/calc HTTP/1.1\r\n" + header + b"\r\n"),
+                await _request(port, b"GET /" + b"a" * 70000 + b" HTTP/1.1\r\n\r\n"))
+    (header_status, _, header_body), (line_status, _, _) = _serve(_server(), scenario)
+    assert header_status == 431 and "error" in header_body
+    assert line_status == 414
+
+
+def test_keep_alive_serves_several_requests():
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        replies = []
+        for text in ("1+1", "2+2"):
+            body = json.dumps({"expression": text}).encode()
+            writer.write(b"POST /api/calc HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+            await reader.readuntil(b"\r\n\r\n")
+            replies.append(await reader.readuntil(b"}"))
+        writer.close()
+        return replies
+    assert _serve(_server(), scenario) == [b'{"result": 2}', b'{"result": 4}']
+
+
+def test_identical_requests_are_coalesced():
+    slow = SlowExecutor()
+    server = _server(slow)
+
+    async def scenario(port):
+        same = [_request(port, _post({"expression": "6*7"})) for _ in range(5)]
+        other = _request(port, _post({"expression": "6*7", "mode": "rational"}))
+        return await asyncio.gather(*same, other)
+    results = _serve(server, scenario)
+    assert [body for _, _, body in results] == [{"result": 42}] * 5 + [{"result": "42"}]
+    assert slow.calls == 2
+    assert server.coalescer.coalesced == 4
+
+
+def test_over_budget_gets_429():
+    gate = admission.Admission(rate=1, burst=6, max_wait=0)
+
+    async def scenario(port):
+        return [await _request(port, _post({"expression": "1+2"})) for _ in range(3)]
+    (first, _, _), (second, _, _), (third, headers, _) = _serve(_server(gate=gate), scenario)
+    assert (first, second, third) == (200, 200, 429)
+    assert int(headers["Retry-After"]) >= 1
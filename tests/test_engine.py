@@ -0,0 +1,100 @@
+import math
+
+import pytest
+
+import engine
+
+# The supported grammar, all of it also valid Python
+EXPRESSIONS = [
+    "1+2*3", "(1+2)*3", "2**10", "2**-1", "-2**2", "(-2)**2", "7//2", "-7//2", "7%3", "-7%3",
+    "7/2", "1e3+.5", "3.25e-2*4", "--3", "+-+3", "2**3**2", "10-4-3", "100/10/5",
+    "sin(pi/6)", "cos(0)+tan(pi/4)", "sqrt(16)+log(1000)", "ln(e)", "math.floor(2.7)",
+    "math.hypot(3, 4)", "math.exp(1)-e", "sqrt(2)*sin(pi/4)+ln(10)",
+]
+
+NAMESPACE = dict(engine.ALLOWED_NAMES)
+
+
+@pytest.mark.parametrize("text", EXPRESSIONS)
+def test_matches_python_eval(text):
+    expected = eval(text, {"__builtins__": {}}, NAMESPACE)
+    result = engine.evaluate(text)
+    assert type(result) is type(expected)
+    assert result == pytest.approx(expected, rel=1e-15)
+
+
+@pytest.mark.parametrize("text", ["x*y+1", "sin(x)**2+cos(x)**2", "x//y", "x%y"])
+def test_variables_match_python_eval(text):
+    variables = {"x": 7.5, "y": 2}
+    expected = eval(text, {"__builtins__": {}}, dict(NAMESPACE, **variables))
+    assert engine.evaluate(text, variables) == pytest.approx(expected, rel=1e-15)
+
+
+@pytest.mark.parametrize("text", ["__import__('os')", "().__class__", "x.__class__", "open('f')",
+                                  "lambda: 1", "1 +", "(1", "1 2", "[1]", "'a'"])
+def test_rejects_outside_grammar(text):
+    with pytest.raises(engine.ExpressionError):
+        engine.evaluate(text, {"x": 1})
+
+
+@pytest.mark.parametrize("text", ["1/0", "sqrt(-1)", "ln(0)"])
+def test_raises_like_python(text):
+    with pytest.raises((ArithmeticError, ValueError)):
+        engine.evaluate(text)
+
+
+def test_evaluate_many_matches_single_evaluation():
+    texts = ["sqrt(a*a+b*b)", "sqrt(a*a+b*b)*2", "a+b", "b+a", "2**10"]
+    values, errors = engine.evaluate_many(texts, {"a": 3, "b": 4})
+    assert values == [engine.evaluate(text, {"a": 3, "b": 4}) for text in texts]
+    assert errors == [False] * len(texts)
+
+
+def test_evaluate_many_masks_failures():
+    texts = ["1/0", "(-1)**0.5", "1e308*10", "1 +", None, 3, "unbound+1", "1+1"]
+    values, errors = engine.evaluate_many(texts)
+    assert errors == [True] * 7 + [False]
+    assert values == [None] * 7 + [2]
+
+
+def test_batch_matches_scalar_rows():
+    columns = {"x": [0.5, 1.0, 2.0], "y": [1, 2, 3]}
+    values, errors = engine.evaluate_batch("sin(x)*y + ln(y)", columns)
+    expected = [math.sin(x) * y + math.log(y) for x, y in zip(columns["x"], columns["y"])]
+    assert values == pytest.approx(expected)
+    assert errors == [False, False, False]
+
+
+def test_batch_masks_failed_rows():
+    values, errors = engine.evaluate_batch("ln(x)", {"x": [1, 0, -1, math.e]})
+    assert errors == [False, True, True, False]
+    assert values[0] == 0 and values[1] is None and values[2] is None
+    assert values[3] == pytest.approx(1)
+
+
+def test_batch_bad_cell_fails_only_its_row():
+    values, errors = engine.evaluate_batch("x*2", {"x": ["a", 1, None, 2.5]})
+    assert values == [None, 2.0, None, 5.0]
+    assert errors == [True, False, True, False]
+
+
+def test_batch_constant_failure_falls_back_per_row():
+    values, errors = engine.evaluate_batch("x + 1/y", {"x": [1, 2], "y": [0, 2]})
+    assert values == [None, 2.5]
+    assert errors == [True, False]
+
+
+def test_batch_ragged_columns_fail_whole_batch():
+    with pytest.raises(engine.ExpressionError):
+        engine.evaluate_batch("x+y", {"x": [1, 2], "y": [1]})
+    with pytest.raises(engine.ExpressionError):
+        engine.evaluate_batch("x+y", {"x": [1, 2]})
+
+
+def test_array_names_expose_only_math_functions():
+    if engine.ARRAY_NAMES is None:
+        pytest.skip("NumPy is not installed")
+    func, _ = engine.compile_tree(engine.parse("math.sin(x)+math.pi"), engine.ARRAY_NAMES)
+    assert func(x=engine.np.zeros(2)).tolist() == [math.pi, math.pi]
+    with pytest.raises(engine.ExpressionError):
+        engine.compile_tree(engine.parse("math.size(math.zeros(10))+x"), engine.ARRAY_NAMES)
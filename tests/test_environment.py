@@ -0,0 +1,105 @@
+import pytest
+
+import admission
+import app as calc_app
+import engine
+import environment
+import executor
+
+
+@pytest.fixture
+def env():
+    return environment.Environment()
+
+
+def test_define_constants_and_functions(env):
+    env.define("rate = 0.07")
+    env.define("f(x, y) = x*rate + y")
+    assert env.evaluate("f(100, 1)") == pytest.approx(8.0)
+    assert env.evaluate("f(2, 0)", mode="rational") == pytest.approx(0.14)
+    assert env.definitions() == ["rate = 0.07", "f(x, y) = x*rate + y"]
+
+
+def test_parameters_shadow_other_names(env):
+    env.define("x = 10")
+    env.define("g(x) = x + 1")
+    assert env.evaluate("g(1) + x") == 12
+
+
+def test_redefine_replaces_the_value(env):
+    env.define("a = 2")
+    assert env.evaluate("a*3") == 6
+    env.define("a = 5")
+    assert env.evaluate("a*3") == 15
+    assert env.definitions() == ["a = 5"]
+
+
+def test_redefining_recomputes_dependents_and_keeps_unrelated_results(env):
+    env.define("a = 2")
+    env.define("b = a*10")
+    env.define("c = 7")
+    assert env.evaluate("b + 1") == 21
+    assert env.evaluate("c*2") == 14
+    env.define("a = 3")
+    assert env.lookup("b + 1") is None
+    assert env.lookup("c*2") == 14
+    assert env.evaluate("b + 1") == 31
+
+
+def test_bad_definitions_leave_the_environment_unchanged(env):
+    env.define("a = 1")
+    env.define("b = a + 1")
+    with pytest.raises(engine.ExpressionError):
+        env.define("a = b")
+    with pytest.raises(engine.ExpressionError):
+        env.define("a = nope")
+    with pytest.raises(engine.ExpressionError):
+        env.define("sin = 3")
+    assert env.evaluate("a + b") == 3
+    with pytest.raises(engine.ExpressionError):
+        env.remove("a")
+
+
+def test_define_without_check_leaves_evaluation_to_use(env):
+    env.define("a = 1/0", check=False)
+    with pytest.raises(ZeroDivisionError):
+        env.evaluate("a")
+
+
+def test_define_in_returns_constant_values():
+    assert environment.define_in(["a = 2", "f(x) = x*a"], "b = f(a)") == [2, 4]
+    assert environment.define_in(["a = 2", "b = a*10"], "a = 3") == [3, 30]
+    with pytest.raises(engine.ExpressionError):
+        environment.define_in([], "b = q")
+
+
+def test_dependents_are_evaluated_under_the_time_limit():
+    pool = executor.ProcessExecutor(size=1, queue_depth=0, time_limit=1.0)
+    try:
+        with pytest.raises(executor.EvaluationTimeout):
+            pool.run(environment.define_in, ["a = 2", "b = a**a**a"], "a = 9")
+    finally:
+        pool.shutdown()
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission(rate=0))
+    return calc_app.app.test_client()
+
+
+def test_app_definitions(client):
+    assert client.post("/api/calc", json={"expression": "rate = 0.5"}).json == {
+        "defined": "rate", "definitions": ["rate = 0.5"]}
+    client.post("/api/calc", json={"expression": "f(x) = x*rate"})
+    assert client.post("/api/calc", json={"expression": "f(8)"}).json == {"result": 4.0}
+    client.post("/api/calc", json={"expression": "rate = 2"})
+    assert client.post("/api/calc", json={"expression": "f(8)"}).json == {"result": 16}
+
+
+@pytest.mark.parametrize("text", ["big = 3**3**15", "big = 10**5000", "big = nope"])
+def test_app_rejects_expensive_or_invalid_definitions(client, monkeypatch, text):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission())
+    response = client.post("/api/calc", json={"expression": text})
+    assert response.status_code == 400
+    assert client.get("/api/definitions").json == {"definitions": []}
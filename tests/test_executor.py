@@ -0,0 +1,70 @@
+import threading
+
+import pytest
+
+import engine
+import executor
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = executor.ProcessExecutor(size=1, queue_depth=0, time_limit=1.0, max_digits=50)
+    yield pool
+    pool.shutdown()
+
+
+def test_runs_jobs_in_a_worker(pool):
+    assert pool.run(engine.evaluate, "6*7") == 42
+    assert pool.map(engine.evaluate, [("1+1",), ("x*2", {"x": 3})]) == [2, 6]
+
+
+def test_worker_errors_are_raised_in_the_caller(pool):
+    with pytest.raises(engine.ExpressionError):
+        pool.run(engine.evaluate, "1 +")
+    with pytest.raises(ZeroDivisionError):
+        pool.run(engine.evaluate, "1/0")
+
+
+def test_result_size_limit(pool):
+    assert pool.run(engine.evaluate, "10**49") == 10 ** 49
+    with pytest.raises(executor.ResultTooLarge):
+        pool.run(engine.evaluate, "10**60")
+
+
+def test_runaway_job_is_killed_and_replaced(pool):
+    timeouts = pool.stats.timeouts
+    with pytest.raises(executor.EvaluationTimeout):
+        pool.run(engine.evaluate, "9**9**9")
+    assert pool.stats.timeouts == timeouts + 1
+    # The replacement worker takes the next job
+    assert pool.run(engine.evaluate, "2+2") == 4
+
+
+def test_full_queue_is_rejected(pool):
+    started = threading.Event()
+    outcome = []
+
+    def slow():
+        started.set()
+        try:
+            pool.run(engine.evaluate, "9**9**9", timeout=0.5)
+        except executor.EvaluationTimeout as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=slow)
+    thread.start()
+    started.wait()
+    # Let the first job take the only slot
+    threading.Event().wait(0.1)
+    with pytest.raises(executor.QueueFull):
+        pool.run(engine.evaluate, "1+1")
+    thread.join()
+    assert outcome and pool.stats.rejected >= 1
+
+
+def test_inline_executor_checks_results():
+    inline = executor.InlineExecutor()
+    assert inline.run(engine.evaluate, "2**10") == 1024
+    with pytest.raises(executor.ResultTooLarge):
+        executor.check_result(2 ** 20000)
+    assert inline.metrics()["jobs"] == 1
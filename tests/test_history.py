@@ -0,0 +1,109 @@
+import math
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+import admission
+import app as calc_app
+import history
+import numeric
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = history.HistoryStore(str(tmp_path / "history.db"))
+    yield store
+    store.close()
+
+
+@pytest.mark.parametrize("text, mode, precision", [
+    ("0.1+0.2", "float", None),
+    ("2**100", "float", None),
+    ("1/3", "decimal", 10),
+    ("1/3", "decimal", 40),
+    ("1/3", "rational", None),
+    ("sin(1)", "rational", None),
+    ("2**100", "rational", None),
+])
+def test_recall_gives_back_the_same_value_and_type(store, text, mode, precision):
+    result = numeric.evaluate(text, mode=mode, precision=precision or numeric.DEFAULT_PRECISION)
+    store.append(text, result, mode, precision)
+    store.flush()
+    # A fresh store reads from the table rather than the in-memory memo
+    reopened = history.HistoryStore(store.path)
+    try:
+        for recalled in (store.recall(text, mode, precision), reopened.recall(text, mode, precision)):
+            assert type(recalled) is type(result)
+            assert recalled == result
+    finally:
+        reopened.close()
+
+
+def test_recall_is_keyed_by_mode_and_decimal_precision(store):
+    store.append("1/3", Decimal("0.333"), "decimal", 3)
+    assert store.recall("1/3", "decimal", 3) == Decimal("0.333")
+    assert store.recall("1/3", "decimal", 4) is None
+    assert store.recall("1/3", "float") is None
+    assert store.recall("1/3", "rational") is None
+    # Precision only matters in decimal mode
+    store.append("1/3", Fraction(1, 3), "rational", 7)
+    assert store.recall("1/3", "rational", 50) == Fraction(1, 3)
+
+
+def test_recall_normalizes_the_expression(store):
+    store.append("2 ^ 3", 8)
+    assert store.recall("2**3") == 8
+    assert store.recall("2**4") is None
+
+
+def test_listing_is_limited_to_an_owner(store):
+    store.append("1+1", 2, owner="a")
+    store.append("1+2", 3, owner="b")
+    store.append("1+3", 4)
+    assert [e["expression"] for e in store.recent(owner="a")] == ["1+1"]
+    assert [e["expression"] for e in store.search("1+", prefix=True, owner="b")] == ["1+2"]
+    assert [e["expression"] for e in store.recent(owner="")] == ["1+3"]
+    assert len(store.recent()) == 3
+    # Recall is shared: the answer doesn't depend on who asked
+    assert store.recall("1+2") == 3
+
+
+def test_app_recall_keeps_float_results_floats(monkeypatch):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission(rate=0))
+    client = calc_app.app.test_client()
+    first = client.post("/api/calc", json={"expression": "sin(1.5)", "mode": "rational"}).json
+    second = client.post("/api/calc", json={"expression": "sin(1.5)", "mode": "rational"}).json
+    assert first == second == {"result": math.sin(1.5)}
+
+
+def test_app_history_is_per_session(monkeypatch):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission(rate=0))
+    alice = calc_app.app.test_client()
+    bob = calc_app.app.test_client()
+    alice.post("/api/calc", json={"expression": "123+456"})
+    bob.post("/api/calc", json={"expression": "123+456"})
+    bob.post("/api/calc", json={"expression": "789+1"})
+    assert [e["expression"] for e in alice.get("/api/history").json] == ["123+456"]
+    assert [e["expression"] for e in bob.get("/api/history").json] == ["789+1", "123+456"]
+    assert calc_app.app.test_client().get("/api/history").json == []
+
+
+def test_compaction_keeps_the_newest_row_per_calculation(store):
+    for value in (1, 2, 3):
+        store.append("x", value, owner="a")
+    store.append("x", 4, owner="b")
+    assert store.compact() == 2
+    assert [(e["result"], e["expression"]) for e in store.recent()] == [("4", "x"), ("3", "x")]
+
+
+def test_append_compacts_in_the_background(tmp_path, monkeypatch):
+    monkeypatch.setattr(history, "COMPACT_EVERY", 10)
+    store = history.HistoryStore(str(tmp_path / "history.db"), max_rows=5)
+    try:
+        for i in range(10):
+            store.append(f"{i}+0", i)
+        store._compactor.join()
+        assert [e["expression"] for e in store.recent()] == [f"{i}+0" for i in range(9, 4, -1)]
+    finally:
+        store.close()
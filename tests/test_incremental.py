@@ -0,0 +1,60 @@
+import pytest
+
+import engine
+import incremental
+import numeric
+
+EXPRESSIONS = [
+    # precedence
+    "2+3*4", "2*3+4", "10-4-3", "8/4/2", "2*(3+4)*5", "1+2*3**2", "7//2*3", "-7%3+1", "7-2*3//2",
+    # right-associative **
+    "2**3**2", "(2**3)**2", "2**-1", "2**-1**2", "4**0.5**2",
+    # unary minus
+    "-2**2", "(-2)**2", "-(3-5)*2", "--3", "-3*-2", "2*-3**2", "1-(-1)",
+    # parentheses and calls
+    "((1+2))*(3-(4-5))", "1/3+1/6", "sqrt(16)+1", "pi*2", "2**100*3-1", "0.1+0.2",
+]
+MODES = [("float", None), ("decimal", 28), ("decimal", 8), ("rational", None)]
+
+
+def _chunks(text):
+    # Committed the way the calculator does: each operand with the operator after it
+    chunks, current = [], ""
+    for kind, value in engine.tokenize(text):
+        current += value
+        if kind == "op" and value not in "(":
+            chunks.append(current)
+            current = ""
+    return chunks, current
+
+
+@pytest.mark.parametrize("mode, precision", MODES)
+@pytest.mark.parametrize("text", EXPRESSIONS)
+def test_matches_numeric_evaluate(text, mode, precision):
+    backend = numeric.get_backend(mode, precision or numeric.DEFAULT_PRECISION)
+    expected = numeric.evaluate(text, mode=mode, precision=precision or numeric.DEFAULT_PRECISION)
+    chunks, pending = _chunks(text)
+    evaluator = incremental.IncrementalEvaluator(backend)
+    for chunk in chunks:
+        evaluator.feed(chunk)
+    assert evaluator.text + pending == "".join(value for _, value in engine.tokenize(text))
+    for result in (evaluator.result(pending), evaluator.preview(pending)):
+        assert type(result) is type(expected)
+        assert result == expected
+
+
+def test_switching_backend_replays_the_input():
+    evaluator = incremental.IncrementalEvaluator()
+    evaluator.feed("1/3+")
+    assert evaluator.result("1/6") == 1 / 3 + 1 / 6
+    evaluator.set_backend(numeric.RATIONAL)
+    assert evaluator.result("1/6") == numeric.evaluate("1/3+1/6", mode="rational")
+
+
+def test_incomplete_input():
+    evaluator = incremental.IncrementalEvaluator()
+    evaluator.feed("(1+2)*(3+")
+    assert evaluator.preview() is None
+    assert evaluator.preview("4") == 21
+    with pytest.raises(engine.ExpressionError):
+        evaluator.result("4")
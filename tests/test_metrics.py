@@ -0,0 +1,79 @@
+import admission
+import app as calc_app
+import engine
+import metrics
+
+
+def test_counter_renders_labels_escaped():
+    counter = metrics.Counter("things_total", "Things", ["kind"])
+    counter.inc('say "hi"\n')
+    counter.inc("a", amount=2)
+    counter.inc("a")
+    assert counter.render() == ["# HELP things_total Things", "# TYPE things_total counter",
+                                'things_total{kind="a"} 3', 'things_total{kind="say \\"hi\\"\\n"} 1']
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 7.0):
+        histogram.observe(value)
+    assert histogram.render()[2:] == ['latency_seconds_bucket{le="0.1"} 2',
+                                      'latency_seconds_bucket{le="1.0"} 3',
+                                      'latency_seconds_bucket{le="+Inf"} 4',
+                                      "latency_seconds_sum 7.65", "latency_seconds_count 4"]
+
+
+def test_registry_keeps_the_first_metric_and_skips_broken_gauges():
+    registry = metrics.Registry()
+    first = registry.register(metrics.Counter("c_total", "C"))
+    assert registry.register(metrics.Counter("c_total", "Again")) is first
+    registry.register(metrics.Gauge("broken", "Broken", lambda: 1 / 0))
+    registry.register(metrics.Gauge("answer", "Answer", lambda: 42))
+    assert registry.render().splitlines()[-1] == "answer 42"
+    assert "broken" not in registry.render()
+
+
+def test_traces_collect_stage_timings_on_their_thread():
+    assert metrics.current() is None
+    with metrics.tracing("outer", record=False) as outer:
+        # Not seen before, so it is parsed and compiled here
+        engine.evaluate("1+2*3+0.5151")
+        with metrics.tracing("inner", record=False) as inner:
+            assert metrics.current() is inner
+        assert metrics.current() is outer
+    assert metrics.current() is None
+    assert {"cache_lookup", "parse", "compile", "execute"} <= set(outer.stages)
+
+
+def test_recorded_traces_feed_the_stage_histogram():
+    def executed():
+        line = 'calc_stage_seconds_count{stage="test_stage"}'
+        return sum(int(l.split()[-1]) for l in metrics.STAGES.render() if l.startswith(line))
+    before = executed()
+    with metrics.tracing("x") as trace:
+        trace.add("test_stage", 0.5)
+    with metrics.tracing("y", record=False) as trace:
+        trace.add("test_stage", 0.5)
+    assert executed() == before + 1
+
+
+def test_profiler_keeps_the_slowest():
+    profiler = metrics.SlowestProfiler(2)
+    for total, label in ((0.1, "a"), (0.3, "b"), (0.2, "c"), (0.05, "d")):
+        trace = metrics.Trace(label)
+        trace.add("execute", total)
+        profiler.offer(total, trace)
+    assert profiler.snapshot() == [{"expression": "b", "total": 0.3, "stages": {"execute": 0.3}},
+                                   {"expression": "c", "total": 0.2, "stages": {"execute": 0.2}}]
+
+
+def test_metrics_route(monkeypatch):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission(rate=0))
+    client = calc_app.app.test_client()
+    client.post("/api/calc", json={"expression": "40+2"})
+    response = client.get("/metrics")
+    assert response.mimetype == "text/plain"
+    text = response.get_data(as_text=True)
+    assert 'calc_requests_total{outcome="ok"}' in text
+    assert 'http_request_seconds_count{route="calc"}' in text
+    assert "executor_jobs" in text
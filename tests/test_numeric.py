@@ -0,0 +1,59 @@
+from decimal import Decimal
+from fractions import Fraction
+
+import pytest
+
+import executor
+import numeric
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("math.floor(2.5)", Decimal(2)), ("math.floor(-2.5)", Decimal(-3)),
+    ("math.ceil(2.5)", Decimal(3)), ("math.ceil(-2.5)", Decimal(-2)),
+])
+def test_decimal_floor_and_ceil_stay_decimal(text, expected):
+    result = numeric.evaluate(text, mode="decimal")
+    assert isinstance(result, Decimal)
+    assert result == expected
+
+
+@pytest.mark.parametrize("text, variables, expected", [
+    ("-7//2", {}, -4), ("x//2", {"x": -7}, -4), ("-7.0//2", {}, -4), ("x//2", {"x": -7.0}, -4),
+    ("-7%2", {}, 1), ("x%2", {"x": -7}, 1), ("-7.0%2", {}, 1), ("7.5%-2", {}, Decimal("-0.5")),
+    ("x%y", {"x": 7, "y": -2}, -1), ("6.0%3", {}, 0),
+])
+def test_decimal_floordiv_and_mod_floor_like_other_modes(text, variables, expected):
+    result = numeric.evaluate(text, variables, mode="decimal")
+    assert result == expected
+    assert result == numeric.evaluate(text, variables, mode="rational")
+    assert result == numeric.evaluate(text, variables)
+
+
+def test_decimal_long_mod_chain_compiles():
+    assert numeric.evaluate("%".join(["-1000.0"] + ["7"] * 500), mode="decimal") == 1
+
+
+def test_modes():
+    assert numeric.evaluate("1/3") == 1 / 3
+    assert numeric.evaluate("1/3", mode="rational") == Fraction(1, 3)
+    assert numeric.evaluate("1/3", mode="decimal", precision=5) == Decimal("0.33333")
+    with pytest.raises(ValueError):
+        numeric.evaluate("1/3", mode="octal")
+
+
+@pytest.mark.parametrize("value", [complex(0, 1), float("inf"), float("nan"), Decimal("Infinity")])
+def test_check_result_rejects_unencodable(value):
+    with pytest.raises(ValueError):
+        numeric.check_result(value)
+
+
+@pytest.mark.parametrize("value", [10 ** 5000, Fraction(1, 10 ** 5000), Decimal("9" * 5000),
+                                   [1, [2, 10 ** 5000]]], ids=["int", "fraction", "decimal", "nested"])
+def test_result_size_budget_covers_exact_types(value):
+    with pytest.raises(executor.ResultTooLarge):
+        executor.check_result(value, max_digits=4000)
+
+
+def test_result_size_budget_allows_normal_results():
+    value = [10 ** 100, Fraction(1, 3), Decimal("0.1"), 1.5]
+    assert executor.check_result(value, max_digits=4000) is value
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import rates
+
+
+class StubCache(rates.RateCache):
+    def __init__(self, *args, payload=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.payload = payload or {"USD": 1, "EUR": 0.9137, "JPY": 151.25}
+
+    def _fetch(self, base):
+        self.fetch_count += 1
+        return {"base": base, "rates": dict(self.payload)}
+
+
+class FailingCache(rates.RateCache):
+    def _fetch(self, base):
+        self.fetch_count += 1
+        raise OSError("upstream down")
+
+
+@pytest.mark.parametrize("base", ["USD", "EUR"])
+def test_valid_base(base):
+    assert rates.valid_base(base)
+
+
+@pytest.mark.parametrize("base", ["usd", "US", "USDX", "US/", "../", "", None])
+def test_invalid_base(base):
+    assert not rates.valid_base(base)
+    with pytest.raises(ValueError):
+        rates.RateCache().get(base)
+
+
+def test_failed_fetch_is_cached():
+    cache = FailingCache(failure_ttl=60)
+    for _ in range(3):
+        with pytest.raises(OSError):
+            cache.get("EUR")
+    assert cache.fetch_count == 1
+    assert cache.get("EUR", wait=False) is None
+    assert cache.fetch_count == 1
+
+
+def test_failed_fetch_is_retried_after_ttl():
+    cache = FailingCache(failure_ttl=0)
+    for _ in range(2):
+        with pytest.raises(OSError):
+            cache.get("EUR")
+    assert cache.fetch_count == 2
+
+
+def test_snapshots_round_trip(tmp_path):
+    path = str(tmp_path / "rates.bin")
+    snapshots = {"USD": rates.RateSnapshot({"base": "USD", "rates": {"EUR": 0.1 + 0.2, "JPY": 151.25}},
+                                           1700000000.123456, version=7),
+                 "EUR": rates.RateSnapshot({"base": "EUR", "rates": {}}, 1700000001.5)}
+    rates.write_snapshots(path, snapshots)
+    loaded = rates.read_snapshots(path)
+    assert list(loaded) == ["USD", "EUR"]
+    for base, snapshot in snapshots.items():
+        assert loaded[base].data == snapshot.data
+        assert loaded[base].fetched_at == snapshot.fetched_at
+        assert loaded[base].version == snapshot.version
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+@pytest.mark.parametrize("content", [None, b"", b"garbage", b"XYZ\x01\x00\x00", b"CRS\x02\x00\x00",
+                                     b"CRS\x01\x01\x00USD"])
+def test_unreadable_snapshot_files_read_as_empty(tmp_path, content):
+    path = tmp_path / "rates.bin"
+    if content is not None:
+        path.write_bytes(content)
+    assert rates.read_snapshots(str(path)) == {}
+
+
+def test_restart_serves_saved_rates_without_fetching(tmp_path):
+    path = str(tmp_path / "rates.bin")
+    first = StubCache(path=path)
+    fetched = first.get("USD")
+    assert first.fetch_count == 1
+    seen = []
+    second = StubCache(path=path)
+    second.subscribe(lambda base, snapshot: seen.append(base))
+    restored = second.get("USD")
+    assert second.fetch_count == 0
+    assert restored.rates == fetched.rates
+    assert restored.fetched_at == fetched.fetched_at
+    assert seen == ["USD"]
+
+
+def test_merged_snapshots_keep_missing_codes_and_count_changes():
+    snapshot = rates.RateSnapshot({"base": "USD", "rates": {"EUR": 0.9, "JPY": 150.0}}, 0)
+    same = snapshot.merged({"base": "USD", "rates": {"EUR": 0.9}}, 1)
+    assert same.version == snapshot.version
+    assert same.rates == {"EUR": 0.9, "JPY": 150.0}
+    changed = same.merged({"base": "USD", "rates": {"JPY": 151.0}}, 2)
+    assert changed.version == snapshot.version + 1
+    assert changed.rates == {"EUR": 0.9, "JPY": 151.0}
@@ -0,0 +1,108 @@
+import math
+
+import pytest
+
+import engine
+import solver
+
+np = engine.np
+pytestmark = pytest.mark.skipif(np is None, reason="solving needs NumPy")
+
+
+@pytest.fixture(autouse=True)
+def cold_starts(monkeypatch):
+    # Each test starts without solutions cached by the others
+    monkeypatch.setattr(solver, "warm_starts", solver.WarmStarts())
+
+
+def test_converges_for_every_row():
+    solutions, converged, iterations = solver.solve("x**2 = a", params={"a": [4, 9, 2]})
+    assert np.allclose(solutions["x"], [2, 3, math.sqrt(2)], rtol=0, atol=1e-12)
+    assert converged.all()
+    assert 0 < iterations <= solver.MAX_ITERATIONS
+
+
+def test_batch_agrees_with_solving_each_row_alone(monkeypatch):
+    a = [0.5, 1, 3, 10, 100]
+    batch, converged, _ = solver.solve("x*math.exp(x) = a", params={"a": a})
+    assert converged.all()
+    for i, value in enumerate(a):
+        # Solved cold, not warm-started from the batch
+        monkeypatch.setattr(solver, "warm_starts", solver.WarmStarts())
+        alone, ok, _ = solver.solve("x*math.exp(x) = a", params={"a": value})
+        assert ok[0]
+        assert alone["x"][0] == pytest.approx(batch["x"][i], abs=1e-12)
+
+
+def test_systems_of_equations():
+    solutions, converged, _ = solver.solve(["x + y = 3", "x - y = 1"], ["x", "y"])
+    assert converged.all()
+    assert (solutions["x"][0], solutions["y"][0]) == pytest.approx((2, 1))
+    solutions, converged, _ = solver.solve(["x**2 + y**2 = r**2", "x = y"], ["x", "y"],
+                                           params={"r": [2, 4]})
+    assert converged.all()
+    assert np.allclose(solutions["x"], [math.sqrt(2), math.sqrt(8)])
+
+
+def test_no_root_does_not_converge():
+    _, converged, iterations = solver.solve("x**2 + 1")
+    assert not converged.any()
+    assert iterations <= solver.MAX_ITERATIONS
+
+
+def test_zero_derivative_at_the_start():
+    # The first row starts where the derivative vanishes
+    solutions, converged, _ = solver.solve("x**3 - 1", guess={"x": [0, 2]})
+    assert list(converged) == [False, True]
+    assert solutions["x"][1] == pytest.approx(1)
+
+
+def test_nan_rows_fail_alone():
+    solutions, converged, _ = solver.solve("sqrt(x) - 2", guess={"x": [-1, 1]})
+    assert list(converged) == [False, True]
+    assert solutions["x"][1] == pytest.approx(4)
+    solutions, converged, _ = solver.solve("x**2 = a", params={"a": [4, math.nan, 9]})
+    assert list(converged) == [True, False, True]
+    assert solutions["x"][[0, 2]] == pytest.approx([2, 3])
+
+
+def test_bracketed():
+    solutions, converged, _ = solver.solve("x**3 - x - 2", bracket=(1, 2))
+    assert converged.all()
+    assert solutions["x"][0] ** 3 - solutions["x"][0] - 2 == pytest.approx(0, abs=1e-12)
+    # No sign change across the bracket
+    solutions, converged, _ = solver.solve("x**2 + 1", bracket=(0, 2))
+    assert not converged.any()
+    assert np.isnan(solutions["x"]).all()
+
+
+def test_finite_differences_stand_in_for_missing_derivatives():
+    solutions, converged, _ = solver.solve("math.hypot(x, 3) = 5", guess={"x": 1})
+    assert converged.all()
+    assert solutions["x"][0] == pytest.approx(4)
+
+
+def test_large_batches_are_split(monkeypatch):
+    monkeypatch.setattr(solver, "CHUNK_ROWS", 3)
+    calls = []
+
+    def run_many(func, jobs):
+        calls.append(len(jobs))
+        return [func(*job) for job in jobs]
+    a = list(range(1, 11))
+    solutions, converged, _ = solver.solve("x**2 = a", params={"a": a}, run_many=run_many)
+    assert calls == [4]
+    assert converged.all()
+    assert np.allclose(solutions["x"], np.sqrt(a))
+
+
+@pytest.mark.parametrize("equations, unknowns, params", [
+    (["x + y = 1"], ["x", "y"], {}),
+    ("x = a", ["x"], {"a": [1, 2], "b": [1, 2, 3]}),
+    ("x = a", ["x"], {"a": ["one"]}),
+    ("x = a = b", ["x"], {}),
+    ("x = a", ["x"], {}),
+])
+def test_bad_requests_are_errors(equations, unknowns, params):
+    with pytest.raises(engine.ExpressionError):
+        solver.solve(equations, unknowns, params)
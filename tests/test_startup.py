@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import engine
+import wire
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _loaded_after(statement, modules):
+    """Which of `modules` a fresh interpreter has loaded after `statement`."""
+    code = f"import sys\n{statement}\nprint(' '.join(m for m in {modules!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True,
+                            text=True, check=True).stdout
+    return output.split()
+
+
+def test_web_modules_leave_numpy_for_the_first_array_request():
+    assert _loaded_after("import app, sampler, solver, wire", ["numpy"]) == []
+    assert _loaded_after("import sampler; sampler.Function('x**2')", ["numpy"]) == ["numpy"]
+    assert _loaded_after("import solver; solver.get_system(['x-1'], ['x'])", ["numpy"]) == ["numpy"]
+
+
+def test_desktop_startup_leaves_converter_and_history_modules():
+    pytest.importorskip("tkinter")
+    assert _loaded_after("import calc", ["numpy", "rates", "units", "history"]) == []
+
+
+def test_float64_without_numpy(monkeypatch):
+    expected = wire.float64([1.5, None, 2])
+    monkeypatch.setattr(engine, "_numpy_module", False)
+    assert engine.np is None
+    assert wire.float64([1.5, None, 2]) == expected
+    assert len(expected) == 24
@@ -0,0 +1,48 @@
+import io
+import json
+
+import admission
+import app as calc_app
+import stream
+
+
+def _lines(chunks):
+    return [json.loads(line) for chunk in chunks for line in chunk.decode().splitlines()]
+
+
+def test_records_from_bare_lines_and_json():
+    body = io.BytesIO(b'1+1\n\n{"id": "a", "expression": "x*2", "vars": {"x": 4}}\n{"nope": 1}\n{"id": 1\n')
+    records = list(stream.iter_records(body))
+    assert records[:2] == [(1, "1+1", None), ("a", "x*2", {"x": 4})]
+    assert [r[0] for r in records[2:]] == [4, 5]
+    assert all(isinstance(r[1], ValueError) for r in records[2:])
+
+
+def test_overlong_line_fails_alone(monkeypatch):
+    monkeypatch.setattr(stream, "MAX_LINE", 8)
+    records = list(stream.iter_records(io.BytesIO(b"1+1\n" + b"1+" * 20 + b"1\n2+2\n")))
+    assert records[0] == (1, "1+1", None)
+    assert isinstance(records[1][1], ValueError)
+    assert records[2] == (3, "2+2", None)
+
+
+def test_pipeline_results_and_errors():
+    body = io.BytesIO(b'6*7\n1/0\n1e308*10\n{"id": 9, "expression": "y+1", "vars": {"y": 1}}\n')
+    results = _lines(stream.evaluate_stream(body))
+    assert results == [{"id": 1, "result": 42}, {"id": 2, "error": "Invalid Expression"},
+                       {"id": 3, "error": "Invalid Result"}, {"id": 9, "result": 2}]
+
+
+def test_output_is_chunked(monkeypatch):
+    monkeypatch.setattr(stream, "FLUSH_LINES", 10)
+    chunks = list(stream.encode_ndjson({"id": i, "result": i} for i in range(25)))
+    assert len(chunks) == 3
+    assert [r["id"] for r in _lines(chunks)] == list(range(25))
+
+
+def test_route_streams_ndjson(monkeypatch):
+    monkeypatch.setattr(calc_app, "ADMISSION", admission.Admission(rate=0))
+    client = calc_app.app.test_client()
+    response = client.post("/api/calc/stream", data=b"1+2\nsqrt(-1)\n")
+    assert response.mimetype == "application/x-ndjson"
+    assert _lines([response.data]) == [{"id": 1, "result": 3}, {"id": 2, "error": "Invalid Expression"}]
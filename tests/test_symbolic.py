@@ -0,0 +1,99 @@
+import math
+
+import pytest
+
+import engine
+import sampler
+import symbolic
+
+np = engine.np
+needs_numpy = pytest.mark.skipif(np is None, reason="sampling needs NumPy")
+
+
+@pytest.mark.parametrize("text, expected", [
+    # sums, products, quotients and powers
+    ("3*x+2", "3"), ("x**2", "2*x"), ("x/2", "1/2"), ("1/x", "-1/x**2"), ("-x", "-1"),
+    ("sin(x)*x", "cos(x)*x + sin(x)"), ("2**x", "2**x*ln(2)"), ("x**x", "x**x*(ln(x) + x/x)"),
+    # functions, with the chain rule
+    ("cos(x)", "-sin(x)"), ("tan(x)", "1/cos(x)**2"), ("sqrt(x)", "1/(2*sqrt(x))"),
+    ("ln(x)", "1/x"), ("log(x)", "1/(x*ln(10))"), ("math.exp(2*x)", "2*math.exp(2*x)"),
+    ("x//2", "0"),
+])
+def test_rules(text, expected):
+    assert symbolic.differentiate(text) == expected
+
+
+@pytest.mark.parametrize("text, var, order, expected", [
+    ("x*0+5", "x", 1, "0"), ("x**3", "x", 2, "6*x"), ("x**3", "x", 3, "6"),
+    ("3*(2*x**2)", "x", 1, "12*x"), ("x/3", "x", 1, "1/3"), ("x*y", "y", 1, "x"), ("y**2", "x", 1, "0"),
+])
+def test_simplification(text, var, order, expected):
+    assert symbolic.differentiate(text, var, order) == expected
+
+
+@pytest.mark.parametrize("text", ["sin(x)*x**2", "ln(x)/x", "x**x", "sqrt(1+x**2)", "tan(x)-x%1.5"])
+def test_derivative_matches_a_finite_difference(text):
+    derivative = symbolic.differentiate(text)
+    for x in (0.3, 0.7, 1.2):
+        h = 1e-6
+        estimate = (engine.evaluate(text, {"x": x + h}) - engine.evaluate(text, {"x": x - h})) / (2 * h)
+        assert engine.evaluate(derivative, {"x": x}) == pytest.approx(estimate, rel=1e-5)
+
+
+def test_undifferentiable_functions_are_errors():
+    with pytest.raises(engine.ExpressionError):
+        symbolic.differentiate("abs(x)")
+    with pytest.raises(engine.ExpressionError):
+        symbolic.differentiate("math.hypot(x, 1)")
+
+
+@needs_numpy
+def test_function_is_nan_where_undefined():
+    xs = np.array([-1.0, 0.0, 4.0])
+    assert np.array_equal(sampler.Function("sqrt(x)")(xs), [math.nan, 0.0, 2.0], equal_nan=True)
+    assert np.isnan(sampler.Function("1/0")(xs)).all()
+    assert list(sampler.Function("5")(xs)) == [5.0] * 3
+    assert sampler.Function("x**3", order=2).text == "6*x"
+    with pytest.raises(engine.ExpressionError):
+        sampler.Function("x*y")
+    with pytest.raises(engine.ExpressionError):
+        sampler.Function("x", order=sampler.MAX_ORDER + 1)
+
+
+@needs_numpy
+def test_sampling_without_refinement_is_even():
+    xs, ys = sampler.sample(sampler.get_function("x**2"), -1, 1, 5, adaptive=False)
+    assert list(xs) == [-1, -0.5, 0, 0.5, 1]
+    assert list(ys) == [1, 0.25, 0, 0.25, 1]
+
+
+@needs_numpy
+def test_refinement_adds_points_where_the_curve_bends():
+    xs, ys = sampler.sample(sampler.get_function("2*x+1"), -1, 1, 11)
+    assert len(xs) == 11
+    xs, ys = sampler.sample(sampler.get_function("x**2"), -1, 1, 5)
+    assert 5 < len(xs) <= 20
+    assert (np.diff(xs) > 0).all()
+    assert np.allclose(ys, xs ** 2)
+
+
+@needs_numpy
+def test_refinement_respects_the_point_budget():
+    xs, _ = sampler.sample(sampler.get_function("sin(1/x)"), -1, 1, 50, max_points=120)
+    assert len(xs) == 120
+
+
+@needs_numpy
+def test_refinement_closes_in_on_domain_edges():
+    xs, ys = sampler.sample(sampler.get_function("sqrt(x)"), -1, 1, 11)
+    # Evenly spaced, the last undefined point is 0.2 from the edge at 0
+    assert -0.02 < xs[np.isnan(ys)].max() < 0
+    assert xs[~np.isnan(ys)].min() == 0
+
+
+@needs_numpy
+def test_sample_bytes_layout():
+    payload, count, text = sampler.sample_bytes("x**2", 0, 1, 3, order=1, adaptive=False)
+    assert (count, text) == (3, "2*x")
+    values = np.frombuffer(payload, dtype="<f8")
+    assert list(values) == [0, 0.5, 1, 0, 1, 2]
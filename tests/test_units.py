@@ -0,0 +1,63 @@
+from decimal import Decimal
+
+import pytest
+
+import app as calc_app
+import rates
+import units
+
+
+def test_factor_lookup():
+    registry = units.UnitRegistry()
+    assert registry.convert("length", 2, "km", "m") == 2000
+    assert registry.convert("Length", 1, "mi", "km") == pytest.approx(1.60934)
+    assert registry.convert("weight", 1, "kg", "g") == pytest.approx(1000)
+    with pytest.raises(ValueError):
+        registry.convert("length", 1, "km", "kg")
+    with pytest.raises(ValueError):
+        registry.convert("volume", 1, "l", "ml")
+
+
+def test_convert_many_marks_unparseable_values():
+    category = units.UnitRegistry().get("length")
+    assert category.convert_many([1, "2", "x", None], "km", "m") == [1000, 2000, None, None]
+
+
+def test_convert_exact_stays_decimal():
+    category = units.UnitRegistry().get("length")
+    assert category.convert_exact(Decimal("1"), "inch", "cm") == Decimal("2.54")
+
+
+def test_currency_follows_the_rate_table():
+    registry = units.UnitRegistry()
+    assert registry.get("currency") is None
+    assert registry.units("currency") == units.DEFAULT_CURRENCIES
+    registry.set_rates({"USD": 1, "EUR": 0.5, "GBP": 0.25})
+    assert registry.convert("currency", 10, "USD", "EUR") == 5
+    assert registry.convert("currency", 1, "GBP", "EUR") == 2
+
+
+class StubRates(rates.RateCache):
+    def _fetch(self, base):
+        self.fetch_count += 1
+        return {"base": base, "rates": {"USD": 1, "EUR": 0.5}}
+
+
+def test_cold_server_converts_currency(monkeypatch):
+    registry = units.UnitRegistry()
+    cache = StubRates()
+    registry.track(cache)
+    monkeypatch.setattr(units, "registry", registry)
+    monkeypatch.setattr(calc_app, "RATE_CACHE", cache)
+    client = calc_app.app.test_client()
+    response = client.post("/api/convert", json={"category": "currency", "from": "USD", "to": "EUR",
+                                                 "values": [2, "x"]})
+    assert response.status_code == 200
+    assert response.json == {"result": [1, None]}
+    assert cache.fetch_count == 1
+
+
+def test_unknown_category_is_400():
+    client = calc_app.app.test_client()
+    response = client.post("/api/convert", json={"category": "volume", "from": "l", "to": "ml"})
+    assert response.status_code == 400
@@ -0,0 +1,143 @@
+"""
+Unit registry shared by the desktop converter and the web app.
+
+Each category keeps its units, their factors to the category's base unit and
+a precomputed pairwise factor matrix, so a from->to lookup is a single index.
+Currency is rebuilt from the rate cache whenever rates refresh.
+"""
+import threading
+from decimal import Decimal
+from fractions import Fraction
+
+# NumPy is imported by the first bulk conversion, not at startup
+_numpy_module = None
+
+
+def _numpy():
+    global _numpy_module
+    if _numpy_module is None:
+        try:
+            import numpy
+        except ImportError:  # Bulk conversion falls back to a list comprehension
+            numpy = False
+        _numpy_module = numpy
+    return _numpy_module or None
+
+# Factor to the base unit of each category (m, kg)
+UNIT_FACTORS = {
+    "length": {"m": 1, "km": 1000, "ft": 0.3048, "mi": 1609.34, "cm": 0.01, "inch": 0.0254},
+    "weight": {"kg": 1, "g": 0.001, "lb": 0.453592, "oz": 0.0283495},
+}
+
+# Shown before live rates are available
+DEFAULT_CURRENCIES = ["USD", "EUR", "GBP", "JPY", "INR"]
+
+
+class Category:
+    def __init__(self, name, factors):
+        self.name = name
+        self.units = list(factors)
+        self.index = {unit: i for i, unit in enumerate(self.units)}
+        self.to_base = [float(factors[unit]) for unit in self.units]
+        # Exact factors for the decimal path (currency formatting)
+        self.exact = [_to_fraction(factors[unit]) for unit in self.units]
+        # matrix[i][j] converts a value in units[i] to units[j]
+        self.matrix = [[f / t for t in self.to_base] for f in self.to_base]
+
+    def factor(self, u_from, u_to):
+        try:
+            return float(self.matrix[self.index[u_from]][self.index[u_to]])
+        except KeyError:
+            raise ValueError(f"Unknown unit for {self.name}: {u_from!r} -> {u_to!r}") from None
+
+    def convert(self, value, u_from, u_to):
+        return value * self.factor(u_from, u_to)
+
+    def convert_exact(self, value, u_from, u_to):
+        """Convert a Decimal without going through binary floats."""
+        try:
+            ratio = self.exact[self.index[u_from]] / self.exact[self.index[u_to]]
+        except KeyError:
+            raise ValueError(f"Unknown unit for {self.name}: {u_from!r} -> {u_to!r}") from None
+        return Decimal(value) * ratio.numerator / ratio.denominator
+
+    def convert_many(self, values, u_from, u_to):
+        """Convert a sequence in one pass. Non-numeric entries become None."""
+        factor = self.factor(u_from, u_to)
+        np = _numpy()
+        if np is not None:
+            try:
+                array = np.asarray(values, dtype=np.float64) * factor
+            except (TypeError, ValueError):
+                array = np.array([_to_float(v) for v in values], dtype=np.float64) * factor
+            result = array.tolist()
+            for i in np.flatnonzero(~np.isfinite(array)).tolist():
+                result[i] = None
+            return result
+        result = []
+        for value in values:
+            value = _to_float(value) * factor
+            result.append(value if value == value else None)
+        return result
+
+
+def _to_fraction(value):
+    if isinstance(value, float):
+        return Fraction(repr(value))
+    return Fraction(value)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class UnitRegistry:
+    def __init__(self, factors=UNIT_FACTORS):
+        self._categories = {name: Category(name, table) for name, table in factors.items()}
+        self._lock = threading.Lock()
+
+    def categories(self):
+        return list(self._categories)
+
+    def get(self, name):
+        """Category by (case-insensitive) name, or None if not loaded."""
+        return self._categories.get(name.lower())
+
+    def units(self, name):
+        category = self.get(name)
+        if category is not None:
+            return category.units
+        return DEFAULT_CURRENCIES if name.lower() == "currency" else []
+
+    def convert(self, name, value, u_from, u_to):
+        category = self.get(name)
+        if category is None:
+            raise ValueError(f"Unknown or unloaded category {name!r}")
+        return category.convert(value, u_from, u_to)
+
+    def set_rates(self, rates):
+        """Rebase the currency matrix on a rates table (units per USD)."""
+        currency = Category("currency", {code: 1 / _to_fraction(rate) for code, rate in rates.items() if rate})
+        with self._lock:
+            self._categories = dict(self._categories, currency=currency)
+
+    def track(self, rate_cache, base="USD"):
+        """Rebuild currency every time `rate_cache` refreshes `base`."""
+        def on_refresh(refreshed, snapshot):
+            if refreshed == base:
+                self.set_rates(snapshot.rates)
+        rate_cache.subscribe(on_refresh)
+        snapshot = rate_cache.peek(base)
+        if snapshot is not None:
+            self.set_rates(snapshot.rates)
+
+    def to_dict(self):
+        """Units and base factors per category, for clients that convert locally."""
+        return {name: {"units": c.units, "factors": dict(zip(c.units, c.to_base))}
+                for name, c in self._categories.items()}
+
+
+registry = UnitRegistry()
@@ -0,0 +1,90 @@
+"""
+Response encodings for the web API, picked from the request's Accept header.
+
+    application/json            the default
+    application/msgpack         the same structure as the JSON, if msgpack is installed;
+                                ints wider than 64 bits are sent as strings
+    application/octet-stream    numeric results only: little-endian float64,
+                                one per result, NaN where a row failed
+"""
+import array
+import json
+import math
+import sys
+
+import engine
+
+try:
+    import msgpack
+except ImportError:  # MessagePack is optional
+    msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+FLOAT64 = "application/octet-stream"
+
+
+def formats(numeric=False):
+    """Encodings on offer, JSON first so */* and a missing header get JSON."""
+    offered = [JSON]
+    if msgpack is not None:
+        offered.append(MSGPACK)
+    if numeric:
+        offered.append(FLOAT64)
+    return offered
+
+
+def negotiate(accept, numeric=False):
+    """Best format for a werkzeug Accept header; `numeric` offers FLOAT64."""
+    return accept.best_match(formats(numeric), default=JSON)
+
+
+def dumps(payload, fmt):
+    """payload encoded as JSON or MessagePack bytes."""
+    if fmt == MSGPACK:
+        try:
+            return msgpack.packb(payload)
+        except OverflowError:
+            return msgpack.packb(_packable(payload))
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def _packable(value):
+    # MessagePack ints stop at 64 bits; wider ones go as decimal strings,
+    # the way decimal and rational results already do
+    if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 64:
+        return str(value)
+    if isinstance(value, dict):
+        return {key: _packable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_packable(item) for item in value]
+    return value
+
+
+def float64(values):
+    """
+    Little-endian float64 bytes for a float64 array (copied once, as is) or
+    a list of numbers with None for failures.
+    """
+    # Without NumPy, float arrays are built with the array module instead
+    np = engine.np
+    if np is not None:
+        if not isinstance(values, np.ndarray):
+            values = np.array([_float(v) for v in values], dtype=np.float64)
+        if sys.byteorder != "little":
+            values = values.astype("<f8")
+        return values.tobytes()
+    packed = array.array("d", (_float(v) for v in values))
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _float(value):
+    if value is None:
+        return math.nan
+    try:
+        return float(value)
+    except OverflowError:
+        # An exact int too large for a double
+        return math.inf if value > 0 else -math.inf